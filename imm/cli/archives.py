@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Archive inputs
+
+An --input root may be a zip or tar archive rather than a directory; its
+members are then processed as the files of a directory would be, without the
+archive ever being extracted to disk. A member's path relative to the archive
+is its relpath, so it maps to an image name (and to packages with --layout)
+exactly as the same file below an --input directory would.
+
+    zip - the central directory lists the members, which are visited in name
+          order like the entries of a directory; each one is read on its own
+          when needed, by seeking to it in the archive.
+    tar - a tar archive (compressed or not) has no index, so it is streamed
+          once from start to end and the members are visited in archive order;
+          the bytes of a member are read as it streams by and handed down the
+          build pipeline, which releases them once the member is read.
+
+Members are passed around as ArchiveMember objects, strings of the form
+'<archive path>/<member name>' that know how to open themselves; openFile()
+opens either kind of path.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os
+import threading
+import tarfile
+import zipfile
+
+from io import BytesIO
+
+#-------------------------------------------------------------------------------
+# Each thread keeps its own zipfile.ZipFile of every zip archive it opened, so
+# the central directory is read once per thread rather than once per member;
+# it is opened again once the archive file changed
+_local = threading.local()
+
+#-------------------------------------------------------------------------------
+class ArchiveMember(str):
+    """
+    The path of a member of an archive, the string '<archive>/<name>'.
+
+    archive - the path of the archive file
+    name    - the member's name in the archive
+    stamp   - the tuple (version, size) telling whether the member changed,
+              as pipeline.fileStamp() does for a file
+    data    - the bytes of a tar member, None once released or for a zip member
+    """
+    def __new__(cls, archive, name, stamp, data=None):
+        self = super().__new__(cls, archive + '/' + (memberName(name) or name))
+        self.archive = archive
+        self.name = name
+        self.stamp = stamp
+        self.data = data
+        return self
+
+
+    def open(self):
+        """
+        Returns a binary file object reading the member.
+        """
+        if self.data is not None:
+            return BytesIO(self.data)
+        return _zipFile(self.archive).open(self.name)
+
+
+    def release(self):
+        """
+        Forget the bytes of a tar member, once they were read for the last time.
+        """
+        self.data = None
+
+
+#-------------------------------------------------------------------------------
+def _zipFile(path):
+    zips = getattr(_local, 'zips', None)
+    if zips is None:
+        zips = _local.zips = dict()
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = zips.get(path)
+    if cached is None or cached[0] != stamp:
+        if cached is not None:
+            cached[1].close()
+        cached = zips[path] = (stamp, zipfile.ZipFile(path))
+    return cached[1]
+
+
+#-------------------------------------------------------------------------------
+def isArchive(path):
+    """
+    Returns True if the file path is a zip or a tar archive, going by its
+    content rather than its name.
+    """
+    if not os.path.isfile(path):
+        return False
+    return zipfile.is_zipfile(path) or tarfile.is_tarfile(path)
+
+
+#-------------------------------------------------------------------------------
+def isTarArchive(path):
+    """
+    Returns True if the file path is a tar archive, whose members can only be
+    read as it is streamed, see scanArchive().
+    """
+    return os.path.isfile(path) and not zipfile.is_zipfile(path) and tarfile.is_tarfile(path)
+
+
+#-------------------------------------------------------------------------------
+def openFile(path):
+    """
+    Returns a binary file object reading path, a file or an ArchiveMember.
+    """
+    if isinstance(path, ArchiveMember):
+        return path.open()
+    return open(path, 'rb')
+
+
+#-------------------------------------------------------------------------------
+def memberName(name):
+    """
+    Returns the relpath of the archive member name, or None for a name that
+    does not stay inside the archive (an absolute name, or one with '..').
+    """
+    name = name.replace('\\', '/').lstrip('/')
+    parts = name.split('/')
+    if not name or '..' in parts:
+        return None
+    return '/'.join(part for part in parts if part not in ('', '.'))
+
+
+#-------------------------------------------------------------------------------
+def scanArchive(path, accept=None, data=True):
+    """
+    Yields the tuple (relpath, member) for each regular file member of the
+    archive path whose relpath accept(relpath) returns True for (every member
+    if accept is None), member being an ArchiveMember.
+
+    If data is False, only the members and their stamps are listed: the bytes
+    of tar members are skipped rather than read, so they cannot be opened.
+    """
+    if zipfile.is_zipfile(path):
+        archive = _zipFile(path)
+        members = list()
+        for info in archive.infolist():
+            relpath = memberName(info.filename)
+            if info.is_dir() or relpath is None:
+                continue
+            members.append((relpath, info))
+
+        for (relpath, info) in sorted(members, key=lambda member: member[0]):
+            if accept is None or accept(relpath):
+                yield (relpath, ArchiveMember(path, info.filename, (info.CRC, info.file_size)))
+        return
+
+    # Listing opens the archive for random access, seeking over the members'
+    # bytes where it is not compressed
+    with tarfile.open(path, mode='r|*' if data else 'r:*') as archive:
+        for info in archive:
+            relpath = memberName(info.name)
+            if not info.isfile() or relpath is None:
+                continue
+            if accept is not None and not accept(relpath):
+                continue
+            stamp = (int(info.mtime * 1e9), info.size)
+            if not data:
+                yield (relpath, ArchiveMember(path, info.name, stamp))
+                continue
+            yield (relpath, ArchiveMember(path, info.name, stamp, archive.extractfile(info).read()))
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
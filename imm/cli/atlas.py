@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Sprite atlas packing
+
+Packs many small images into a few large atlas images so that an application
+decodes one PNG per atlas rather than one per image, then crops each image
+out of its decoded atlas.
+
+The rectangles are placed with the skyline bottom-left algorithm: the top
+edge of the packed area is kept as a list of horizontal segments (the
+skyline) and each rectangle goes where its top ends up lowest, the narrowest
+segment winning a tie. Rectangles are packed tallest first, so images of a
+similar size end up side by side on the same rows. Each rectangle is tried
+in every atlas opened so far before a new atlas is opened.
+
+See: Jukka Jylanki, "A Thousand Ways to Pack the Bin" (2010).
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+# Width and height of an atlas, unless an image is larger
+DEFAULT_SIZE = 1024
+
+# Transparent pixels left between two images so that a scaled or filtered
+# crop of one does not bleed into its neighbour
+PADDING = 1
+
+#-------------------------------------------------------------------------------
+class Skyline():
+    """
+    The skyline of one atlas of width x height pixels.
+    """
+    def __init__(self, width, height):
+        self._width = width
+        self._height = height
+        self._segments = [ [0, 0, width] ]   # [x, y, width] from left to right
+        self.used_width = 0
+        self.used_height = 0
+
+
+    def _fit(self, i, w, h):
+        """
+        Returns the y at which a w x h rectangle with its left edge at segment i
+        rests on the skyline, or None if it does not fit there.
+        """
+        x = self._segments[i][0]
+        if x + w > self._width:
+            return None
+
+        y = 0
+        remaining = w
+        while remaining > 0:
+            y = max(y, self._segments[i][1])
+            if y + h > self._height:
+                return None
+            remaining -= self._segments[i][2]
+            i += 1
+        return y
+
+
+    def insert(self, w, h):
+        """
+        Place a w x h rectangle, returning its (x, y) or None if it does not fit.
+        """
+        best = None
+        for i in range(len(self._segments)):
+            y = self._fit(i, w, h)
+            if y is not None:
+                key = (y + h, self._segments[i][2])
+                if best is None or key < best[0]:
+                    best = (key, i, self._segments[i][0], y)
+
+        if best is None:
+            return None
+
+        (key, i, x, y) = best
+        self._segments.insert(i, [x, y + h, w])
+
+        # Shorten or drop the segments now under the new one
+        j = i + 1
+        while j < len(self._segments):
+            segment = self._segments[j]
+            overlap = x + w - segment[0]
+            if overlap <= 0:
+                break
+            if overlap < segment[2]:
+                segment[0] += overlap
+                segment[2] -= overlap
+                break
+            del self._segments[j]
+
+        # Merge neighbouring segments of the same height
+        j = 0
+        while j < len(self._segments) - 1:
+            if self._segments[j][1] == self._segments[j+1][1]:
+                self._segments[j][2] += self._segments[j+1][2]
+                del self._segments[j+1]
+            else:
+                j += 1
+
+        self.used_width = max(self.used_width, x + w)
+        self.used_height = max(self.used_height, y + h)
+
+        return (x, y)
+
+
+#-------------------------------------------------------------------------------
+def pack(sizes, size=DEFAULT_SIZE, padding=PADDING):
+    """
+    Packs the rectangles of the dictionary sizes, name -> (w, h), into atlases
+    of at most size x size pixels. An image larger than that gets an atlas of
+    its own.
+
+    Returns the tuple (atlases, placements) where atlases is a list of the
+    (width, height) of each atlas, cropped to the area used, and placements
+    maps each name to (atlas, x, y, w, h), atlas being an index in atlases.
+    """
+    skylines = list()
+    placements = dict()
+
+    # Tallest first, then widest; the name keeps the order reproducible
+    order = sorted(sizes, key=lambda name: (-sizes[name][1], -sizes[name][0], name))
+
+    for name in order:
+        (w, h) = sizes[name]
+        (pw, ph) = (w + padding, h + padding)
+
+        if pw > size or ph > size:
+            skyline = Skyline(pw, ph)
+            skylines.append(skyline)
+            (x, y) = skyline.insert(pw, ph)
+            placements[name] = (len(skylines) - 1, x, y, w, h)
+            continue
+
+        for (index, skyline) in enumerate(skylines):
+            position = skyline.insert(pw, ph)
+            if position is not None:
+                break
+        else:
+            skyline = Skyline(size, size)
+            skylines.append(skyline)
+            index = len(skylines) - 1
+            position = skyline.insert(pw, ph)
+
+        placements[name] = (index, position[0], position[1], w, h)
+
+    # The padding after the last image of a row or column is not needed
+    atlases = [ (max(s.used_width - padding, 1), max(s.used_height - padding, 1)) for s in skylines ]
+
+    return (atlases, placements)
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
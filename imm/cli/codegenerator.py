@@ -20,8 +20,11 @@ import os.path
 import platform
 import logging
 import getpass
+import shutil
 import datetime as dt
 
+from io import BytesIO
+
 from pprint import pformat
 
 #-------------------------------------------------------------------------------
@@ -29,7 +32,11 @@ from PIL import Image, ImageTk
 
 #-------------------------------------------------------------------------------
 from imm.cli import constants as C
+from imm.cli import workers
+from imm.cli import atlas
+from imm.cli import outputs as OU
 from imm import imagedata as GID
+from imm import imagecodecs
 #-------------------------------------------------------------------------------
 PYTHON_SPEC = "/usr/bin/env python"
 
@@ -43,19 +50,290 @@ MAIN_EMPTY_TEMPLATE = """if __name__ == "__main__":
 
 META_DATA_MODULE_FILE = "image_meta_data.py"
 
+PACKAGE_INIT_FILE = "__init__.py"
+
+# A new MODULE, or package, is generated as this hidden file, or directory,
+# and renamed once the build succeeds; see CodeGen.genCommit()
+STAGING_TEMPLATE = ".%s.%d.tmp"
+SHARD_MODULE_PREFIX = "_shard"
+SHARD_MODULE_TEMPLATE = SHARD_MODULE_PREFIX + "%04d"
+
+# The __init__ module of a --split package. The image data variables are
+# looked up in _SHARDS and their shard module imported on first access, see
+# PEP 562 -- Module __getattr__ and __dir__.
+PACKAGE_INDEX_TEMPLATE = """import importlib as _importlib
+
+# image data variable name -> shard module defining it
+_SHARDS = \\
+%s
+
+def __getattr__(name):
+    '''Import the shard module defining name the first time name is used.'''
+    try:
+        shard = _SHARDS[name]
+    except KeyError:
+        raise AttributeError("module %%r has no attribute %%r" %% (__name__, name)) from None
+    value = getattr(_importlib.import_module('.' + shard, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_SHARDS))
+"""
+
+# --layout values
+LAYOUT_MODULE    = 'module'     # one MODULE (or a --split package) holding every image
+LAYOUT_DIRECTORY = 'directory'  # a package per input directory holding that directory's images
+LAYOUT_IMAGE     = 'image'      # a package per input directory and a module per image
+
+LAYOUTS = (LAYOUT_MODULE, LAYOUT_DIRECTORY, LAYOUT_IMAGE)
+
+# Appended to the __init__ module of every package of a --layout directory or
+# image package tree; sub-packages and image modules are imported on first use.
+TREE_INDEX_TEMPLATE = """
+import importlib as _importlib
+
+# sub-packages and image modules imported the first time they are used
+_SUBMODULES = \\
+%s
+
+def __getattr__(name):
+    '''Import the sub-package or image module name the first time name is used.'''
+    if name not in _SUBMODULES:
+        raise AttributeError("module %%r has no attribute %%r" %% (__name__, name))
+    return _importlib.import_module('.' + name, __name__)
+
+def __dir__():
+    return sorted(set(globals()) | set(_SUBMODULES))
+"""
+
+ATLAS_VAR_TEMPLATE = "atlas%04d"
+
+# Follows the atlas image data in a MODULE generated with --atlas. PIL and
+# tkinter are imported only by the accessor that needs them.
+ATLAS_ACCESSOR_TEMPLATE = """
+ATLASES = (%s)
+
+# image name -> (atlas, x, y, width, height, mode of the image file)
+ATLAS_INDEX = \\
+%s
+
+_decoded_atlases = dict()
+
+def get_image(name):
+    '''Returns the PIL image of name, cropped from its atlas which is decoded
+    once, in the mode of its image file; a palette image gets a palette of
+    its own colors.'''
+    from io import BytesIO
+    from PIL import Image
+    (atlas, x, y, w, h, mode) = ATLAS_INDEX[name]
+    if atlas not in _decoded_atlases:
+        _decoded_atlases[atlas] = Image.open(BytesIO(ATLASES[atlas]))
+        _decoded_atlases[atlas].load()
+    image = _decoded_atlases[atlas].crop((x, y, x + w, y + h))
+    if mode == 'P':
+        return image.convert('RGB').convert('P', palette=Image.ADAPTIVE)
+    if mode != image.mode:
+        return image.convert(mode)
+    return image
+
+_photo_atlases = dict()
+
+def get_photo_image(name):
+    '''Returns a tkinter.PhotoImage of name, copied from its atlas which is decoded once.
+    A Tk root window must exist.'''
+    import tkinter
+    (atlas, x, y, w, h, mode) = ATLAS_INDEX[name]
+    if atlas not in _photo_atlases:
+        _photo_atlases[atlas] = tkinter.PhotoImage(data=ATLASES[atlas])
+    image = tkinter.PhotoImage(width=w, height=h)
+    image.tk.call(image, 'copy', _photo_atlases[atlas], '-from', x, y, x + w, y + h)
+    return image
+"""
+
+# Follows the image data in a MODULE generated with --variant
+VARIANT_INDEX_TEMPLATE = """
+# image name -> ((width, height, image data), ...) of the image and its
+# variants from the smallest to the largest
+VARIANTS = \\
+%s
+
+def get_variant(name, size):
+    '''Returns the image data of the variant of name (or name itself) whose
+    longest side is nearest to size, the larger one on a tie.'''
+    return min(VARIANTS[name], key=lambda v: (abs(max(v[0], v[1]) - size), -max(v[0], v[1])))[2]
+"""
+
+# Follows the image data in a MODULE generated with a --codec other than png
+CODEC_INDEX_TEMPLATE = """
+# image name -> codec its image data is encoded with
+IMAGE_CODECS = \\
+%s
+
+def get_image(name):
+    '''Returns the PIL image decoded from the image data of name.'''
+    import struct
+    from io import BytesIO
+    from PIL import Image
+    data = globals()[name + '_data']
+    if IMAGE_CODECS[name] != 'raw':
+        return Image.open(BytesIO(data))
+    # IMMRAW, length of mode, mode, width, height then the pixel data
+    length = data[6]
+    (mode, width, height) = struct.unpack_from('>%%dsII' %% length, data, 7)
+    return Image.frombytes(mode.decode('ascii'), (width, height), data[15 + length:])
+"""
+
+# Follows the image data in a MODULE generated with --frames
+FRAME_INDEX_TEMPLATE = """
+# image name -> ((image data, offset ms, duration ms, width, height), ...) of
+# each of its frames; image data is None for the frames of an animation
+# re-encoded as a whole in <image name>_data
+FRAMES = \\
+%s
+"""
+
+# The image meta-data module generated for --show and --metadata holds one
+# column per field and one row per image rather than a dictionary per image,
+# so it imports fast and small; IMG_META_DATA still maps each image name to
+# a dictionary-like view of its row
+META_DATA_TEMPLATE = """
+import array as _array
+from collections.abc import Mapping as _Mapping, MutableMapping as _MutableMapping
+
+LARGEST_WIDTH = %d
+UNIFORM_WIDTH = %r
+
+# The image names, in the order the images were processed
+NAMES = (
+%s)
+
+# field -> the value of every image in NAMES order, None where an image has
+# no such field
+COLUMNS = {
+%s}
+
+class ImageMetaData(_MutableMapping):
+    '''The meta-data of one image, a view of its row of COLUMNS. Other keys
+    may be set, as the show module sets 'row', 'col' and 'imagecount'.'''
+    __slots__ = ('_row', '_extra')
+
+    def __init__(self, row):
+        self._row = row
+        self._extra = None
+
+    def __getitem__(self, key):
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        if key == 'largest_width':
+            return LARGEST_WIDTH
+        if key == 'uniform_width':
+            return UNIFORM_WIDTH
+        value = COLUMNS[key][self._row]
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if self._extra is None:
+            self._extra = dict()
+        self._extra[key] = value
+
+    def __delitem__(self, key):
+        if self._extra is None:
+            raise KeyError(key)
+        del self._extra[key]
+
+    def __iter__(self):
+        keys = [ key for (key, column) in COLUMNS.items() if column[self._row] is not None ]
+        keys += [ 'largest_width', 'uniform_width' ]
+        keys += [ key for key in (self._extra or ()) if key not in keys ]
+        return iter(keys)
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+class ImageMetaDataTable(_Mapping):
+    '''IMG_META_DATA, image name -> its ImageMetaData. The index of the rows
+    and the views are only made when first looked up.'''
+    __slots__ = ('_rows', '_views')
+
+    def __init__(self):
+        self._rows = None
+        self._views = dict()
+
+    def __getitem__(self, name):
+        view = self._views.get(name)
+        if view is None:
+            if self._rows is None:
+                self._rows = dict(zip(NAMES, range(len(NAMES))))
+            view = self._views[name] = ImageMetaData(self._rows[name])
+        return view
+
+    def __iter__(self):
+        return iter(NAMES)
+
+    def __len__(self):
+        return len(NAMES)
+
+IMG_META_DATA = ImageMetaDataTable()
+
+"""
+
+# Values written per line of a column of the image meta-data module
+META_DATA_VALUES_PER_LINE = 16
+
+# Every generated module starts with this, see CodeGen._genRuntimeIdentStr()
+GENERATED_IDENT = "# This module was auto-generated..."
+
+
+#-------------------------------------------------------------------------------
+def isGeneratedModule(path):
+    """
+    Returns True if the Python module file at path was generated by CodeGen.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(1024)
+    return GENERATED_IDENT.encode('ascii') in head
+
+
+#-------------------------------------------------------------------------------
+def removeGeneratedPackage(package_path, logger):
+    """
+    Remove the modules generated below the package directory package_path by
+    an earlier run, then every directory left empty. Files that were not
+    generated are left alone.
+    """
+    for (dirpath, dirnames, filenames) in os.walk(package_path, topdown=False):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if filename.endswith('.py') and isGeneratedModule(path):
+                logger.warning("Removing a previously generated Image Data Package File: '%s'" % path)
+                os.remove(path)
+        for dirname in dirnames:
+            if dirname == '__pycache__':
+                shutil.rmtree(os.path.join(dirpath, dirname))
+        if not os.listdir(dirpath):
+            os.rmdir(dirpath)
+
 
 #-------------------------------------------------------------------------------
 class CodeGen():
     """
     logger - a logging module logger object created by the caller
 
-    This code generator supports:
+    This code generator supports (see --layout):
         - generating a single Python module with multiple image data references
+          (or a --split package of shard modules)
      or
-        - generating multiple Python modules each containing a single image data reference.
-
-    If module_name is None, then we are generating multiple Python modules;
-    otherwise, we are generating a single Python module.
+        - generating a package per input directory, each containing the image
+          data references of the images in that directory
+     or
+        - generating a package per input directory and multiple Python modules
+          each containing a single image data reference.
 
     caller_version - the version of the caller used to write a header in generated code
 
@@ -85,7 +363,7 @@ class CodeGen():
         self._show = self._args.show
 
         self._largest_width = 0
-        self._uniform_width = None  # Set this to True or False
+        self._largest_count = 0     # the images as wide as the largest
 
         if self._args.append:
             # Appending to an EXISTING MODULE
@@ -97,11 +375,51 @@ class CodeGen():
             self._write_mode = "wb"
 
         self._module_fp = None
+        # A new MODULE, or package, is written to this temporary file, or
+        # directory, which replaces it once the build succeeds, see genCommit()
+        self._staging_path = None
         self._CurrentImageName = None
         self._CurrentImagePath = None
 
-        self._imageMetaData = dict()
-
+        # The image meta-data as columns, see addMetaData()
+        self._metaNames = list()
+        self._metaColumns = dict()
+
+        # The files the images written came from, in order, see Inputs
+        self._inputs = dict()
+
+        # --split BYTES generates a package of shard modules of at most BYTES
+        # each rather than a single module
+        self._split = self._args.split
+        self._shard_count = 0
+        self._shard_bytes = 0
+        self._shard_header_bytes = 0
+        self._shard_index = dict()
+        self._shard_name = None  # the shard module currently open
+
+        # --layout directory|image generates a package tree mirroring the
+        # input directories
+        self._layout = self._args.layout
+        self._tree_package = None   # the package whose module is currently open
+        self._tree_children = dict() # package -> names of its sub-packages and image modules
+        self._tree_started = set()   # packages whose __init__ module has been started
+
+        # --atlas SIZE packs the images into atlas images of SIZE x SIZE
+        # pixels, written by genAtlases() once every image has been processed
+        self._atlas = self._args.atlas
+        self._atlas_images = list()
+
+        # --variant NAME=SIZE writes resized variants after each image, see
+        # genVariantIndex()
+        self._variants = dict()
+
+        # --frames writes the frames of multi-frame images after each image,
+        # see genFrameIndex()
+        self._frames = dict()
+
+        # --css and --contact-sheet collect the data made for them from each
+        # image, see genOutputs()
+        self._outputs = OU.makeWriters(self._args)
 
         self.genOpenModule()
 
@@ -127,62 +445,304 @@ class CodeGen():
         return ident
 
 
-    def processImage(self, image_name, image_file_path, image_type):
+    def processImage(self, image_name, image_file_path, image_type, encoded=None, package=()):
         """
         Makes sure image name is unique and not been used before. The image name
         is used as the image data reference in the generated source file.
 
-        Reads the image data from the image_file_path.
+        Reads the image data from the image_file_path, unless encoded is the
+        (image_data, meta_data) tuple already returned for it by workers.encodeImage().
+
+        package is the tuple of the package names the image belongs to below
+        MODULE, one per sub-directory, used by --layout directory and image.
         """
         self._logr.info("Processing image '%s'.\n" % image_name)
 
         self._CurrentImageName = image_name.lower()
         self._CurrentImageType = image_type.lower()
         self._CurrentImagePath = image_file_path
+        self._inputs[getattr(image_file_path, 'archive', image_file_path)] = None
 
-        ####################### Using IMM Library ###########################
-        with GID.Generator(self._module_fp, self._write_mode) as gfxModule:
-            # image_file_path will be changed if the original image_file_path
-            # input is not a png file
-            gfxModule.write(image_file_path, image_name)
-        #####################################################################
+        if encoded is None:
+            encoded = workers.encodeImage(image_file_path, outputs=OU.outputSettings(self._args))
+
+        (self._CurrentImageData, meta_data) = encoded
+
+        if self._atlas:
+            self._atlas_images.append((self._CurrentImageName, self._CurrentImageData))
+        elif self._layout == LAYOUT_MODULE:
+            self.genImageData()
+        else:
+            self.genTreeImageData(package)
+
+        if 'Variants' in meta_data:
+            self.genVariantData(meta_data['Variants'], meta_data['Width'], meta_data['Height'])
 
-        img = Image.open(image_file_path)
+        if 'Frames' in meta_data:
+            self.genFrameData(meta_data['Frames'], meta_data.get('FrameData'))
 
         # populate image info dictionary to be returned
-        (w, h) = img.size
+        (w, h) = (meta_data['Width'], meta_data['Height'])
 
         if w > self._largest_width:
             self._largest_width = w
+            self._largest_count = 0
+        if w == self._largest_width:
+            self._largest_count += 1
 
         self._logr.info(" %s Size -- Width: %d  Height: %d"  % (image_type, w, h))
 
-        self._imageMetaData[self._CurrentImageName] = {
+        fields = {
             'FilePath' : self._CurrentImagePath,
             'ImgType'  : self._CurrentImageType,
             'Width'    : w,
             'Height'   : h,
+            'Codec'    : meta_data.get('Codec', imagecodecs.DEFAULT_CODEC),
         }
 
+        if 'Frames' in meta_data:
+            fields['Frames'] = len(meta_data['Frames'])
+
+        # --stats AverageColor, AlphaCoverage, BBox and IsDark
+        fields.update(meta_data.get('Stats', dict()))
+
+        self.addMetaData(self._CurrentImageName, fields)
+
+        rendered = meta_data.get('Outputs', dict())
+        for writer in self._outputs:
+            if writer.OUTPUT in rendered:
+                writer.add(self._CurrentImageName, package, w, h, rendered[writer.OUTPUT])
+            else:
+                self._logr.warning("The image '%s' was encoded without its --%s data and is left out of '%s'" %
+                                   (self._CurrentImageName, writer.OUTPUT, writer.Path))
+
         self._logr.info("Read image data from file '%s'" % image_file_path)
 
 
+    def addMetaData(self, image_name, fields):
+        """
+        Add the row of image_name to the image meta-data columns, fields being
+        the dictionary of its meta-data. A field first seen now is None for
+        the images before, a field missing now is None for this one.
+        """
+        row = len(self._metaNames)
+        self._metaNames.append(image_name)
+        for (field, value) in fields.items():
+            if field not in self._metaColumns:
+                self._metaColumns[field] = [ None ] * row
+            self._metaColumns[field].append(value)
+        for column in self._metaColumns.values():
+            if len(column) == row:
+                column.append(None)
+
+
+    @property
+    def Inputs(self):
+        """
+        The list of the files the images written so far were read from; for
+        an archive member, the archive.
+        """
+        return list(self._inputs)
+
+
+    @property
+    def Outputs(self):
+        """
+        The list of the files generated: MODULE, or every module of the MODULE
+        package with --split or --layout, and the --css and --contact-sheet.
+        """
+        outputs = list()
+        if self._split or self._layout != LAYOUT_MODULE:
+            for (dirpath, dirnames, filenames) in os.walk(self._package_abs_path):
+                dirnames.sort()
+                outputs.extend(os.path.join(dirpath, name) for name in sorted(filenames) if name.endswith('.py'))
+        else:
+            outputs.append(os.path.join(self._module_path, self._module_name+'.py'))
+        return outputs + [ writer.Path for writer in self._outputs ]
+
+
     @property
     def CurrentImageName(self):
         return self._CurrentImageName
 
 
     def genOpenModule(self):
+        if self._split:
+            self.genOpenPackage()
+            return
+
+        if self._layout != LAYOUT_MODULE:
+            self.genOpenTree()
+            return
+
+        if self._module_path == C.STDOUT:
+            # Streamed, there is nothing to remove before or after
+            self._module_abs_path = '<stdout>'
+            self._logr.info("Writing the Image Data Module to stdout")
+            sys.stdout.flush()
+            self._module_fp = open(sys.stdout.fileno(), "wb", closefd=False)
+            self._module_start = 0
+            return
+
         self._module_abs_path = os.path.join(self._module_path, self._module_name+'.py')
 
-        if os.path.exists(self._module_abs_path):
-            self._logr.warning("Removing a previously generated Image Data Module File: '%s'" % self._module_abs_path)
-            os.remove(self._module_abs_path)
+        if self._write_mode == "wb":
+            # A previously generated module is only replaced once the build
+            # succeeds, see genCommit()
+            self._staging_path = os.path.join(self._module_path, STAGING_TEMPLATE % (self._module_name + '.py', os.getpid()))
+            self._logr.info("Opening for output the Image Data Module File (Python Module) '%s' as '%s'" % (self._module_abs_path, self._staging_path))
+            self._module_fp = open(self._staging_path, self._write_mode)
+            self._module_start = 0
+            return
 
         self._logr.info("Opening for output the Image Data Module File (Python Module) '%s' with write mode '%s'" % (self._module_abs_path, self._write_mode))
 
         self._module_fp = open(self._module_abs_path, self._write_mode)
 
+        # Where this run's output starts, see genAbandon()
+        self._module_start = self._module_fp.seek(0, os.SEEK_END)
+
+
+    def genOpenPackage(self):
+        """
+        Create the --split package directory and open the first shard.
+        """
+        self.genOpenStagingPackage()
+
+        self._logr.info("Generating the Image Data Package '%s' split into modules of at most %d bytes" % (self._package_abs_path, self._split))
+
+        self.genOpenShard()
+
+
+    def genOpenStagingPackage(self):
+        """
+        Create the temporary directory the --split or --layout package is
+        generated in; it replaces the package once the build succeeds, see
+        genCommit().
+        """
+        self._package_abs_path = os.path.join(self._module_path, STAGING_TEMPLATE % (self._module_name, os.getpid()))
+        if os.path.isdir(self._package_abs_path):
+            shutil.rmtree(self._package_abs_path)
+        os.makedirs(self._package_abs_path)
+        self._staging_path = self._package_abs_path
+
+
+    def genOpenShard(self):
+        """
+        Open the next shard module of a --split package.
+        """
+        self._shard_name = SHARD_MODULE_TEMPLATE % self._shard_count
+        self._shard_count += 1
+
+        self._module_abs_path = os.path.join(self._package_abs_path, self._shard_name + '.py')
+        self._logr.info("Opening for output the Image Data Shard Module '%s'" % self._module_abs_path)
+
+        self._module_fp = open(self._module_abs_path, self._write_mode)
+        self._module_start = 0
+        self._shard_bytes = 0
+
+
+    def genNextShard(self):
+        """
+        Close the current shard module of a --split package and open the next one.
+        """
+        self._module_fp.close()
+        self.genOpenShard()
+        self.genModuleHeader()
+
+
+    def genOpenTree(self):
+        """
+        Create the --layout directory|image package directory. The modules of
+        the package tree are opened as the images arrive, see genTreeImageData().
+        """
+        self.genOpenStagingPackage()
+
+        self._module_abs_path = self._package_abs_path
+        self._module_start = 0
+        self._tree_children[()] = set()
+
+        self._logr.info("Generating the Image Data Package tree '%s' with --layout %s" % (self._package_abs_path, self._layout))
+
+
+    def _treePath(self, package, module=PACKAGE_INIT_FILE[:-3]):
+        """
+        Returns the path of the module named module of package, creating the
+        package's directory if needed.
+        """
+        package_path = os.path.join(self._package_abs_path, *package)
+        os.makedirs(package_path, exist_ok=True)
+        return os.path.join(package_path, module + '.py')
+
+
+    def genTreeImageData(self, package):
+        """
+        Write the current image's data to its module in the package tree:
+        the __init__ module of package with --layout directory, a module of
+        its own in package with --layout image.
+        """
+        for i in range(len(package)):
+            self._tree_children.setdefault(package[:i], set()).add(package[i])
+        self._tree_children.setdefault(package, set())
+
+        if self._layout == LAYOUT_IMAGE:
+            self._tree_children[package].add(self._CurrentImageName)
+            self._module_abs_path = self._treePath(package, self._CurrentImageName)
+            self._module_fp = open(self._module_abs_path, "wb")
+            self._tree_package = package
+            self.genModuleHeader()
+            self.genImageData()
+            self.genTreeClose()
+            return
+
+        if self._tree_package != package:
+            # Images of a package usually arrive together, but one directory
+            # may be found below several --input directories
+            self.genTreeClose()
+            self._module_abs_path = self._treePath(package)
+            started = package in self._tree_started
+            self._module_fp = open(self._module_abs_path, "ab" if started else "wb")
+            self._tree_package = package
+            if not started:
+                self._tree_started.add(package)
+                self.genModuleHeader()
+
+        self.genImageData()
+
+
+    def genTreeClose(self):
+        """
+        Close the module of the package tree currently open.
+        """
+        if self._module_fp:
+            self._module_fp.close()
+            self._module_fp = None
+        self._tree_package = None
+
+
+    def genTreeIndexes(self):
+        """
+        Complete the __init__ module of every package of the package tree with
+        the lazy loader of its sub-packages and image modules.
+        """
+        self._logr.info("Generating the __init__ modules of %d package(s)..." % len(self._tree_children))
+
+        for package in sorted(self._tree_children):
+            self._module_abs_path = self._treePath(package)
+            started = package in self._tree_started
+            self._module_fp = open(self._module_abs_path, "ab" if started else "wb")
+            if not started:
+                self._tree_started.add(package)
+                self.genModuleHeader()
+
+            submodules = pformat(tuple(sorted(self._tree_children[package])), indent=4, width=1)
+            self._module_fp.write(bytes((TREE_INDEX_TEMPLATE % submodules).encode(self._encoding)))
+
+            self.genModuleMain()
+
+            self._module_fp.close()
+            self._module_fp = None
+
 
     def genModuleHeader(self):
         """
@@ -194,6 +754,10 @@ class CodeGen():
             --main
 
         """
+        if self._layout != LAYOUT_MODULE and self._module_fp is None:
+            # Every module of a package tree gets its header when it is opened
+            return
+
         self._logr.info("Generating Module Header...")
 
         if self._args.python:
@@ -215,6 +779,10 @@ class CodeGen():
         self._module_fp.write(bytes(DIVIDER_TEMPLATE.encode(self._encoding)))
         self._module_fp.write(bytes(NEW_LINE.encode(self._encoding)))
 
+        if self._split:
+            self._shard_header_bytes = self._module_fp.tell()
+            self._shard_bytes = self._shard_header_bytes
+
 
     def genImageData(self):
         """
@@ -224,13 +792,159 @@ class CodeGen():
                 self._module_fp : image source code module file opened for writing
 
         Write the image data to the image module source file.
+
+        With --split, a shard module that already holds image data and would
+        grow past the byte cap is closed and the image data goes to a new one.
         """
         self._logr.info("Generating Image Data...")
 
-        dataRef = "%s_data = " % self._CurrentImageName
-        self._module_fp.write(bytes(dataRef.encode(self._encoding)))
-        self._module_fp.write(bytes(repr(self._CurrentImageData).encode(self._encoding)))
-        self._module_fp.write(bytes(NEW_LINE.encode(self._encoding)))
+        ####################### Using IMM Library ###########################
+        entry = GID.format_data_entry(self._CurrentImageData, self._CurrentImageName, self._encoding)
+        #####################################################################
+
+        if self._split:
+            if self._shard_bytes > self._shard_header_bytes and self._shard_bytes + len(entry) > self._split:
+                self.genNextShard()
+            self._shard_index["%s_data" % self._CurrentImageName] = self._shard_name
+            self._shard_bytes += len(entry)
+
+        self._module_fp.write(entry)
+
+
+    def genFrameData(self, frames, frame_data):
+        """
+        Write the image data of the distinct frames of the current image as
+        <image name>_frame<N>_data, except for the first one (and the frames
+        identical to it) which is the image data of the current image itself.
+        """
+        image_name = self._CurrentImageName
+        image_data = self._CurrentImageData
+
+        names = list()
+        for (n, data) in enumerate(frame_data or ()):
+            if n == 0:
+                names.append("%s_data" % image_name)
+                continue
+            self._CurrentImageName = "%s_frame%d" % (image_name, n)
+            self._CurrentImageData = data
+            self.genImageData()
+            names.append("%s_data" % self._CurrentImageName)
+
+        self._frames[image_name] = [ (names[frame['Data']] if 'Data' in frame else None,
+                                      frame['Offset'], frame['Duration'], frame['Width'], frame['Height'])
+                                     for frame in frames ]
+
+        self._CurrentImageName = image_name
+        self._CurrentImageData = image_data
+
+
+    def genFrameIndex(self):
+        """
+        Write the index of the frames of every multi-frame image.
+        """
+        lines = list()
+        for (image_name, frames) in self._frames.items():
+            lines.append("    %r : (\n" % image_name)
+            for (name, offset, duration, w, h) in frames:
+                lines.append("        (%s, %d, %d, %d, %d),\n" % (name, offset, duration, w, h))
+            lines.append("    ),\n")
+        index = "{\n" + "".join(lines) + "}"
+
+        self._module_fp.write(bytes((FRAME_INDEX_TEMPLATE % index).encode(self._encoding)))
+
+
+    def genCodecIndex(self):
+        """
+        Write the index of the codec of every image and the get_image() accessor.
+        """
+        codecs = dict(zip(self._metaNames, self._metaColumns.get('Codec', ())))
+        index = pformat(codecs, indent=4, width=1)
+
+        self._module_fp.write(bytes((CODEC_INDEX_TEMPLATE % index).encode(self._encoding)))
+
+
+    def genVariantData(self, variants, width, height):
+        """
+        Write the image data of the variants of the current image as
+        <image name>_<variant name>_data.
+        """
+        image_name = self._CurrentImageName
+        image_data = self._CurrentImageData
+
+        sizes = [ (width, height, "%s_data" % image_name) ]
+        for (variant_name, (data, w, h)) in sorted(variants.items()):
+            self._CurrentImageName = "%s_%s" % (image_name, variant_name)
+            self._CurrentImageData = data
+            self.genImageData()
+            sizes.append((w, h, "%s_data" % self._CurrentImageName))
+
+        self._variants[image_name] = sorted(sizes, key=lambda size: (max(size[0], size[1]), size[2]))
+
+        self._CurrentImageName = image_name
+        self._CurrentImageData = image_data
+
+
+    def genVariantIndex(self):
+        """
+        Write the index of the variants of every image and the get_variant()
+        accessor.
+        """
+        lines = list()
+        for (image_name, sizes) in self._variants.items():
+            lines.append("    %r : (%s),\n" % (image_name, " ".join("(%d, %d, %s)," % size for size in sizes)))
+        index = "{\n" + "".join(lines) + "}"
+
+        self._module_fp.write(bytes((VARIANT_INDEX_TEMPLATE % index).encode(self._encoding)))
+
+
+    def genAtlases(self):
+        """
+        Pack the images processed into atlas images (see atlas.py) and write
+        the image data of each atlas, the index of where each image is in
+        which atlas and the accessors cropping an image from its atlas.
+        """
+        images = dict()
+        for (name, data) in self._atlas_images:
+            images[name] = Image.open(BytesIO(data))
+
+        (atlases, placements) = atlas.pack(dict((name, img.size) for (name, img) in images.items()), self._atlas)
+        self._logr.info("Packed %d image(s) into %d atlas image(s)" % (len(images), len(atlases)))
+
+        # The atlases are RGBA whatever the mode of each image; get_image()
+        # converts an image back to its own mode, except that a palette image
+        # with a transparent color stays RGBA to keep its transparency
+        modes = dict()
+        for (name, img) in images.items():
+            modes[name] = 'RGBA' if img.mode == 'P' and 'transparency' in img.info else img.mode
+
+        sheets = [ Image.new('RGBA', size, (0, 0, 0, 0)) for size in atlases ]
+        for (name, (index, x, y, w, h)) in placements.items():
+            sheets[index].paste(images[name].convert('RGBA'), (x, y))
+
+        names = list()
+        for (index, sheet) in enumerate(sheets):
+            self._CurrentImageName = ATLAS_VAR_TEMPLATE % index
+            ####################### Using IMM Library ###########################
+            self._CurrentImageData = GID.encode_image(sheet)
+            #####################################################################
+            self.genImageData()
+            names.append("%s_data, " % self._CurrentImageName)
+
+        # In the order the images were processed rather than packed
+        index = "{\n" + "".join("    %r : %r,\n" % (name, placements[name] + (modes[name],)) for (name, data) in self._atlas_images) + "}"
+        accessors = ATLAS_ACCESSOR_TEMPLATE % ("".join(names), index)
+        self._module_fp.write(bytes(accessors.encode(self._encoding)))
+
+        self._atlas_images = list()
+
+
+    def genOutputs(self):
+        """
+        Write the --css and --contact-sheet files from the data collected.
+        """
+        for writer in self._outputs:
+            writer.close()
+            self._logr.info("Generated the --%s file '%s'" % (writer.OUTPUT, writer.Path))
 
 
     def genModuleMain(self):
@@ -239,6 +953,14 @@ class CodeGen():
         """
         self._logr.info("Generating Module __main__...")
 
+        if self._shard_name is not None or self._tree_package is not None:
+            # A package's __main__ goes in its __init__, see genPackageIndex()
+            # and genTreeIndexes()
+            return
+
+        if self._layout != LAYOUT_MODULE and self._module_fp is None:
+            return
+
         if self._args.main:
             self._logr.info("   *** Main is NOT empty. ***")
             self._module_fp.write(bytes(NEW_LINE.encode(self._encoding)))
@@ -254,17 +976,131 @@ class CodeGen():
 
         """
         self._logr.info("Closing Output File... '%s'\n" % self._module_abs_path)
+        if self._layout != LAYOUT_MODULE:
+            self.genTreeClose()
+            self.genTreeIndexes()
+        elif self._module_fp:
+            self._module_fp.close()
+            self._module_fp = None
+
+            if self._split:
+                self._shard_name = None
+                self.genPackageIndex()
+
+        self.genCommit()
+
+
+    def genCommit(self):
+        """
+        Replace the previously generated MODULE, or package, and anything that
+        would be confused with it on import, with the one this run generated.
+        """
+        if self._staging_path is None:
+            return
+
+        module_abs_path = os.path.join(self._module_path, self._module_name + '.py')
+        package_abs_path = os.path.join(self._module_path, self._module_name)
+
+        if os.path.isdir(package_abs_path):
+            removeGeneratedPackage(package_abs_path, self._logr)
+
+        if os.path.isdir(self._staging_path):
+            if os.path.exists(module_abs_path):
+                self._logr.warning("Removing a previously generated Image Data Module File: '%s'" % module_abs_path)
+                os.remove(module_abs_path)
+
+            # Files that were not generated may be left in the package directory
+            for (dirpath, dirnames, filenames) in os.walk(self._staging_path):
+                target = os.path.join(package_abs_path, os.path.relpath(dirpath, self._staging_path))
+                os.makedirs(target, exist_ok=True)
+                for filename in filenames:
+                    os.replace(os.path.join(dirpath, filename), os.path.join(target, filename))
+            shutil.rmtree(self._staging_path)
+            self._package_abs_path = package_abs_path
+            self._module_abs_path = package_abs_path
+        else:
+            if os.path.exists(module_abs_path):
+                self._logr.warning("Replacing the previously generated Image Data Module File: '%s'" % module_abs_path)
+            os.replace(self._staging_path, module_abs_path)
+            self._module_abs_path = module_abs_path
+
+        self._staging_path = None
+
+
+    def genPackageIndex(self):
+        """
+        Write the __init__ module of a --split package: the index of which shard
+        module defines each image data variable and the lazy loader using it.
+        """
+        self._module_abs_path = os.path.join(self._package_abs_path, PACKAGE_INIT_FILE)
+        self._logr.info("Generating the Image Data Package index '%s' for %d shard module(s)" % (self._module_abs_path, self._shard_count))
+
+        self._module_fp = open(self._module_abs_path, "wb")
+
+        self.genModuleHeader()
+
+        index = pformat(self._shard_index, indent=4, width=1)
+        self._module_fp.write(bytes((PACKAGE_INDEX_TEMPLATE % index).encode(self._encoding)))
+
+        self.genModuleMain()
+
+        self._module_fp.close()
+        self._module_fp = None
+
+
+    def genAbandon(self):
+        """
+        Undo this run's output when the build fails part way through: a new
+        module or package is removed, leaving the one previously generated as
+        it was, an appended module is truncated back to the size it had before
+        this run.
+        """
         if self._module_fp:
             self._module_fp.close()
             self._module_fp = None
-            
+
+        for writer in self._outputs:
+            writer.abandon()
+
+        if self._staging_path is not None:
+            self._logr.warning("Removing the incomplete Image Data %s: '%s'" %
+                               ('Package' if os.path.isdir(self._staging_path) else 'Module File', self._staging_path))
+            if os.path.isdir(self._staging_path):
+                shutil.rmtree(self._staging_path)
+            else:
+                os.remove(self._staging_path)
+            self._staging_path = None
+        elif self._module_path == C.STDOUT:
+            self._logr.warning("The Image Data Module written to stdout is incomplete")
+        else:
+            self._logr.warning("Truncating the Image Data Module File '%s' to its original %d bytes" % (self._module_abs_path, self._module_start))
+            os.truncate(self._module_abs_path, self._module_start)
+
 
     #---------------------------------------------------------------------------
     # meta-data generation methods
     #---------------------------------------------------------------------------
+    def _formatColumn(self, values, indent=4):
+        """
+        Returns the source of a column of the image meta-data module: an
+        array of unsigned ints if every value is one, else a tuple.
+        """
+        lines = list()
+        for start in range(0, len(values), META_DATA_VALUES_PER_LINE):
+            chunk = values[start:start + META_DATA_VALUES_PER_LINE]
+            lines.append(indent*" " + "".join("%r, " % (value,) for value in chunk).rstrip() + "\n")
+        source = "".join(lines)
+
+        if values and all(type(value) is int and value >= 0 for value in values):
+            return "_array.array('L', [\n%s%s])" % (source, (indent - 4)*" ")
+        if indent == 4:
+            return source
+        return "(\n%s%s)" % (source, (indent - 4)*" ")
+
+
     def genImageMetaData(self):
         """
-        Open the meta-data file, write the meta-data dictionary, and close file
+        Open the meta-data file, write the meta-data columns, and close file
         """
         self._logr.info("Generating image metadata...")
 
@@ -283,28 +1119,13 @@ class CodeGen():
 
         self._module_fp = open(metadata_module_abs_path, write_mode)
 
-        count = 0
-        uniform_count = 0
-        for img in self._imageMetaData:
-            count += 1
-            self._imageMetaData[img]['largest_width'] = self._largest_width
-
-            if self._imageMetaData[img]['Width'] == self._largest_width:
-                uniform_count += 1
-
-        if uniform_count == count:
-            self._uniform_width = True
-        else:
-            self._uniform_width = False
-
-        for img in self._imageMetaData:
-            self._imageMetaData[img]['uniform_width'] = self._uniform_width
-
-        meta_data = pformat(self._imageMetaData, indent=4, width=1)
-
         self.genModuleHeader()
 
-        self._module_fp.write(bytes("IMG_META_DATA = \\\n".encode(self._encoding)))
+        uniform_width = self._largest_count == len(self._metaNames)
+        names = self._formatColumn(self._metaNames)
+        columns = "".join("    %r : %s,\n" % (field, self._formatColumn(values, indent=8))
+                          for (field, values) in self._metaColumns.items())
+        meta_data = META_DATA_TEMPLATE % (self._largest_width, uniform_width, names, columns)
         self._module_fp.write(bytes(meta_data.encode(self._encoding)))
 
         # We want an empty main in the meta-data module
@@ -18,7 +18,17 @@ import logging
 
 #-------------------------------------------------------------------------------
 from imm.cli import constants as C
+from imm.cli import utils
 from imm.cli import codegenerator as CG
+from imm.cli import pipeline as PL
+from imm.cli import discovery as DS
+from imm.cli import watcher as WA
+from imm.cli import atlas as AT
+from imm.cli import variants as VA
+from imm.cli import frames as FR
+from imm.cli import shards as SH
+from imm.cli import outputs as OU
+from imm import imagecodecs as IC
 from imm.cli.loggingsetup import LOG_LEVELS
 
 #-------------------------------------------------------------------------------
@@ -178,8 +188,30 @@ class LocalFormatter(argparse.HelpFormatter):
         return s + '\n'
 
 #-------------------------------------------------------------------------------
-def parseCmdLine(version):
+# Command line parsers already built, keyed by version -- the build daemon
+# parses many command lines but only needs to build the parser once.
+_cliparsers = dict()
+
+def parseCmdLine(version, argv=None):
+    """
+    Parse the command line and return the tuple (args, cliparser).
+
+    argv - a list of command line arguments to parse rather than sys.argv[1:],
+           used by the build daemon to parse the command lines it is forwarded.
+    """
+    if version not in _cliparsers:
+        _cliparsers[version] = buildCmdLineParser(version)
+
+    cliparser = _cliparsers[version]
+
+    args = cliparser.parse_args(argv)
+
+    return args, cliparser
+
+#-------------------------------------------------------------------------------
+def buildCmdLineParser(version):
     """
+    Returns the command line parser object created by argparse.ArgumentParser()
     """
 
     DESCRIPTION = "Reads image files and embeds them in a Python module."
@@ -193,10 +225,28 @@ def parseCmdLine(version):
                                         description=DESCRIPTION,
                                         epilog=EPILOG)
 
-    cliparser.add_argument('--input', '-i', metavar ='INPUT', default='.',
+    cliparser.add_argument('--input', '-i', metavar ='INPUT', default=None, action='append',
                              help='Specifies an INPUT directory of image files or specifies a single image file. \n' \
+                                  'A zip or tar archive INPUT is read as a directory, without extracting it.\n' \
+                                  'INPUT - reads a newline or NUL separated list of INPUT paths from stdin.\n' \
+                                  'May be repeated to process several INPUT directories and/or files into one MODULE.\n' \
                                   'Defaults to current directory.')
 
+    cliparser.add_argument('--recursive', '-r', action='store_true', default=False,
+                           help='Also process the image files in the sub-directories of each INPUT directory.')
+
+    cliparser.add_argument('--include', metavar='GLOB', default=None, action='append',
+                           help='Only process files matching GLOB. May be repeated. A GLOB without a "/" is matched\n' \
+                                'against the file name, otherwise against the path relative to the INPUT directory.')
+
+    cliparser.add_argument('--exclude', metavar='GLOB', default=None, action='append',
+                           help='Skip files and sub-directories matching GLOB. May be repeated. Matched like --include.')
+
+    cliparser.add_argument('--symlinks', metavar='POLICY', default=DS.DEFAULT_SYMLINKS, choices=DS.SYMLINK_POLICIES,
+                           help="POLICY for symbolic links found in INPUT directories, one of %s.\n" \
+                                "'follow' follows links to files and directories, 'files' follows only links to files,\n" \
+                                "'skip' ignores all symbolic links. Defaults to '%s'." % (DS.SYMLINK_POLICIES, DS.DEFAULT_SYMLINKS))
+
     group = cliparser.add_mutually_exclusive_group(required=False)
     group.add_argument('--module', '-m', metavar ='MODULE', default='gfxmodule',
                              help='Specifies the Python MODULE name to generate. MODULE can be specified by --module or --append.\n' \
@@ -212,7 +262,7 @@ def parseCmdLine(version):
     cliparser.add_argument('--code', '-c', metavar ='CODE_PATH', default='.',
                              help="Specifies path where the code to the Python module named MODULE will be generated.\n" \
                                    "If the --show option is specified, then a meta-data module and a GUI module will also be generated.\n" \
-                                   "Defaults to current directory.")
+                                   "CODE_PATH - writes the Python module to stdout instead. Defaults to current directory.")
 
     # # MISC flag options
     cliparser.add_argument('--fixident', metavar ='PREFIX', default=None, nargs='?', const=C.FIXIDENT_NO_ARG,
@@ -231,6 +281,135 @@ def parseCmdLine(version):
                                 'If ENCODING is omitted, then "utf-8" will be used to encode the generated MODULE.\n' \
                                 'If ENCODING is specified, then ENCODING will be used. Note that no validation is done on ENCODING.')
 
+    cliparser.add_argument('--jobs', '-j', metavar='JOBS', type=int, default=1, nargs='?', const=0,
+                           help='JOBS specifies the number of worker processes that decode and encode images in parallel.\n' \
+                                'By default images are processed one at a time. If JOBS is omitted (or 0), one worker per CPU is used.\n' \
+                                'Image data is always written to MODULE in the same order as a run without --jobs.')
+
+    cliparser.add_argument('--depth', metavar='DEPTH', type=int, default=PL.DEFAULT_DEPTH,
+                           help='DEPTH specifies how many images may wait between two stages of the build pipeline.\n' \
+                                'Peak memory use is bounded by DEPTH rather than the number of images. DEPTH must be at least 1,\n' \
+                                'below JOBS some workers are left idle. Defaults to %d.' % PL.DEFAULT_DEPTH)
+
+    cliparser.add_argument('--timeout', metavar='SECONDS', type=float, default=None,
+                           help='Fail an image file whose decoding and encoding takes more than SECONDS. Its worker process\n' \
+                                'is killed and replaced; the images other workers were encoding are encoded again.')
+
+    cliparser.add_argument('--memory-limit', metavar='BYTES', type=utils.parseByteSize, default=None,
+                           help='Limit the memory of each worker process to BYTES (a suffix of K, M or G may be used); an image\n' \
+                                'file needing more fails. Not supported on Windows.')
+
+    cliparser.add_argument('--keep-going', action='store_true', default=False,
+                           help='Leave an image file that fails out of MODULE and go on with the others, rather than stopping\n' \
+                                'the build. The failures are listed at the end and the return code is 11.')
+
+    cliparser.add_argument('--config', metavar='FILE', default=None,
+                           help='Build every target declared by the TOML (.toml) or INI config FILE in one process, sharing the\n' \
+                                'worker pool and the images encoded, and report the time each target took. The other options\n' \
+                                'given apply to every target. With --keep-going a failed target does not stop the others.')
+
+    cliparser.add_argument('--depfile', metavar='FILE', default=None,
+                           help='Also write FILE, a Make/Ninja dependency file making every file generated depend on every\n' \
+                                'image file written to MODULE, the input directories scanned and the --config file, so that the\n' \
+                                'build tool only runs IMM when one of them changed.')
+
+    cliparser.add_argument('--shard', metavar='i/N', type=SH.parseShard, default=None,
+                           help='Encode only shard i of the N shards the image files are split into, and write them to the\n' \
+                                'partial result MODULE.shard<i>of<N>.immpart in CODE_PATH rather than to MODULE. Running\n' \
+                                'the N shards on N machines, then --merge, builds MODULE as a single build would.')
+
+    cliparser.add_argument('--merge', metavar='PARTIAL', action='append', default=None,
+                           help='Generate MODULE from the partial results of every shard of a --shard build, one --merge\n' \
+                                'PARTIAL for each, without decoding any image again. The image files are not read.')
+
+    cliparser.add_argument('--watch', metavar='SECONDS', type=float, default=None, nargs='?', const=WA.DEFAULT_INTERVAL,
+                           help='Keep running after MODULE is generated, polling the INPUT directories every SECONDS and\n' \
+                                'regenerating MODULE when image files are added, changed or removed. Only the changed image\n' \
+                                'files are encoded again. If SECONDS is omitted, %s is used.' % WA.DEFAULT_INTERVAL)
+
+    cliparser.add_argument('--plan', metavar='FILE', default=None, nargs='?', const=C.STDOUT,
+                           help='Generate nothing; instead write a JSON build plan to FILE listing the image files that would be\n' \
+                                'processed, renamed or ignored with an estimate of the MODULE size and encoding time.\n' \
+                                'Only image headers are read. If FILE is omitted, the plan is written to stdout.')
+
+    cliparser.add_argument('--split', metavar='BYTES', type=utils.parseByteSize, default=None,
+                           help='Generate MODULE as a package directory of shard modules of at most BYTES each (a suffix of K, M\n' \
+                                'or G may be used) rather than as a single module. The package __init__ imports a shard module\n' \
+                                'only when one of its image data names is first used. Cannot be combined with --append.')
+
+    cliparser.add_argument('--layout', metavar='LAYOUT', default=CG.LAYOUT_MODULE, choices=CG.LAYOUTS,
+                           help="LAYOUT of the generated code, one of %s. 'module' generates the single MODULE,\n" \
+                                "'directory' generates MODULE as a package tree mirroring the INPUT directories, the images of\n" \
+                                "each directory in its package's __init__, 'image' generates the same package tree with a\n" \
+                                "module per image. Sub-packages and modules are imported when first used. Defaults to '%s'." % (CG.LAYOUTS, CG.LAYOUT_MODULE))
+
+    cliparser.add_argument('--atlas', metavar='SIZE', type=int, default=None, nargs='?', const=AT.DEFAULT_SIZE,
+                           help='Pack the images into atlas images of at most SIZE x SIZE pixels and generate, rather than a\n' \
+                                'data string per image, a data string per atlas, the ATLAS_INDEX of where each image is and the\n' \
+                                'get_image(name) and get_photo_image(name) accessors. If SIZE is omitted, %d is used.' % AT.DEFAULT_SIZE)
+
+    cliparser.add_argument('--codec', metavar='CODEC', default=IC.DEFAULT_CODEC, choices=IC.codec_names() + [IC.AUTO],
+                           help="CODEC the image data is encoded with, one of %s.\n" \
+                                "'auto' encodes each image with %s and keeps the smallest image data\n" \
+                                "with a PSNR of at least --min-psnr. Defaults to '%s'." % (IC.codec_names() + [IC.AUTO], IC.AUTO_CANDIDATES, IC.DEFAULT_CODEC))
+
+    cliparser.add_argument('--min-psnr', metavar='DB', type=float, default=IC.DEFAULT_MIN_PSNR,
+                           help='The lowest PSNR in DB of a lossy encoding --codec auto may keep. Defaults to %s.' % IC.DEFAULT_MIN_PSNR)
+
+    cliparser.add_argument('--frames', metavar='MODE', default=FR.DEFAULT_FRAMES, choices=FR.FRAMES_MODES,
+                           help="What to generate of multi-frame images (animated GIF, APNG and WebP, multi-page TIFF, ICO),\n" \
+                                "MODE is one of %s. 'first' generates the first frame only, 'split' also generates every\n" \
+                                "distinct frame, 'apng' and 'webp' re-encode animations as a whole. MODULE then gets the\n" \
+                                "FRAMES index of each frame's offset and duration. Defaults to '%s'." % (FR.FRAMES_MODES, FR.DEFAULT_FRAMES))
+
+    cliparser.add_argument('--max-size', metavar='SIZE', type=utils.parseBox, default=None,
+                           help='Reduce every image larger than SIZE (N for N x N or WxH) pixels to fit in SIZE. JPEG images are\n' \
+                                'decoded at a reduced scale and uncompressed images a strip at a time, so a huge image file is\n' \
+                                'never decoded in full when possible. Pillow\'s decompression bomb check is then not made,\n' \
+                                'see --max-pixels.')
+
+    cliparser.add_argument('--max-pixels', metavar='PIXELS', type=int, default=None,
+                           help="Fail rather than decode more than PIXELS pixels of an image at once (after any reduced scale\n" \
+                                "decoding of --max-size). Replaces Pillow's decompression bomb check.")
+
+    cliparser.add_argument('--variant', metavar='NAME=SIZE', type=VA.parseVariant, default=None, action='append',
+                           help='Also generate a variant of each image resized to fit in SIZE (N for N x N or WxH) pixels,\n' \
+                                'written as <image name>_NAME_data, and the VARIANTS index with a get_variant(name, size)\n' \
+                                'accessor returning the variant nearest to size. May be repeated, as in --variant 1x=16 --variant 2x=32.')
+
+    cliparser.add_argument('--resample', metavar='FILTER', default=VA.DEFAULT_RESAMPLE, choices=sorted(VA.RESAMPLE_FILTERS),
+                           help="Resampling FILTER used to make --variant images, one of %s.\n" \
+                                "Defaults to '%s'." % (sorted(VA.RESAMPLE_FILTERS), VA.DEFAULT_RESAMPLE))
+
+    cliparser.add_argument('--variant-cache', metavar='DIR', default=C.VARIANT_CACHE_PATH,
+                           help="DIR in which --variant images are cached by the content of their image file, so an unchanged\n" \
+                                "image file is never resized again. Defaults to '%s'." % C.VARIANT_CACHE_PATH)
+
+    cliparser.add_argument('--css', metavar='FILE', default=None,
+                           help='Also write the style sheet FILE, with a rule named after each image whose background-image\n' \
+                                'is the image as a data URI. Made from the decode MODULE is encoded from.')
+
+    cliparser.add_argument('--css-codec', metavar='CODEC', default=OU.DEFAULT_CSS_CODEC,
+                           choices=sorted(OU.CSS_MIME_TYPES) + [IC.AUTO],
+                           help="CODEC the --css data URIs are encoded with, one of %s.\n" \
+                                "Defaults to '%s'." % (sorted(OU.CSS_MIME_TYPES) + [IC.AUTO], OU.DEFAULT_CSS_CODEC))
+
+    cliparser.add_argument('--contact-sheet', metavar='FILE', default=None,
+                           help='Also write the PNG FILE, a contact sheet of a thumbnail of every image. Made from the decode\n' \
+                                'MODULE is encoded from.')
+
+    cliparser.add_argument('--contact-size', metavar='SIZE', type=utils.parseBox, default=OU.DEFAULT_CONTACT_SIZE,
+                           help='The thumbnails of the --contact-sheet fit in SIZE (N for N x N or WxH) pixels.\n' \
+                                'Defaults to %dx%d.' % OU.DEFAULT_CONTACT_SIZE)
+
+    cliparser.add_argument('--metadata', action='store_true', default=False,
+                           help='Also generate the image meta-data module, as --show does, without the show module.')
+
+    cliparser.add_argument('--stats', action='store_true', default=False,
+                           help='Also compute the average color, alpha coverage, bounding box and whether it is mostly\n' \
+                                'dark of every image from its decode, and write them to the image meta-data module.\n' \
+                                'Implies --metadata. Uses NumPy if it is installed. Cannot be combined with --code -.')
+
     cliparser.add_argument('--show', action='store_true', default=False,
                            help='Generates an addtional image meta-data module and a show module that will\n' \
                                 'be executed to display a visual interface to interact with the image data.')
@@ -239,6 +418,12 @@ def parseCmdLine(version):
                            help='If --main not specified, no __main__ statement is generated.\n' \
                                 "If --main is specified, then this line is generated:   if __name__ == '__main__':pass")
 
+    cliparser.add_argument('--daemon', metavar='SOCKET', default=None, nargs='?', const=C.DAEMON_SOCKET,
+                           help='Run as a long-lived build daemon listening on the Unix domain SOCKET.\n' \
+                                'Command lines forwarded by immclient.py are built by the daemon which keeps\n' \
+                                'Pillow, the logging sub-system and the command line parser warm between builds.\n' \
+                                "If SOCKET is omitted, then '%s' is used." % C.DAEMON_SOCKET)
+
     cliparser.add_argument('--quiet', action='store_true', help='Suppress all console output (and we do really really mean ALL)')
 
     LOG_LEVEL_DEFAULT = 'warning'
@@ -259,9 +444,7 @@ def parseCmdLine(version):
     cliparser.add_argument('--version', '-v', action='version', version=version,
                            help='Specifies the version and exits.')
 
-    args = cliparser.parse_args()
-
-    return args, cliparser
+    return cliparser
 
 #-------------------------------------------------------------------------------
 if __name__ == "__main__":
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Build configuration files
+
+With --config FILE one invocation builds every target FILE declares, rather
+than running IMM once per MODULE. FILE is TOML if its name ends in .toml
+(read with tomllib, Python 3.11 or later), otherwise INI (read with
+configparser):
+
+    # gfx.toml                          ; gfx.ini
+    [defaults]                          [DEFAULT]
+    code = "build/gfx"                  code = build/gfx
+    recursive = true                    recursive = true
+
+    [targets.icons]                     [icons]
+    input = ["gfx/icons", "gfx/ui"]     input = gfx/icons
+    exclude = ["*_old.*"]                       gfx/ui
+                                        exclude = *_old.*
+    [targets.photos]
+    input = "gfx/photos"                [photos]
+    codec = "auto"                      input = gfx/photos
+                                        codec = auto
+
+Each key of a target is a command line option without its leading '--', its
+value the option's argument: true for an option without one (false leaves
+the option out) and a list (or lines in INI) for an option that may be
+repeated. The defaults apply to every target and a target's MODULE is named
+after it unless it says otherwise. Paths are relative to the directory of
+FILE.
+
+Every target is turned into the command line it stands for, see targetArgv(),
+so a target builds exactly like the same command line would.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os
+import configparser
+
+try:
+    import tomllib
+except ImportError:
+    # Python 3.10 and earlier, only INI configs can be read
+    tomllib = None
+
+#-------------------------------------------------------------------------------
+from imm.cli import constants as C
+
+#-------------------------------------------------------------------------------
+# Options whose arguments are paths, relative to the config file's directory
+PATH_OPTIONS = ('input', 'code', 'depfile', 'variant-cache', 'merge', 'css', 'contact-sheet')
+
+# Options that make no sense for a target
+GLOBAL_OPTIONS = ('config', 'daemon', 'watch', 'plan', 'help', 'version')
+
+# INI values standing for true and false
+INI_TRUE = ('true', 'yes', 'on')
+INI_FALSE = ('false', 'no', 'off')
+
+#-------------------------------------------------------------------------------
+class ConfigError(Exception):
+    pass
+
+
+#-------------------------------------------------------------------------------
+def loadConfig(path):
+    """
+    Returns the list of the (name, options) tuples of the targets declared by
+    the config file path, in the order declared, the defaults merged into the
+    options of each. Raises ConfigError if it cannot be read.
+    """
+    if os.path.splitext(path)[1].lower() == '.toml':
+        return _loadToml(path)
+    return _loadIni(path)
+
+
+def _loadToml(path):
+    if tomllib is None:
+        raise ConfigError("Reading the TOML config '%s' needs Python 3.11 or later, use an INI config instead" % path)
+
+    try:
+        with open(path, 'rb') as f:
+            data = tomllib.load(f)
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        raise ConfigError("Unable to read the config '%s': %s" % (path, e))
+
+    defaults = data.get('defaults', dict())
+    targets = data.get('targets', dict())
+    if not isinstance(defaults, dict) or not isinstance(targets, dict) or \
+       not all(isinstance(options, dict) for options in targets.values()):
+        raise ConfigError("The config '%s' must only have a [defaults] table and [targets.NAME] tables" % path)
+
+    return [ (name, dict(defaults, **options)) for (name, options) in targets.items() ]
+
+
+def _loadIni(path):
+    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        with open(path, encoding=C.DEFAULT_ENCODE) as f:
+            parser.read_file(f)
+    except (OSError, configparser.Error) as e:
+        raise ConfigError("Unable to read the config '%s': %s" % (path, e))
+
+    # The [DEFAULT] section is merged into every section by configparser
+    return [ (name, dict((key, _iniValue(value)) for (key, value) in parser[name].items()))
+             for name in parser.sections() ]
+
+
+def _iniValue(value):
+    """
+    Returns the INI value as a list if it has several lines, as True or False
+    if it is a boolean, else as is.
+    """
+    lines = [ line.strip() for line in value.splitlines() if line.strip() ]
+    if len(lines) > 1:
+        return lines
+
+    value = lines[0] if lines else ''
+    if value.lower() in INI_TRUE:
+        return True
+    if value.lower() in INI_FALSE:
+        return False
+    return value
+
+
+#-------------------------------------------------------------------------------
+def targetArgv(name, options, base_dir):
+    """
+    Returns the command line building the target name with options, paths
+    being relative to base_dir. Raises ConfigError for an option a target
+    cannot have.
+    """
+    options = dict((key.replace('_', '-'), value) for (key, value) in options.items())
+    if 'module' not in options and 'append' not in options:
+        options['module'] = name
+
+    argv = list()
+    for (option, values) in options.items():
+        if option in GLOBAL_OPTIONS:
+            raise ConfigError("The target '%s' cannot have the option '%s'" % (name, option))
+
+        if not isinstance(values, list):
+            values = [ values ]
+
+        for value in values:
+            if value is True:
+                argv.append('--' + option)
+            elif value is not False:
+                value = str(value)
+                if option in PATH_OPTIONS and value not in (C.STDIN, C.STDOUT):
+                    value = os.path.join(base_dir, os.path.expanduser(value))
+                argv.append('--%s=%s' % (option, value))
+
+    return argv
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
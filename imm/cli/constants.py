@@ -35,6 +35,13 @@ APP_PATH = os.path.join(USER_HOME_PATH, APP_DIR)
 
 LOG_PATH = os.path.join(os.path.join(USER_HOME_PATH, APP_DIR), LOG_FILE)
 
+DAEMON_SOCKET_FILE = 'immd.sock'
+DAEMON_SOCKET = os.path.join(APP_PATH, DAEMON_SOCKET_FILE)
+DAEMON_SOCKET_ENV = 'IMM_SOCKET'
+
+VARIANT_CACHE_DIR = "variants"
+VARIANT_CACHE_PATH = os.path.join(APP_PATH, VARIANT_CACHE_DIR)
+
 LOGGER = 'Image-Module-Maker(IMM)'
 LOG_LVL_FILE = 'DEBUG'
 LOG_LVL_CONSOLE = 'INFO'
@@ -44,11 +51,6 @@ LOG_FILE_FORMAT = '%(asctime)s:%(name)s:%(funcName)s-%(lineno)d:%(levelname)s -
 LOG_CONSOLE_FORMAT = '%(name)s:%(levelname)s-%(lineno)d: %(message)s'
 LOG_FILE_BACKUP_COUNT = 5
 
-# https://pillow.readthedocs.org/handbook/image-file-formats.html#fully-supported-formats
-# The Image (file) Extensions below are the most common supported by PILLOW
-# The only formats tested so far are: png, gif, jpg, ico, tif/tiff, tga, xbm, ppm
-IMG_EXTS = ['.png', '.pcx', '.ppm', '.gif', '.ico', '.jpg', '.jpeg', '.jfif', '.j2p', '.jpx', '.bmp', '.tif', '.tiff', '.tga', '.xbm']
-
 LEGAL_PYTHON_IDENT = """
 A legal Python identifier must adhere to the following syntax:
 
@@ -118,6 +120,12 @@ DEFAULTS_MSG = """Defaults:
 
 EMPTY = '<<empty>>'
 
+# Names stdout where an option otherwise names a file
+STDOUT = '-'
+
+# Names stdin where an option otherwise names a file
+STDIN = '-'
+
 #-------------------------------------------------------------------------------
 if __name__ == "__main__":
     # visually inspect defined constants
@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Build daemon
+
+A long-lived process that listens on a Unix domain socket and builds the
+command lines forwarded to it by a thin client (see immclient.py). Each build
+request re-uses the interpreter, the Pillow plugins, the logging sub-system
+and the command line parser of the daemon instead of paying for them again.
+
+The protocol is one JSON object per connection in each direction:
+
+    client -> daemon : {"argv": [...], "cwd": "..."}
+    daemon -> client : {"status": N, "stdout": "...", "stderr": "..."}
+
+The client shuts down the write side of its socket once the request is sent,
+the daemon closes the connection once the reply is sent.
+
+This module only imports the Python Standard Library at module level so
+that the client side stays cheap to start.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os
+import os.path
+import sys
+import io
+import json
+import socket
+import socketserver
+import signal
+
+from contextlib import redirect_stdout, redirect_stderr
+
+#-------------------------------------------------------------------------------
+from imm.cli import constants as C
+
+#-------------------------------------------------------------------------------
+# Return code used when the daemon cannot be started or reached
+DAEMON_ERROR = 9
+
+RECV_SIZE = 64 * 1024
+
+#-------------------------------------------------------------------------------
+def _recvAll(sock):
+    """
+    Read from sock until the peer shuts down its write side.
+    """
+    chunks = list()
+    while True:
+        chunk = sock.recv(RECV_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+#-------------------------------------------------------------------------------
+def forward(socket_path, argv, cwd=None):
+    """
+    Forward the command line argv to the build daemon listening on socket_path
+    and relay the daemon's output. Returns the build's return code.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        sys.stderr.write("The build daemon requires Unix domain sockets which are not available on this platform.\n")
+        return DAEMON_ERROR
+
+    request = {
+        'argv' : list(argv),
+        'cwd'  : os.path.abspath(cwd or os.getcwd()),
+    }
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall(json.dumps(request).encode(C.DEFAULT_ENCODE))
+            sock.shutdown(socket.SHUT_WR)
+            reply = json.loads(_recvAll(sock).decode(C.DEFAULT_ENCODE))
+    except (OSError, ValueError) as e:
+        sys.stderr.write("Unable to reach the build daemon at '%s': %s\n" % (socket_path, e))
+        return DAEMON_ERROR
+
+    sys.stdout.write(reply['stdout'])
+    sys.stdout.flush()
+    sys.stderr.write(reply['stderr'])
+    sys.stderr.flush()
+
+    return reply['status']
+
+
+#-------------------------------------------------------------------------------
+class _RequestHandler(socketserver.BaseRequestHandler):
+    """
+    Handles a single build request; self.server is the UnixStreamServer
+    whose build_daemon attribute references the owning BuildDaemon.
+    """
+    def handle(self):
+        daemon = self.server.build_daemon
+        try:
+            request = json.loads(_recvAll(self.request).decode(C.DEFAULT_ENCODE))
+            reply = daemon.runRequest(request['argv'], request['cwd'])
+        except (ValueError, KeyError) as e:
+            reply = { 'status' : DAEMON_ERROR, 'stdout' : '', 'stderr' : "Malformed build request: %s\n" % e }
+
+        self.request.sendall(json.dumps(reply).encode(C.DEFAULT_ENCODE))
+
+
+#-------------------------------------------------------------------------------
+class BuildDaemon():
+    """
+    Serve build requests on the Unix domain socket socket_path.
+
+    logSubSystem - the loggingsetup.Setup() object of the daemon process
+    build        - the callable build(args, cliparser, logSubSystem, argv, caches)
+                   used by immcli.main() to build a MODULE
+    version      - the version of the caller, passed to the command line parser
+
+    Builds are run one at a time since a build changes the current working
+    directory to that of the client which forwarded the command line. The
+    images encoded are cached between requests, like the targets of a --config
+    share them, so that a request only encodes the image files that changed.
+    """
+    def __init__(self, socket_path, logSubSystem, build, version=''):
+        self._socket_path = socket_path
+        self._logSubSystem = logSubSystem
+        self._logr = logSubSystem.Logger().getChild('BuildDaemon')
+        self._build = build
+        self._version = version
+        self._requests = 0
+        self._caches = dict()
+
+
+    def _warmUp(self):
+        """
+        Load everything a build needs up front so the first request does not pay for it.
+        """
+        from PIL import Image
+        from imm.cli import commandline as Cli
+
+        self._logr.info("Loading Pillow plugins...")
+        Image.init()
+
+        # builds and caches the command line parser
+        Cli.parseCmdLine(self._version, [])
+
+
+    def serve(self):
+        """
+        Serve build requests until interrupted. Returns a RETURN CODE.
+        """
+        if not hasattr(socket, 'AF_UNIX'):
+            self._logr.fatal("The build daemon requires Unix domain sockets which are not available on this platform.")
+            return DAEMON_ERROR
+
+        if os.path.exists(self._socket_path):
+            # A socket file left behind by a daemon that was killed is removed,
+            # but a socket that still accepts connections belongs to a live daemon.
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self._socket_path)
+                except OSError:
+                    self._logr.warning("Removing stale daemon socket '%s'" % self._socket_path)
+                    os.remove(self._socket_path)
+                else:
+                    self._logr.fatal("A build daemon is already listening on '%s'" % self._socket_path)
+                    return DAEMON_ERROR
+
+        self._warmUp()
+
+        try:
+            server = socketserver.UnixStreamServer(self._socket_path, _RequestHandler)
+        except OSError as e:
+            self._logr.fatal("Unable to listen on '%s': %s" % (self._socket_path, e))
+            return DAEMON_ERROR
+
+        server.build_daemon = self
+
+        # Treat a polite kill like Ctrl-C so the socket file is cleaned up
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        self._logr.warning("Build daemon listening on '%s'" % self._socket_path)
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self._logr.warning("Build daemon stopped after %d request(s)" % self._requests)
+        finally:
+            server.server_close()
+            if os.path.exists(self._socket_path):
+                os.remove(self._socket_path)
+
+        return 0
+
+
+    def runRequest(self, argv, cwd):
+        """
+        Build the command line argv from the working directory cwd capturing
+        everything written to the console. Returns the reply dictionary.
+        """
+        from imm.cli import commandline as Cli
+
+        self._requests += 1
+        self._logr.info("Request #%d from '%s': %s" % (self._requests, cwd, argv))
+
+        out = io.StringIO()
+        err = io.StringIO()
+        status = 0
+
+        saved_cwd = os.getcwd()
+        saved_stream = self._logSubSystem.SetConsoleStream(err)
+        try:
+            os.chdir(cwd)
+            with redirect_stdout(out), redirect_stderr(err):
+                try:
+                    (args, cliparser) = Cli.parseCmdLine(self._version, argv)
+                    if args.daemon or args.help:
+                        err.write("The options --daemon and --help cannot be forwarded to the build daemon.\n")
+                        status = DAEMON_ERROR
+                    elif args.code == C.STDOUT or C.STDIN in (args.input or ()):
+                        # The daemon's own stdin and stdout are not the client's
+                        err.write("The options --code - and --input - cannot be forwarded to the build daemon.\n")
+                        status = DAEMON_ERROR
+                    else:
+                        self._build(args, cliparser, self._logSubSystem, argv, self._caches)
+                except SystemExit as e:
+                    if e.code is None:
+                        status = 0
+                    elif isinstance(e.code, int):
+                        status = e.code
+                    else:
+                        err.write("%s\n" % e.code)
+                        status = 1
+                except Exception as e:
+                    self._logr.exception("Build request failed: %s" % e)
+                    status = 1
+        except OSError as e:
+            err.write("Unable to change to the client's working directory '%s': %s\n" % (cwd, e))
+            status = DAEMON_ERROR
+        finally:
+            os.chdir(saved_cwd)
+            if saved_stream is not None:
+                self._logSubSystem.SetConsoleStream(saved_stream)
+            # --quiet removes the console handler for the rest of the process
+            self._logSubSystem.RestoreConsoleLogger()
+
+        # Not to hold the images of files removed since for the daemon's lifetime
+        for cache in self._caches.values():
+            cache.prune()
+
+        self._logr.info("Request #%d finished with return code %d" % (self._requests, status))
+
+        return { 'status' : status, 'stdout' : out.getvalue(), 'stderr' : err.getvalue() }
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Dependency files
+
+With --depfile FILE a build writes FILE in the Makefile syntax gcc -MD uses,
+which both Make (include FILE) and Ninja (depfile = FILE) read:
+
+    icons.py image_meta_data.py show.py: gfx/save.png gfx/open.png \
+      gfx/close.png
+
+Every file generated is a target, every image file written to MODULE is a
+dependency -- the archive itself for the members of a zip or tar --input. So
+are the directories scanned for image files, which change when a file is added
+to or removed from them, and the --config file declaring the build. The build
+tool then runs IMM again only when one of them changed.
+
+A directory a target is written to is left out, since writing the target
+changes it: a file added to it is only noticed once another dependency changed.
+
+Spaces are escaped with a backslash, '#' too, and '$' is doubled, as Make and
+Ninja expect.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os
+
+#-------------------------------------------------------------------------------
+# Dependencies are wrapped onto lines of about this many characters
+LINE_WIDTH = 78
+
+#-------------------------------------------------------------------------------
+def escapePath(path):
+    """
+    Returns path escaped for a Makefile rule.
+    """
+    return path.replace('$', '$$').replace('#', '\\#').replace(' ', '\\ ')
+
+
+#-------------------------------------------------------------------------------
+def formatDepfile(targets, dependencies):
+    """
+    Returns the text of the rule making targets depend on dependencies.
+    """
+    lines = list()
+    line = ' '.join(escapePath(target) for target in targets) + ':'
+    for dependency in dependencies:
+        dependency = escapePath(dependency)
+        if len(line) + 1 + len(dependency) > LINE_WIDTH:
+            lines.append(line + ' \\')
+            line = ' '
+        line += ' ' + dependency
+    lines.append(line)
+    return '\n'.join(lines) + '\n'
+
+
+#-------------------------------------------------------------------------------
+def dependencies(inputs, directories, config=None, written=()):
+    """
+    Returns the dependencies of the targets of a build: the files inputs read,
+    then the directories scanned but for those in written, the directories the
+    targets are written to, then the config file unless it is None.
+    """
+    written = set(os.path.abspath(directory) for directory in written)
+    deps = list(inputs)
+    deps.extend(directory for directory in directories if os.path.abspath(directory) not in written)
+    if config is not None:
+        deps.append(config)
+    return deps
+
+
+#-------------------------------------------------------------------------------
+def writeDepfile(path, targets, dependencies):
+    """
+    Write the depfile path atomically, so that a build tool never reads one
+    half written.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(formatDepfile(targets, dependencies))
+    os.replace(tmp_path, path)
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Input discovery
+
+Walks the --input roots with os.scandir() and yields the files found. The
+directory entry types returned by scandir are used wherever possible, so a
+plain file or directory costs no stat() call of its own. Directories are only
+stat()'ed, to detect cycles, when symbolic links to directories are followed.
+
+Each directory's entries are visited in name order so that the images of a
+MODULE are always generated in the same order whatever the file system.
+
+A root that is a zip or tar archive is scanned like a directory, see
+archives.py; the same --recursive, --include and --exclude rules apply to the
+paths of its members.
+
+The root '-' reads a list of roots from stdin, one per line or separated by
+NUL characters (as written by find -print0), so that a build system can hand
+over exactly the files that changed, the output of git diff --name-only for
+instance. A listed path that does not exist (a deleted file) is skipped.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os
+import os.path
+import sys
+
+from fnmatch import fnmatchcase
+
+#-------------------------------------------------------------------------------
+from imm.cli import archives
+from imm.cli import constants as C
+
+#-------------------------------------------------------------------------------
+# Symbolic link policies for --symlinks
+SYMLINKS_FOLLOW = 'follow'  # follow links to files and to directories
+SYMLINKS_FILES  = 'files'   # follow links to files, do not descend into linked directories
+SYMLINKS_SKIP   = 'skip'    # ignore every symbolic link
+
+SYMLINK_POLICIES = (SYMLINKS_FOLLOW, SYMLINKS_FILES, SYMLINKS_SKIP)
+
+DEFAULT_SYMLINKS = SYMLINKS_FILES
+
+#-------------------------------------------------------------------------------
+def matchesAny(relpath, patterns):
+    """
+    Returns True if the relative path relpath (using '/' separators) matches any
+    of the glob patterns. A pattern without a '/' is matched against the last
+    component of relpath only, so '*.png' matches 'icons/save.png'. As with the
+    fnmatch module a '*' also matches '/', so 'icons/*' matches 'icons/a/b.png'.
+    """
+    name = relpath.rsplit('/', 1)[-1]
+    for pattern in patterns:
+        if '/' in pattern:
+            if fnmatchcase(relpath, pattern):
+                return True
+        elif fnmatchcase(name, pattern):
+            return True
+    return False
+
+
+#-------------------------------------------------------------------------------
+def readFileList(stream):
+    """
+    Returns the list of the paths read from the binary stream, separated by NUL
+    characters if there is any, otherwise by newlines. Empty entries are left out.
+    """
+    data = stream.read()
+    if b'\0' in data:
+        entries = data.split(b'\0')
+    else:
+        entries = [ entry.rstrip(b'\r') for entry in data.split(b'\n') ]
+    return [ os.fsdecode(entry) for entry in entries if entry ]
+
+
+#-------------------------------------------------------------------------------
+class Discovery():
+    """
+    Yields the files below a list of --input roots.
+
+    recursive - descend into sub-directories
+    include   - glob patterns a file must match one of to be yielded (None for all files)
+    exclude   - glob patterns of files and directories to skip
+    symlinks  - one of SYMLINK_POLICIES
+    stdin     - the binary stream the root '-' reads the list of roots from,
+                by default sys.stdin.buffer
+
+    Directories maps each directory root to the list of the directories the
+    last scan of that root visited, the root first.
+    """
+    def __init__(self, recursive=False, include=None, exclude=None, symlinks=DEFAULT_SYMLINKS, stdin=None):
+        self._recursive = recursive
+        self._include = include or list()
+        self._exclude = exclude or list()
+        self._symlinks = symlinks
+        self._stdin = stdin
+        self.Directories = dict()
+
+
+    def scan(self, roots, data=True):
+        """
+        Yields the tuple (relpath, path) for each file below the roots, where
+        relpath is the file's path relative to its root using '/' separators.
+        A root that is a file yields itself with relpath being its file name,
+        unless it is an archive whose members are yielded as archives.ArchiveMember
+        paths. The root '-' yields what the roots listed on stdin yield.
+
+        data is passed to archives.scanArchive(), False only lists the members
+        of a tar archive without reading them.
+        """
+        for root in roots:
+            if root == C.STDIN:
+                stdin = self._stdin if self._stdin is not None else sys.stdin.buffer
+                listed = [ path for path in readFileList(stdin) if os.path.exists(path) ]
+                for found in self.scan(listed, data):
+                    yield found
+            elif os.path.isdir(root):
+                ancestors = set()
+                if self._symlinks == SYMLINKS_FOLLOW:
+                    st = os.stat(root)
+                    ancestors.add((st.st_dev, st.st_ino))
+                directories = self.Directories[root] = list()
+                for found in self._scanDirectory(root, '', ancestors, directories):
+                    yield found
+            elif archives.isArchive(root):
+                for found in archives.scanArchive(root, self._acceptMember, data):
+                    yield found
+            else:
+                yield (os.path.basename(root), root)
+
+
+    def _acceptMember(self, relpath):
+        """
+        Returns True if the archive member relpath would have been yielded had
+        the archive been extracted to a directory root.
+        """
+        dirs = relpath.split('/')[:-1]
+        if dirs and not self._recursive:
+            return False
+
+        for i in range(len(dirs)):
+            if matchesAny('/'.join(dirs[:i+1]), self._exclude):
+                return False
+
+        if self._include and not matchesAny(relpath, self._include):
+            return False
+
+        return not matchesAny(relpath, self._exclude)
+
+
+    def _scanDirectory(self, path, relpath, ancestors, directories):
+        follow = self._symlinks == SYMLINKS_FOLLOW
+        directories.append(path)
+
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+
+        subdirs = list()
+        for entry in entries:
+            entry_relpath = relpath + '/' + entry.name if relpath else entry.name
+
+            if self._symlinks == SYMLINKS_SKIP and entry.is_symlink():
+                continue
+
+            if entry.is_dir(follow_symlinks=follow):
+                if self._recursive and not matchesAny(entry_relpath, self._exclude):
+                    subdirs.append((entry, entry_relpath))
+                continue
+
+            # For anything but a symbolic link the entry type is already known
+            if not entry.is_file():
+                continue
+
+            if self._include and not matchesAny(entry_relpath, self._include):
+                continue
+
+            if matchesAny(entry_relpath, self._exclude):
+                continue
+
+            yield (entry_relpath, entry.path)
+
+        for (entry, entry_relpath) in subdirs:
+            key = None
+            if follow:
+                # Only when links are followed can a directory be its own ancestor
+                st = entry.stat()
+                key = (st.st_dev, st.st_ino)
+                if key in ancestors:
+                    continue
+                ancestors.add(key)
+
+            for found in self._scanDirectory(entry.path, entry_relpath, ancestors, directories):
+                yield found
+
+            if key is not None:
+                ancestors.discard(key)
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
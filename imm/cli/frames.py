@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Multi-frame and multi-size images
+
+Animated GIF, APNG and WebP files and multi-page TIFF files hold several
+frames, ICO files hold the same icon at several sizes. By default only the
+first frame (or the largest size) is generated, as always; --frames makes
+the other frames available too:
+
+    split - every distinct frame gets image data of its own
+    apng  - the animation is re-encoded as one APNG
+    webp  - the animation is re-encoded as one animated WebP (lossless)
+
+Only animations are re-encoded, the frames of a TIFF or ICO file are always
+split.
+
+Frames are decoded one at a time by seeking the opened image, so with split
+the frames of a long animation are never all held in memory, and the default
+of only using the first frame never decodes the others. Identical frames are
+found by hashing their pixels; with split they share one image data entry.
+
+Each frame is described by a dictionary with its index, its offset (the
+time in milliseconds from the start of the animation it is shown at), its
+duration in milliseconds, its width and its height.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import hashlib
+
+from io import BytesIO
+
+#-------------------------------------------------------------------------------
+from imm import imagedata as GID
+
+#-------------------------------------------------------------------------------
+# --frames modes
+FRAMES_FIRST = 'first'
+FRAMES_SPLIT = 'split'
+FRAMES_APNG  = 'apng'
+FRAMES_WEBP  = 'webp'
+
+FRAMES_MODES = (FRAMES_FIRST, FRAMES_SPLIT, FRAMES_APNG, FRAMES_WEBP)
+
+DEFAULT_FRAMES = FRAMES_FIRST
+
+# Formats whose frames are shown one after the other for a duration
+ANIMATION_FORMATS = ('GIF', 'PNG', 'WEBP')
+
+#-------------------------------------------------------------------------------
+def frameCount(img):
+    """
+    Returns the number of frames, or of sizes for an ICO file, of the opened image.
+    """
+    if img.format == 'ICO':
+        return len(img.info.get('sizes', ())) or 1
+    return getattr(img, 'n_frames', 1)
+
+
+#-------------------------------------------------------------------------------
+def iterFrames(img):
+    """
+    Yields the tuple (index, frame, duration) for each frame of the opened
+    image, seeking to and decoding one frame at a time. The sizes of an ICO
+    file are yielded from the largest to the smallest with no duration.
+    """
+    if img.format == 'ICO':
+        for (index, size) in enumerate(sorted(img.info['sizes'], reverse=True)):
+            yield (index, img.ico.getimage(size), 0)
+        return
+
+    for index in range(frameCount(img)):
+        img.seek(index)
+        yield (index, img, img.info.get('duration', 0))
+
+    img.seek(0)
+
+
+#-------------------------------------------------------------------------------
+def describeFrames(img):
+    """
+    Returns the list of the dictionaries describing each frame of img.
+    """
+    frames = list()
+    offset = 0
+    for (index, frame, duration) in iterFrames(img):
+        frames.append({
+            'Index'    : index,
+            'Offset'   : offset,
+            'Duration' : duration,
+            'Width'    : frame.size[0],
+            'Height'   : frame.size[1],
+        })
+        offset += duration
+    return frames
+
+
+#-------------------------------------------------------------------------------
+def splitFrames(img):
+    """
+    Returns the tuple (frames, frame_data) where frames is the list of the
+    dictionaries describing each frame of img, each with a 'Data' key giving
+    the index in frame_data of the PNG encoded frame. Identical frames share
+    the same frame_data entry. frame_data[0], the first frame, is None since
+    it is the image data of img itself, whatever codec that is encoded with.
+    """
+    frames = list()
+    frame_data = list()
+    seen = dict()
+    offset = 0
+    for (index, frame, duration) in iterFrames(img):
+        digest = hashlib.sha1(frame.mode.encode('ascii') + frame.tobytes()).hexdigest()
+        if digest not in seen:
+            seen[digest] = len(frame_data)
+            frame_data.append(GID.encode_image(frame, 'PNG') if frame_data else None)
+        frames.append({
+            'Index'    : index,
+            'Offset'   : offset,
+            'Duration' : duration,
+            'Width'    : frame.size[0],
+            'Height'   : frame.size[1],
+            'Data'     : seen[digest],
+        })
+        offset += duration
+    return (frames, frame_data)
+
+
+#-------------------------------------------------------------------------------
+def isAnimation(img):
+    """
+    Returns True if img is an animation rather than, say, the pages of a TIFF
+    file or the sizes of an ICO file.
+    """
+    return img.format in ANIMATION_FORMATS and getattr(img, 'is_animated', False)
+
+
+#-------------------------------------------------------------------------------
+def encodeAnimation(img, mode):
+    """
+    Returns the tuple (image_data, frames) of the animation img re-encoded as
+    an APNG or an animated WebP (mode FRAMES_APNG or FRAMES_WEBP).
+
+    Pillow reads the frames from img itself, seeking one at a time, and its
+    APNG writer merges consecutive identical frames adding up their durations.
+    """
+    frames = describeFrames(img)
+    durations = [ frame['Duration'] for frame in frames ]
+
+    imageBuf = BytesIO()
+    try:
+        if mode == FRAMES_APNG:
+            img.save(imageBuf, 'PNG', save_all=True, duration=durations, loop=img.info.get('loop', 0))
+        else:
+            img.save(imageBuf, 'WEBP', save_all=True, lossless=True, duration=durations, loop=img.info.get('loop', 0))
+        image_data = imageBuf.getvalue()
+    finally:
+        imageBuf.close()
+        img.seek(0)
+
+    return (image_data, frames)
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
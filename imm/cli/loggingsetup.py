@@ -107,6 +107,23 @@ class Setup():
         logging.getLogger().removeHandler(self._ch)
 
 
+    def RestoreConsoleLogger(self):
+        """
+        Re-attach the console handler removed by QuietConsoleLogger().
+        """
+        logging.getLogger().addHandler(self._ch)
+
+
+    def SetConsoleStream(self, stream):
+        """
+        Redirect the console handler to stream and return the previous stream.
+
+        Used by the build daemon to send a build's console output back to the
+        client that requested the build.
+        """
+        return self._ch.setStream(stream)
+
+
 
 #-------------------------------------------------------------------------------
 if __name__ == "__main__":
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Extra outputs
+
+Besides MODULE a build may write other files made from the same images:
+
+    --css FILE            a style sheet with a rule per image whose
+                          background-image is the image as a data URI,
+                          encoded with --css-codec
+    --contact-sheet FILE  a PNG contact sheet of a thumbnail of every image,
+                          made to fit in --contact-size
+
+Each image is decoded once, in workers.encodeImage(), which hands the decoded
+image to renderOutputs() to make the data each output needs, with the
+output's own settings, alongside MODULE's image data. The output writers then
+only collect that data as CodeGen writes the images to MODULE; none of them
+opens an image file, so the decode work stays that of one build whatever the
+number of outputs.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os
+import math
+import base64
+
+from abc import ABC, abstractmethod
+
+#-------------------------------------------------------------------------------
+from PIL import Image
+
+#-------------------------------------------------------------------------------
+from imm import imagecodecs
+
+#-------------------------------------------------------------------------------
+OUTPUT_CSS = 'css'
+OUTPUT_CONTACT_SHEET = 'contact-sheet'
+
+# --css-codec CODEC, the codecs a browser decodes, by their MIME type
+CSS_MIME_TYPES = {
+    'png'           : 'image/png',
+    'webp-lossless' : 'image/webp',
+    'webp'          : 'image/webp',
+    'jpeg'          : 'image/jpeg',
+    'gif'           : 'image/gif',
+}
+
+DEFAULT_CSS_CODEC = 'png'
+
+# --contact-size SIZE
+DEFAULT_CONTACT_SIZE = (64, 64)
+
+# Pixels between the thumbnails of a contact sheet
+CONTACT_PADDING = 4
+
+CSS_RULE_TEMPLATE = """.%s {
+    width: %dpx;
+    height: %dpx;
+    background-image: url(data:%s;base64,%s);
+}
+"""
+
+#-------------------------------------------------------------------------------
+def outputSettings(args):
+    """
+    Returns the tuple of the (output, settings) tuples of the extra outputs
+    the command line args asks for, passed to workers.encodeImage() as its
+    outputs argument; empty if it asks for none.
+    """
+    settings = list()
+    if args.css:
+        settings.append((OUTPUT_CSS, (args.css_codec, args.min_psnr)))
+    if args.contact_sheet:
+        settings.append((OUTPUT_CONTACT_SHEET, args.contact_size))
+    return tuple(settings)
+
+
+#-------------------------------------------------------------------------------
+def renderOutputs(img, outputs):
+    """
+    Returns the dictionary of the data of the decoded image img for each
+    (output, settings) tuple of outputs:
+
+        css           - the tuple (MIME type, image data)
+        contact-sheet - the tuple (mode, size, pixels) of the thumbnail
+    """
+    rendered = dict()
+    for (output, settings) in outputs:
+        if output == OUTPUT_CSS:
+            (codec, min_psnr) = settings
+            (codec, data) = imagecodecs.encode_with_codec(img, codec, candidates=tuple(CSS_MIME_TYPES), min_psnr=min_psnr)
+            rendered[output] = (CSS_MIME_TYPES[codec], data)
+        elif output == OUTPUT_CONTACT_SHEET:
+            thumbnail = img.convert('RGBA')
+            thumbnail.thumbnail(settings)
+            rendered[output] = (thumbnail.mode, thumbnail.size, thumbnail.tobytes())
+    return rendered
+
+
+#-------------------------------------------------------------------------------
+class OutputWriter(ABC):
+    """
+    Collects the data of one extra output as the images are written to MODULE
+    and writes the output file with close(); written to a temporary file
+    first, so that a failed build leaves no half written output behind.
+
+    path - the output file
+    """
+    OUTPUT = None
+
+    def __init__(self, path):
+        self.Path = path
+        self._tmp_path = path + '.tmp'
+
+
+    @abstractmethod
+    def add(self, name, package, width, height, data):
+        """
+        Collect the data renderOutputs() made of the image name, of width by
+        height pixels, in package.
+        """
+
+
+    @abstractmethod
+    def write(self, f):
+        """
+        Write the output collected to the binary file object f.
+        """
+
+
+    def close(self):
+        with open(self._tmp_path, 'wb') as f:
+            self.write(f)
+        os.replace(self._tmp_path, self.Path)
+
+
+    def abandon(self):
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+class CssWriter(OutputWriter):
+    """
+    The --css style sheet, whose rules are named after the images, prefixed
+    by their package names with --layout.
+    """
+    OUTPUT = OUTPUT_CSS
+
+    def __init__(self, path):
+        OutputWriter.__init__(self, path)
+        self._rules = list()
+
+
+    def add(self, name, package, width, height, data):
+        (mime_type, image_data) = data
+        self._rules.append(CSS_RULE_TEMPLATE % ('-'.join(package + (name,)), width, height, mime_type,
+                                                base64.b64encode(image_data).decode('ascii')))
+
+
+    def write(self, f):
+        f.write('\n'.join(self._rules).encode('ascii'))
+
+
+class ContactSheetWriter(OutputWriter):
+    """
+    The --contact-sheet PNG, the thumbnails laid out in rows in the order the
+    images were written, each centered in a cell of --contact-size.
+    """
+    OUTPUT = OUTPUT_CONTACT_SHEET
+
+    def __init__(self, path, size):
+        OutputWriter.__init__(self, path)
+        self._size = size
+        self._thumbnails = list()
+
+
+    def add(self, name, package, width, height, data):
+        (mode, size, pixels) = data
+        self._thumbnails.append(Image.frombytes(mode, size, pixels))
+
+
+    def write(self, f):
+        columns = max(1, math.ceil(math.sqrt(len(self._thumbnails))))
+        rows = max(1, math.ceil(len(self._thumbnails) / columns))
+        (cell_width, cell_height) = (self._size[0] + CONTACT_PADDING, self._size[1] + CONTACT_PADDING)
+
+        sheet = Image.new('RGBA', (columns * cell_width + CONTACT_PADDING, rows * cell_height + CONTACT_PADDING), (0, 0, 0, 0))
+        for (index, thumbnail) in enumerate(self._thumbnails):
+            (row, column) = divmod(index, columns)
+            x = CONTACT_PADDING + column * cell_width + (self._size[0] - thumbnail.width) // 2
+            y = CONTACT_PADDING + row * cell_height + (self._size[1] - thumbnail.height) // 2
+            sheet.paste(thumbnail, (x, y))
+        sheet.save(f, 'PNG')
+
+
+#-------------------------------------------------------------------------------
+def makeWriters(args):
+    """
+    Returns the list of the OutputWriter objects of the extra outputs the
+    command line args asks for.
+    """
+    writers = list()
+    if args.css:
+        writers.append(CssWriter(args.css))
+    if args.contact_sheet:
+        writers.append(ContactSheetWriter(args.contact_sheet, args.contact_size))
+    return writers
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Streaming build pipeline
+
+Images flow through four stages connected by bounded queues:
+
+    discover --> read --> encode --> write
+
+    discover - iterates the images to process (a generator, typically still
+               scanning the input directory) in its own thread
+    read     - reads each image file's bytes in its own thread
+    encode   - decodes and re-encodes the bytes, in a pool of worker processes
+               if --jobs is used (see workers.py)
+    write    - writes the encoded image data with CodeGen.processImage() in
+               the calling thread
+
+Since every queue is bounded, a stage that gets ahead of the next one blocks,
+so the memory used is set by the queue DEPTH and not by the number of images.
+Results are written in the order the images were discovered whatever the
+order the workers finish them in.
+
+With a timeout or a memory limit every image is encoded in a worker process,
+even without --jobs. An image taking longer than the timeout gets its pool
+killed and replaced; the images the other workers were encoding are simply
+submitted again. When a worker crashes, the images it may have been encoding
+are encoded again one at a time, to find out which of them crashed it. An
+image that fails raises ImageFailedError, or with keep_going is recorded in
+Failures and left out of MODULE.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os
+import time
+import zipfile
+import threading
+import queue
+
+from collections import deque
+from concurrent import futures
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+#-------------------------------------------------------------------------------
+from imm.cli import workers
+from imm.cli import archives
+
+#-------------------------------------------------------------------------------
+DEFAULT_DEPTH = 16
+
+# How long a blocked stage waits before checking whether the build was aborted
+POLL_SECONDS = 0.1
+
+# An image file larger than this is not read by the read stage, the encoder
+# reads it itself so that only the pixels it decodes are held in memory (see
+# --max-size) rather than the whole file as well
+READ_BYTES_LIMIT = 64 * 1024 * 1024
+
+# End of stream marker passed from one stage to the next
+_DONE = object()
+
+#-------------------------------------------------------------------------------
+class ImageFailedError(Exception):
+    """
+    An image file could not be read or encoded, or its encoder timed out or
+    crashed. The image file path is the attribute path, the reason the
+    attribute reason.
+    """
+    def __init__(self, path, reason):
+        super().__init__("Image file '%s' failed: %s" % (path, reason))
+        self.path = path
+        self.reason = reason
+
+
+#-------------------------------------------------------------------------------
+def fileStamp(st):
+    """
+    Returns the stamp of an os.stat_result used to tell whether a file changed.
+    """
+    return (st.st_mtime_ns, st.st_size)
+
+
+#-------------------------------------------------------------------------------
+class EncodeCache():
+    """
+    Remembers the encoded result of each image file by path, together with
+    the stamp (see fileStamp()) the file had when it was encoded, so that an
+    unchanged image file is neither read nor encoded again by a later build
+    in the same process -- see --watch.
+    """
+    def __init__(self):
+        self._entries = dict()
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+    def lookup(self, path, stamp):
+        """
+        Returns the encoded result cached for path, or None if there is none
+        or the file's stamp has changed since.
+        """
+        entry = self._entries.get(path)
+        if entry is None or entry[0] != stamp:
+            return None
+        return entry[1]
+
+
+    def store(self, path, stamp, encoded):
+        self._entries[path] = (stamp, encoded)
+
+
+    def retain(self, paths):
+        """
+        Forget every cached result whose path is not in paths.
+        """
+        for path in set(self._entries) - set(paths):
+            del self._entries[path]
+
+
+    def prune(self):
+        """
+        Forget every cached result whose file, or archive for an archive
+        member, no longer exists.
+        """
+        self.retain([ path for path in self._entries if os.path.exists(getattr(path, 'archive', path)) ])
+
+
+#-------------------------------------------------------------------------------
+class Pipeline():
+    """
+    logger  - a logging module logger object created by the caller
+    codegen - the codegenerator.CodeGen object the images are written with
+    jobs    - number of worker processes used to encode, see workers.getPool()
+    depth   - capacity of each queue between stages, and the number of images
+              handed to the worker processes that have not yet been written;
+              at least 1, a depth below jobs leaves some workers idle
+    cache   - an EncodeCache consulted before reading an image file and
+              updated with every image encoded, or None
+    encode  - the function encoding the bytes of an image file, by default
+              workers.encodeImage(); must be picklable if jobs is not 1, a
+              functools.partial() of workers.encodeImage() for instance
+    timeout - the most seconds a worker may spend encoding one image, or None
+    memory_limit - the most bytes of memory each worker may use, or None
+    keep_going   - if True, an image that fails is recorded in Failures and
+                   the build goes on without it
+    """
+    def __init__(self, logger, codegen, jobs=1, depth=DEFAULT_DEPTH, cache=None, encode=workers.encodeImage,
+                 timeout=None, memory_limit=None, keep_going=False):
+        self._logr = logger.getChild('Pipeline')
+        self._codegen = codegen
+        self._cache = cache
+        self._encode = encode
+        self._hits = 0
+        self._jobs = workers.resolveJobs(jobs)
+        if depth < 1:
+            raise ValueError("The pipeline depth must be at least 1, not %d" % depth)
+        self._depth = depth
+
+        self._timeout = timeout
+        self._memory_limit = memory_limit
+        self._keep_going = keep_going
+        self._failures = list()
+        # Number of images at the head of the line still to be encoded one
+        # at a time since a worker crashed, see _collect()
+        self._isolating = 0
+        self._pool = None
+
+        self._readQ = queue.Queue(maxsize=self._depth)
+        self._encodeQ = queue.Queue(maxsize=self._depth)
+        self._writeQ = queue.Queue(maxsize=self._depth)
+
+        self._abort = threading.Event()
+        self._error = None
+
+        self._count = 0
+
+
+    @property
+    def Count(self):
+        """
+        The number of images written so far.
+        """
+        return self._count
+
+
+    @property
+    def Failures(self):
+        """
+        The list of (image_file_path, reason) of the images that failed.
+        """
+        return self._failures
+
+
+    def _imageFailed(self, image, reason):
+        """
+        Record that image failed for reason; raises ImageFailedError unless
+        the build keeps going.
+        """
+        image_file_path = image[1]
+        self._failures.append((image_file_path, str(reason)))
+        if not self._keep_going:
+            raise ImageFailedError(image_file_path, reason)
+        self._logr.error("Image file '%s' failed and is skipped: %s" % (image_file_path, reason))
+
+
+    def _fail(self, e):
+        """
+        Record the first exception raised by a stage and stop every stage.
+        """
+        if self._error is None:
+            self._error = e
+        self._abort.set()
+
+
+    def _put(self, q, item):
+        """
+        Put item on the queue q, blocking while it is full. Returns False if the
+        build was aborted while blocked.
+        """
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+    def _get(self, q):
+        """
+        Get the next item from the queue q; returns _DONE if the build was aborted.
+        """
+        while not self._abort.is_set():
+            try:
+                return q.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                pass
+        return _DONE
+
+
+    def _discoverStage(self, images):
+        try:
+            for image in images:
+                if not self._put(self._readQ, image):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(self._readQ, _DONE)
+
+
+    def _readStage(self):
+        try:
+            while True:
+                image = self._get(self._readQ)
+                if image is _DONE:
+                    break
+                image_file_path = image[1]
+                member = isinstance(image_file_path, archives.ArchiveMember)
+                try:
+                    with archives.openFile(image_file_path) as f:
+                        if member:
+                            stamp = image_file_path.stamp
+                        else:
+                            stamp = fileStamp(os.fstat(f.fileno()))
+                        encoded = None
+                        if self._cache is not None:
+                            encoded = self._cache.lookup(image_file_path, stamp)
+                        if encoded is not None:
+                            image_file = None
+                            self._hits += 1
+                        elif member or stamp[1] <= READ_BYTES_LIMIT:
+                            # A worker cannot open an archive member by path
+                            image_file = f.read()
+                        else:
+                            image_file = image_file_path
+                    if member:
+                        image_file_path.release()
+                except (OSError, zipfile.BadZipFile) as e:
+                    self._imageFailed(image, e)
+                    continue
+                if not self._put(self._encodeQ, (image, stamp, image_file, encoded)):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._put(self._encodeQ, _DONE)
+
+
+    def _submit(self, pending):
+        """
+        Hand the images of pending not yet handed to a worker to the pool. With
+        a timeout only as many are handed over as there are workers, so that an
+        image starts encoding as soon as it is submitted; after a worker crashed,
+        one at a time.
+        """
+        if self._isolating:
+            limit = 1
+        elif self._timeout is not None:
+            limit = self._jobs
+        else:
+            limit = len(pending)
+
+        running = sum(1 for entry in pending if entry[3] is not None and not entry[3].done())
+        for entry in pending:
+            if running >= limit:
+                break
+            if entry[3] is None:
+                entry[3] = self._pool.submit(self._encode, entry[2])
+                entry[4] = time.monotonic()
+                running += 1
+
+
+    def _restartPool(self, pending):
+        """
+        Kill the pool and start a new one; the images of pending that were not
+        encoded yet will be submitted again.
+        """
+        workers.killPool(self._jobs, self._memory_limit)
+        self._pool = workers.getPool(self._jobs, self._memory_limit, isolate=True)
+
+        for entry in pending:
+            future = entry[3]
+            if future is not None and not (future.done() and future.exception() is None):
+                entry[3] = None
+
+
+    def _collect(self, pending):
+        """
+        Wait for the image at the head of pending to be encoded, then hand it to
+        the write stage. Returns False if the build was aborted.
+        """
+        entry = pending[0]
+        (image, stamp) = entry[:2]
+
+        while True:
+            if self._abort.is_set():
+                return False
+
+            self._submit(pending)
+            future = entry[3]
+            if not futures.wait((future,), timeout=POLL_SECONDS).done:
+                if self._timeout is not None and time.monotonic() - entry[4] > self._timeout:
+                    pending.popleft()
+                    self._restartPool(pending)
+                    self._imageFailed(image, "encoding took more than %s seconds" % self._timeout)
+                    break
+                continue
+
+            error = future.exception()
+            if error is None:
+                pending.popleft()
+                if not self._put(self._writeQ, (image, stamp, future.result())):
+                    return False
+                break
+
+            if not isinstance(error, BrokenProcessPool):
+                pending.popleft()
+                self._imageFailed(image, error)
+                break
+
+            # A worker crashed (a segmentation fault or the memory limit); any
+            # image the pool had not finished may have crashed it.
+            suspects = [ n for (n, other) in enumerate(pending)
+                         if other[3] is not None and not (other[3].done() and other[3].exception() is None) ]
+            if suspects == [0]:
+                pending.popleft()
+                self._restartPool(pending)
+                self._imageFailed(image, "its worker process crashed")
+                break
+            self._logr.warning("A worker process crashed, encoding %d image(s) again one at a time" % len(suspects))
+            self._restartPool(pending)
+            self._isolating = suspects[-1] + 1
+
+        if self._isolating:
+            self._isolating -= 1
+        return True
+
+
+    def _encodeStage(self):
+        isolate = self._timeout is not None or self._memory_limit is not None
+        self._pool = workers.getPool(self._jobs, self._memory_limit, isolate)
+        # [image, stamp, image_file, future, time submitted] of the images in
+        # the order they are to be written; future is None until submitted
+        pending = deque()
+        try:
+            while True:
+                entry = self._get(self._encodeQ)
+                if entry is _DONE:
+                    break
+                (image, stamp, image_file, encoded) = entry
+                if self._pool is None:
+                    if encoded is None:
+                        try:
+                            encoded = self._encode(image_file)
+                        except Exception as e:
+                            self._imageFailed(image, e)
+                            continue
+                    if not self._put(self._writeQ, (image, stamp, encoded)):
+                        break
+                    continue
+
+                future = None
+                if encoded is not None:
+                    # A cached result still has to wait its turn to be written
+                    future = Future()
+                    future.set_result(encoded)
+                pending.append([image, stamp, image_file, future, None])
+                self._submit(pending)
+                # Keep the workers busy, but never let more than depth results
+                # pile up waiting for the one at the head of the line.
+                if len(pending) >= self._depth:
+                    if not self._collect(pending):
+                        break
+
+            while pending and not self._abort.is_set():
+                self._collect(pending)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            for entry in pending:
+                if entry[3] is not None:
+                    entry[3].cancel()
+            self._put(self._writeQ, _DONE)
+
+
+    def run(self, images):
+        """
+        Process every (image_name, image_file_path, image_type, package) tuple
+        yielded by the iterable images. Returns the number of images written.
+
+        An exception raised by any stage stops the pipeline and is re-raised here.
+        """
+        self._logr.info("Starting pipeline with %d encoder(s) and queue depth %d" % (self._jobs, self._depth))
+
+        threads = [
+            threading.Thread(target=self._discoverStage, args=(images,), name='imm-discover', daemon=True),
+            threading.Thread(target=self._readStage, name='imm-read', daemon=True),
+            threading.Thread(target=self._encodeStage, name='imm-encode', daemon=True),
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            while True:
+                entry = self._get(self._writeQ)
+                if entry is _DONE:
+                    break
+                ((image_name, image_file_path, image_type, package), stamp, encoded) = entry
+                self._codegen.processImage(image_name, image_file_path, image_type, encoded, package)
+                if self._cache is not None:
+                    self._cache.store(image_file_path, stamp, encoded)
+                self._count += 1
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            # On success every stage has already finished; on failure the
+            # abort event makes each of them give up promptly.
+            for thread in threads:
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+        self._logr.info("Pipeline wrote %d image(s), %d of them from the cache, %d image(s) failed" % (self._count, self._hits, len(self._failures)))
+
+        return self._count
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Build planning
+
+Works out what a build would do without doing it: which files would be
+processed, renamed by --fixident or ignored, and roughly how large MODULE
+would be and how long encoding would take.
+
+Only image headers are read. PIL.Image.open() is lazy -- it parses the header
+to learn the format, size and mode but does not decode any pixel data until
+load() is called, which the planner never does. Headers are read by a pool of
+threads since the work is dominated by waiting on the file system.
+
+The estimates are deliberately simple rules of thumb, good enough to decide
+whether a build should be sharded, not to predict it to the byte.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+#-------------------------------------------------------------------------------
+from PIL import Image
+
+#-------------------------------------------------------------------------------
+from imm.cli import workers
+from imm.cli import archives
+
+#-------------------------------------------------------------------------------
+# repr() of compressed image data: 95 printable bytes take one character (a
+# few two), the rest take four ('\x00') -- about 2.85 characters per byte.
+REPR_EXPANSION = 2.85
+
+# Characters of "<name>_data = b''\n" around each image's data, not counting the name
+ENTRY_OVERHEAD = 12
+
+# PNG data size as a fraction of the raw pixel data size for images that are
+# not already PNG files (PNG files are assumed to re-encode to their own size)
+PNG_RATIO = 0.5
+
+# Seconds to decode and PNG-encode one million pixels on one core
+SECONDS_PER_MEGAPIXEL = 0.05
+
+#-------------------------------------------------------------------------------
+def readHeader(image_file_path):
+    """
+    Returns a dictionary of what the header of image_file_path tells us; its
+    'Error' is why the file could not be read, removed since it was found for
+    instance.
+    """
+    header = dict()
+    try:
+        if isinstance(image_file_path, archives.ArchiveMember):
+            header['FileBytes'] = image_file_path.stamp[1]
+        else:
+            header['FileBytes'] = os.stat(image_file_path).st_size
+        with archives.openFile(image_file_path) as f, Image.open(f) as img:
+            header['Format'] = img.format
+            header['Mode'] = img.mode
+            (header['Width'], header['Height']) = img.size
+            header['Bands'] = len(img.getbands())
+    except Exception as e:
+        header['Error'] = str(e)
+    return header
+
+
+#-------------------------------------------------------------------------------
+def estimateDataBytes(header):
+    """
+    Returns the estimated size in bytes of an image's PNG data.
+    """
+    if header['Format'] == 'PNG':
+        return header['FileBytes']
+    return int(header['Width'] * header['Height'] * header['Bands'] * PNG_RATIO)
+
+
+#-------------------------------------------------------------------------------
+class Planner():
+    """
+    logger - a logging module logger object created by the caller
+    jobs   - the --jobs JOBS the build would use, for the wall clock estimate
+    """
+    def __init__(self, logger, jobs=1):
+        self._logr = logger.getChild('Planner')
+        self._jobs = workers.resolveJobs(jobs)
+
+
+    def plan(self, images, ignoredFiles, illegalIdentifiers, identmappings):
+        """
+        Returns the plan, a dictionary ready to be emitted as JSON, for the
+        (image_name, image_file_path, image_type, package) tuples of images.
+
+        ignoredFiles, illegalIdentifiers and identmappings are filled in by
+        the images generator (see immcli.selectImages()) so they are read
+        only once images is exhausted.
+        """
+        images = list(images)
+        self._logr.info("Reading the headers of %d image file(s)..." % len(images))
+
+        with ThreadPoolExecutor() as pool:
+            headers = list(pool.map(readHeader, [ image[1] for image in images ]))
+
+        planned = list()
+        module_bytes = 0
+        megapixels = 0.0
+        unreadable = 0
+        for ((image_name, image_file_path, image_type, package), header) in zip(images, headers):
+            entry = {
+                'name'    : image_name.lower(),
+                'path'    : image_file_path,
+                'package' : '.'.join(package),
+            }
+            entry.update(header)
+            planned.append(entry)
+
+            if 'Error' in header:
+                unreadable += 1
+                continue
+
+            module_bytes += int(estimateDataBytes(header) * REPR_EXPANSION) + len(entry['name']) + ENTRY_OVERHEAD
+            megapixels += header['Width'] * header['Height'] / 1e6
+
+        if len(illegalIdentifiers) > 0:
+            return_code = 5
+        elif len(planned) == 0:
+            return_code = 6
+        else:
+            return_code = 0
+
+        encode_seconds = megapixels * SECONDS_PER_MEGAPIXEL
+
+        return {
+            'return_code' : return_code,
+            'images'      : planned,
+            'renamed'     : identmappings,
+            'illegal'     : illegalIdentifiers,
+            'ignored'     : ignoredFiles,
+            'estimate'    : {
+                'images'              : len(planned) - unreadable,
+                'unreadable'          : unreadable,
+                'megapixels'          : round(megapixels, 3),
+                'module_bytes'        : module_bytes,
+                'encode_cpu_seconds'  : round(encode_seconds, 3),
+                'encode_wall_seconds' : round(encode_seconds / self._jobs, 3),
+                'jobs'                : self._jobs,
+            },
+        }
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
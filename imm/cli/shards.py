@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Sharded builds
+
+A build can be split across machines: each of N processes is given the same
+command line plus --shard i/N, and encodes only the images of shard i into a
+partial result file, <MODULE>.shard<i>of<N>.immpart in CODE_PATH. A final
+--merge of the N partial results generates MODULE from the image data they
+hold, without decoding any image again; it is the same MODULE the build
+would have generated on its own.
+
+Images are assigned to shards by a stable hash (SHA-1) of their image name
+and package, so every process agrees on the partition whatever the machine,
+and the images competing for the same image name always land in the same
+shard. Each image keeps its ordinal, its position among all the images of
+the build, so that the merge writes them in the usual order.
+
+A partial result is a sequence of pickles: a header with the shard, the
+number of shards and the encoding options, one record per image and a
+trailer with the files ignored, the illegal names and the failures. Partial
+results are build artifacts to be trusted like the code being built.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os
+import heapq
+import pickle
+import hashlib
+import argparse
+
+#-------------------------------------------------------------------------------
+PARTIAL_MAGIC = b'IMMPART1'
+PARTIAL_SUFFIX = '.immpart'
+
+# The command line options recorded in a partial result as they change the
+# image data encoded, applied by --merge
+ENCODING_OPTIONS = ('codec', 'min_psnr', 'frames', 'max_size', 'max_pixels', 'variant', 'resample', 'fixident',
+                    'css_codec', 'contact_size', 'stats')
+
+#-------------------------------------------------------------------------------
+class ShardError(Exception):
+    pass
+
+
+#-------------------------------------------------------------------------------
+def parseShard(text):
+    """
+    Returns the tuple (i, N) of the --shard i/N argument text. Meant to be
+    used as an argparse type.
+    """
+    try:
+        (index, count) = [ int(part) for part in text.split('/') ]
+    except ValueError:
+        raise argparse.ArgumentTypeError("'%s' is not a shard such as 1/4" % text)
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError("'%s' is not a shard i/N with i from 1 to N" % text)
+    return (index, count)
+
+
+#-------------------------------------------------------------------------------
+def shardOf(key, count):
+    """
+    Returns the shard, from 1 to count, of the image whose key is the tuple of
+    its package names and lower cased image name.
+    """
+    digest = hashlib.sha1('/'.join(key).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count + 1
+
+
+#-------------------------------------------------------------------------------
+def partialPath(code_path, module, shard):
+    """
+    Returns the path of the partial result of shard (i, N) of MODULE.
+    """
+    return os.path.join(code_path, '%s.shard%dof%d%s' % ((module,) + shard + (PARTIAL_SUFFIX,)))
+
+
+#-------------------------------------------------------------------------------
+class PartialWriter():
+    """
+    Writes the partial result of one shard; it stands in for the CodeGen the
+    build pipeline writes the images with.
+
+    path    - the partial result file
+    shard   - the tuple (i, N)
+    options - the dictionary of the ENCODING_OPTIONS of the build
+    """
+    def __init__(self, path, shard, options):
+        self._path = path
+        self._shard = shard
+        self._ordinals = dict()
+        self._inputs = dict()
+        self._fp = open(path, 'wb')
+        self._fp.write(PARTIAL_MAGIC)
+        pickle.dump({'Shard' : shard, 'Options' : options}, self._fp, pickle.HIGHEST_PROTOCOL)
+
+
+    @property
+    def Inputs(self):
+        """
+        The list of the files the images written so far were read from.
+        """
+        return list(self._inputs)
+
+
+    def select(self, images):
+        """
+        Yields the (image_name, image_file_path, image_type, package) tuples of
+        images that belong to this shard, remembering the ordinal of each.
+        """
+        for (ordinal, image) in enumerate(images):
+            (image_name, image_file_path, image_type, package) = image
+            if shardOf(package + (image_name.lower(),), self._shard[1]) == self._shard[0]:
+                self._ordinals[image_file_path] = ordinal
+                yield image
+
+
+    def processImage(self, image_name, image_file_path, image_type, encoded, package=()):
+        self._inputs[getattr(image_file_path, 'archive', image_file_path)] = None
+        image = (image_name, str(image_file_path), image_type, package)
+        pickle.dump((self._ordinals.pop(image_file_path), image, encoded), self._fp, pickle.HIGHEST_PROTOCOL)
+
+
+    def close(self, ignored, illegal, identmappings, failures):
+        # Archive members are written as the plain strings they print as
+        pickle.dump({'Ignored' : [ str(path) for path in ignored ], 'Illegal' : illegal,
+                     'IdentMappings' : identmappings,
+                     'Failures' : [ (str(path), str(reason)) for (path, reason) in failures ]},
+                    self._fp, pickle.HIGHEST_PROTOCOL)
+        self._fp.close()
+
+
+    def abandon(self):
+        self._fp.close()
+        os.remove(self._path)
+
+
+#-------------------------------------------------------------------------------
+class PartialSet():
+    """
+    The partial results of every shard of a build, read back by --merge.
+
+    paths - the partial result files, one per shard in any order
+
+    Raises ShardError unless there is exactly one partial result per shard,
+    all of them of the same build.
+    """
+    def __init__(self, paths):
+        self._files = list()
+        self._trailers = list()
+        headers = list()
+        try:
+            for path in paths:
+                f = open(path, 'rb')
+                self._files.append(f)
+                if f.read(len(PARTIAL_MAGIC)) != PARTIAL_MAGIC:
+                    raise ShardError("'%s' is not a partial result" % path)
+                headers.append(pickle.load(f))
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            self.close()
+            raise ShardError("Unable to read the partial result: %s" % e)
+
+        shards = sorted(header['Shard'] for header in headers)
+        count = shards[0][1] if shards else 0
+        if shards != [ (i, count) for i in range(1, count + 1) ]:
+            self.close()
+            raise ShardError("Expected one partial result for each of the shards 1 to %d, got %s" %
+                             (count, ', '.join('%d/%d' % shard for shard in shards)))
+
+        if any(header['Options'] != headers[0]['Options'] for header in headers):
+            self.close()
+            raise ShardError("The partial results were built with different encoding options")
+
+        self.Options = headers[0]['Options']
+
+
+    def _records(self, f):
+        while True:
+            record = pickle.load(f)
+            if isinstance(record, dict):
+                self._trailers.append(record)
+                return
+            yield record
+
+
+    def images(self):
+        """
+        Yields the tuple (image, encoded) of every image of every shard in the
+        order the build would have written them, image being the tuple
+        (image_name, image_file_path, image_type, package).
+        """
+        merged = heapq.merge(*[ self._records(f) for f in self._files ], key=lambda record: record[0])
+        for (ordinal, image, encoded) in merged:
+            yield (image, encoded)
+
+
+    def _trailerList(self, key):
+        # Every shard ignores and finds illegal the same files, keep them once
+        values = list()
+        for trailer in self._trailers:
+            values.extend(value for value in trailer[key] if value not in values)
+        return values
+
+
+    @property
+    def Ignored(self):
+        return self._trailerList('Ignored')
+
+
+    @property
+    def Illegal(self):
+        return self._trailerList('Illegal')
+
+
+    @property
+    def IdentMappings(self):
+        mappings = dict()
+        for trailer in self._trailers:
+            mappings.update(trailer['IdentMappings'])
+        return mappings
+
+
+    @property
+    def Failures(self):
+        return self._trailerList('Failures')
+
+
+    def close(self):
+        for f in self._files:
+            f.close()
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
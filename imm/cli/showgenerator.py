@@ -153,7 +153,7 @@ BODY_BOTTOM = """
         self.canvas.configure(scrollregion=self.canvas.bbox("all"))
 
     def callback(self, metadata_dict):
-        text = pformat(metadata_dict, indent=4, width=1)
+        text = pformat(dict(metadata_dict), indent=4, width=1)
         index = '1.0'
         self.text.delete(index, tk.END)
         self.text.insert(index, text)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Image format sniffing
+
+Whether a file is an image is decided by its first bytes rather than by its
+file name extension: they are matched against the signature (the _accept()
+function) of the format its extension names first, then of each image
+format registered with Pillow in the order PIL.Image.open() tries them. A
+file that is not an image is rejected without any decoder being invoked,
+and an image file is found whatever the case of its extension, or if it has
+the wrong extension or none at all.
+
+The few formats without a signature (TGA for instance) can only be told by
+their registered extension, as PIL.Image.open() would have to try decoding
+them to know; a file with such an extension is taken for an image and fails
+to encode if it is not one.
+
+Only the first SNIFF_BYTES of a file are read, in batches of SNIFF_BATCH
+files handed to a pool of threads so that the reads overlap.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os.path
+import struct
+import itertools
+
+from concurrent.futures import ThreadPoolExecutor
+
+#-------------------------------------------------------------------------------
+from PIL import Image
+
+#-------------------------------------------------------------------------------
+from imm.cli import archives
+
+#-------------------------------------------------------------------------------
+# The prefix PIL.Image.open() hands to the _accept() functions
+SNIFF_BYTES = 16
+
+# Files sniffed at once, keeping the discovery of the input streaming
+SNIFF_BATCH = 64
+
+# Threads reading the files of a batch
+SNIFF_THREADS = 8
+
+#-------------------------------------------------------------------------------
+def sniffFormat(prefix, ext=''):
+    """
+    Returns the Pillow format name (as in PIL.Image.ID) of the image whose
+    file starts with the bytes prefix and has the file name extension ext, or
+    None if it is not an image Pillow can open.
+    """
+    Image.init()
+
+    # Some signatures are weak (a TGA image starts like a CUR image), so the
+    # format of the extension is preferred if the prefix matches it too
+    format = Image.registered_extensions().get(ext.lower())
+    if format in Image.OPEN and _accepts(format, prefix, True):
+        return format
+
+    for format in Image.ID:
+        if _accepts(format, prefix, False):
+            return format
+
+    return None
+
+
+#-------------------------------------------------------------------------------
+def _accepts(format, prefix, default):
+    """
+    Returns True if prefix matches the signature of format, or default if
+    format has no signature.
+    """
+    accept = Image.OPEN[format][1]
+    if accept is None:
+        return default
+    try:
+        result = accept(prefix)
+    except (SyntaxError, IndexError, TypeError, struct.error):
+        # As PIL.Image.open() does, for a file shorter than a signature
+        return False
+    # A string is the reason Pillow recognized but cannot open the image
+    return bool(result) and not isinstance(result, str)
+
+
+#-------------------------------------------------------------------------------
+def sniffFile(path):
+    """
+    Returns the Pillow format name of the image file path (or archive member,
+    see archives.py), or None if it is not an image or cannot be read.
+    """
+    try:
+        with archives.openFile(path) as f:
+            prefix = f.read(SNIFF_BYTES)
+    except OSError:
+        return None
+
+    return sniffFormat(prefix, os.path.splitext(path)[1])
+
+
+#-------------------------------------------------------------------------------
+def imageType(format, ext):
+    """
+    Returns the image type, a file name extension, of an image of the Pillow
+    format whose file name has the extension ext: ext itself if it is one of
+    the format's extensions, otherwise the format's first extension.
+    """
+    extensions = Image.registered_extensions()
+    if extensions.get(ext.lower()) == format:
+        return ext
+
+    for (extension, ext_format) in extensions.items():
+        if ext_format == format:
+            return extension
+
+    return '.' + format.lower()
+
+
+#-------------------------------------------------------------------------------
+def sniffFiles(files, threads=SNIFF_THREADS):
+    """
+    Yields the tuple (relpath, path, format) for each (relpath, path) tuple of
+    the iterable files, in the same order, where format is the Pillow format
+    name of the file or None if it is not an image.
+    """
+    files = iter(files)
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='imm-sniff') as pool:
+        while True:
+            batch = list(itertools.islice(files, SNIFF_BATCH))
+            if not batch:
+                break
+            formats = pool.map(sniffFile, [ path for (relpath, path) in batch ])
+            for ((relpath, path), format) in zip(batch, formats):
+                yield (relpath, path, format)
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
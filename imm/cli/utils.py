@@ -11,8 +11,47 @@ __license__   = 'ISCL'
 __version__   = '0.0.0'
 
 #-------------------------------------------------------------------------------
+import argparse
 
 #-------------------------------------------------------------------------------
+BYTE_SIZE_SUFFIXES = { 'K' : 1024, 'M' : 1024**2, 'G' : 1024**3 }
+
+#-------------------------------------------------------------------------------
+def parseByteSize(text):
+    """
+    Returns the number of bytes given by text, a positive integer optionally
+    followed by one of the (case insensitive) suffixes K, M or G for KiB, MiB
+    or GiB. Meant to be used as an argparse type.
+    """
+    number = text.strip().upper()
+    multiplier = 1
+    if number[-1:] in BYTE_SIZE_SUFFIXES:
+        multiplier = BYTE_SIZE_SUFFIXES[number[-1]]
+        number = number[:-1]
+    try:
+        size = int(number) * multiplier
+    except ValueError:
+        raise argparse.ArgumentTypeError("'%s' is not a size in bytes such as 500000, 512K or 2M" % text)
+    if size < 1:
+        raise argparse.ArgumentTypeError("'%s' is not a positive size in bytes" % text)
+    return size
+
+
+#-------------------------------------------------------------------------------
+def parseBox(text):
+    """
+    Returns the (width, height) given by text, either N for N x N or WxH.
+    Meant to be used as an argparse type.
+    """
+    try:
+        (width, x, height) = text.lower().partition('x')
+        box = (int(width), int(height or width))
+    except ValueError:
+        raise argparse.ArgumentTypeError("'%s' is not a size such as 2048 or 1920x1080" % text)
+    if min(box) < 1:
+        raise argparse.ArgumentTypeError("'%s' is not a positive size" % text)
+    return box
+
 
 #-------------------------------------------------------------------------------
 def FormatArgsNamespace(args, namespace_name='args'):
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Multi-resolution variants
+
+Makes resized variants of an image (1x/2x/3x icons, thumbnails, ...) from the
+image already decoded to encode it, see workers.encodeImage().
+
+Downscaling passes reducing_gap to Image.resize() so Pillow first shrinks the
+image by an integer factor with Image.reduce(), which is cheap, and only
+resamples the last step with the (expensive) resampling filter.
+
+Each variant is cached on disk by the SHA-256 of the image file's content and
+the variant's size and filter, so a source image that has not changed is
+never resized again, whatever its path and across builds.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os
+import os.path
+import re
+import argparse
+import hashlib
+import tempfile
+
+from io import BytesIO
+
+#-------------------------------------------------------------------------------
+from PIL import Image
+
+#-------------------------------------------------------------------------------
+from imm import imagedata as GID
+
+#-------------------------------------------------------------------------------
+# --resample FILTER names
+RESAMPLE_FILTERS = {
+    'nearest'  : Image.NEAREST,
+    'box'      : Image.BOX,
+    'bilinear' : Image.BILINEAR,
+    'hamming'  : Image.HAMMING,
+    'bicubic'  : Image.BICUBIC,
+    'lanczos'  : Image.LANCZOS,
+}
+
+DEFAULT_RESAMPLE = 'lanczos'
+
+# Image.reduce() the image while it stays at least REDUCING_GAP times the
+# target size, see Image.resize()
+REDUCING_GAP = 2.0
+
+# --variant NAME=SIZE where SIZE is N (N x N) or WxH
+VARIANT_SPEC = re.compile(r"^(\w+)=(\d+)(?:[xX](\d+))?\Z")
+
+#-------------------------------------------------------------------------------
+def parseVariant(text):
+    """
+    Returns the tuple (name, (width, height)) of the --variant NAME=SIZE text.
+    Meant to be used as an argparse type.
+    """
+    match = VARIANT_SPEC.match(text)
+    if not match:
+        raise argparse.ArgumentTypeError("'%s' is not a variant such as 2x=32 or thumb=64x48" % text)
+
+    (name, width, height) = match.groups()
+    box = (int(width), int(height or width))
+    if min(box) < 1:
+        raise argparse.ArgumentTypeError("'%s' is not a positive variant size" % text)
+
+    return (name.lower(), box)
+
+
+#-------------------------------------------------------------------------------
+def fitSize(size, box):
+    """
+    Returns the largest size with the aspect ratio of size that fits in box.
+    """
+    (w, h) = size
+    scale = min(box[0] / w, box[1] / h)
+    return (max(1, round(w * scale)), max(1, round(h * scale)))
+
+
+#-------------------------------------------------------------------------------
+class VariantCache():
+    """
+    Resized variants stored as PNG files below directory, or no caching at
+    all if directory is None. Safe to share between worker processes: a
+    variant is written to a temporary file first and then renamed.
+    """
+    def __init__(self, directory):
+        self._directory = directory
+
+
+    def _path(self, digest, box, resample):
+        key = "%s-%dx%d-%s.png" % (digest, box[0], box[1], resample)
+        return os.path.join(self._directory, digest[:2], key)
+
+
+    def lookup(self, digest, box, resample):
+        """
+        Returns the PNG bytes of the variant cached, or None.
+        """
+        if self._directory is None:
+            return None
+        try:
+            with open(self._path(digest, box, resample), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+    def store(self, digest, box, resample, data):
+        if self._directory is None:
+            return
+        path = self._path(digest, box, resample)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+
+#-------------------------------------------------------------------------------
+def makeVariants(img, source, variants, resample=DEFAULT_RESAMPLE, cache_dir=None):
+    """
+    Returns a dictionary mapping each variant name to the tuple (image_data,
+    width, height) of the PNG encoded variant of the decoded image img.
+
+    source   - the bytes of the image file img was decoded from, hashed to
+               look the variants up in the cache
+    variants - the (name, (width, height)) tuples returned by parseVariant()
+    """
+    cache = VariantCache(cache_dir)
+    digest = hashlib.sha256(source).hexdigest()
+
+    made = dict()
+    for (name, box) in variants:
+        data = cache.lookup(digest, box, resample)
+        if data is None:
+            size = fitSize(img.size, box)
+            variant = img.resize(size, RESAMPLE_FILTERS[resample], reducing_gap=REDUCING_GAP)
+            data = GID.encode_image(variant, 'PNG')
+            cache.store(digest, box, resample, data)
+        else:
+            # The PNG header alone gives the size
+            size = Image.open(BytesIO(data)).size
+        made[name] = (data, size[0], size[1])
+
+    return made
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
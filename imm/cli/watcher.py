@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Watch mode
+
+Polls the --input roots and rebuilds MODULE whenever an image file is added,
+changed or removed; files that are not images, and the files a build
+generates, are not watched. The encoded data of every image stays in memory
+between rebuilds (see pipeline.EncodeCache) so a rebuild only reads and
+encodes the image files that changed; everything else is written straight
+from memory.
+
+Polling with os.scandir() and os.stat() is used rather than inotify since it
+works on every platform with the Python Standard Library alone.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os
+import time
+
+#-------------------------------------------------------------------------------
+from imm.cli import pipeline
+from imm.cli import archives
+from imm.cli import sniffer
+
+#-------------------------------------------------------------------------------
+DEFAULT_INTERVAL = 0.5
+
+#-------------------------------------------------------------------------------
+def isBelow(path, directory):
+    """
+    Returns True if the absolute path is directory or below it.
+    """
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+#-------------------------------------------------------------------------------
+class Watcher():
+    """
+    logger   - a logging module logger object created by the caller
+    finder   - the discovery.Discovery object used to scan the roots
+    roots    - the list of --input roots
+    interval - seconds between two polls of the roots
+    ignore   - paths of files and directories not to watch, CODE_PATH for
+               instance; a directory that is, or is above, one of the roots
+               is not ignored as a whole, only the files generated in it are
+
+    Only image files (see sniffer.py) are watched, and never the files a
+    build generated, so that writing MODULE, or a --contact-sheet, below an
+    input root does not trigger another build.
+    """
+    def __init__(self, logger, finder, roots, interval=DEFAULT_INTERVAL, ignore=()):
+        self._logr = logger.getChild('Watcher')
+        self._finder = finder
+        self._roots = roots
+        self._interval = interval
+        self._cache = pipeline.EncodeCache()
+
+        absroots = [ os.path.abspath(root) for root in roots ]
+        self._ignored = set()
+        for path in ignore:
+            path = os.path.abspath(path)
+            if not any(isBelow(root, path) for root in absroots):
+                self._ignored.add(path)
+
+        # path -> (stamp, format) of every file sniffed, so that only the
+        # files that changed are sniffed again
+        self._sniffed = dict()
+
+
+    def ignored(self, path):
+        """
+        Returns True if path, a file or an ArchiveMember, is not watched.
+        """
+        path = os.path.abspath(getattr(path, 'archive', path))
+        return any(isBelow(path, ignored) for ignored in self._ignored)
+
+
+    def _isImage(self, path, stamp):
+        """
+        Returns True if the file path with the stamp is an image file.
+        """
+        sniffed = self._sniffed.get(path)
+        if sniffed is None or sniffed[0] != stamp:
+            sniffed = self._sniffed[path] = (stamp, sniffer.sniffFile(path))
+        return sniffed[1] is not None
+
+
+    def snapshot(self):
+        """
+        Returns a tuple of (root, relpath, path, stamp) for every image file
+        below the roots that is not ignored. A file removed while the roots
+        are scanned is left out.
+        """
+        files = list()
+        for root in self._roots:
+            # Tar members are listed without reading their bytes, files()
+            # scans the archive again when it is built
+            for (relpath, path) in self._finder.scan([root], data=False):
+                if self.ignored(path):
+                    continue
+                if isinstance(path, archives.ArchiveMember):
+                    files.append((root, relpath, path, path.stamp))
+                    continue
+                try:
+                    stamp = pipeline.fileStamp(os.stat(path))
+                except FileNotFoundError:
+                    continue
+                if self._isImage(path, stamp):
+                    files.append((root, relpath, path, stamp))
+
+        found = set(path for (root, relpath, path, stamp) in files)
+        for path in set(self._sniffed) - found:
+            del self._sniffed[path]
+
+        return tuple(files)
+
+
+    def files(self, snapshot):
+        """
+        Yields the (relpath, path) tuples of the files of snapshot. The members
+        of a tar archive are scanned again, since the snapshot does not keep
+        their bytes (see archives.py).
+        """
+        for root in self._roots:
+            if archives.isTarArchive(root):
+                for found in self._finder.scan([root]):
+                    yield found
+                continue
+            for (file_root, relpath, path, stamp) in snapshot:
+                if file_root == root:
+                    yield (relpath, path)
+
+
+    def run(self, rebuild):
+        """
+        Call rebuild(input_img_files, cache, generated) now and again every
+        time the image files below the roots change, until interrupted.
+        input_img_files is the iterable of (relpath, path) tuples found;
+        rebuild extends the list generated with the paths of the files it
+        generated and returns a RETURN CODE.
+        """
+        previous = None
+        rebuilds = 0
+        try:
+            while True:
+                current = self.snapshot()
+                if current != previous:
+                    if previous is not None:
+                        before = dict((path, stamp) for (root, relpath, path, stamp) in previous)
+                        after = dict((path, stamp) for (root, relpath, path, stamp) in current)
+                        changes = [ path for path in set(before) | set(after) if before.get(path) != after.get(path) ]
+                        self._logr.warning("Detected %d added, changed or removed image file(s), rebuilding..." % len(changes))
+
+                    start = time.perf_counter()
+                    generated = list()
+                    status = rebuild(self.files(current), self._cache, generated)
+                    elapsed = time.perf_counter() - start
+                    rebuilds += 1
+
+                    # A file generated below a root, where an earlier build
+                    # may have left it, is not watched from now on
+                    self._ignored.update(os.path.abspath(path) for path in generated)
+                    current = tuple(entry for entry in current if not self.ignored(entry[2]))
+
+                    self._cache.retain([ path for (root, relpath, path, stamp) in current ])
+
+                    if status == 0:
+                        self._logr.warning("Build #%d done in %.3f seconds, watching for changes (Ctrl-C to stop)..." % (rebuilds, elapsed))
+                    else:
+                        self._logr.error("Build #%d failed with return code %d, watching for changes (Ctrl-C to stop)..." % (rebuilds, status))
+
+                    previous = current
+
+                time.sleep(self._interval)
+        except KeyboardInterrupt:
+            self._logr.warning("Stopped watching after %d build(s)" % rebuilds)
+
+        return 0
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+#coding=utf-8
+"""
+Worker pools
+
+Reading, decoding and encoding an image is independent of every other image,
+so it is done by the module level functions below which can run either in the
+calling process or in a pool of worker processes (see --jobs).
+
+Pools are cached by their number of workers so that the build daemon re-uses
+warm workers from one build request to the next.
+
+A pool may be started with a memory ceiling (see --memory-limit) applied to
+each of its workers with resource.setrlimit(); an image needing more fails
+with a MemoryError, or crashes its worker, rather than exhausting the
+machine. A pool whose worker crashed or hangs is killed with killPool() and
+the next getPool() starts a fresh one.
+"""
+
+__copyright__ = 'Copyright (C) 2014-2015 by E.R. Uber'
+__author__    = 'E.R. Uber (eruber@gmail.com)'
+__license__   = 'ISCL'
+__version__   = '1.0.0'
+
+#-------------------------------------------------------------------------------
+import os
+import atexit
+import multiprocessing
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where --memory-limit is ignored
+    resource = None
+
+from io import BytesIO
+
+from concurrent.futures import ProcessPoolExecutor
+
+#-------------------------------------------------------------------------------
+from PIL import Image
+
+#-------------------------------------------------------------------------------
+from imm import imagecodecs
+from imm import imagereduce
+from imm import imagestats
+from imm.cli import variants as VA
+from imm.cli import frames as FR
+from imm.cli import outputs as OU
+
+#-------------------------------------------------------------------------------
+# Pools already started, keyed by (number of workers, memory limit), and the
+# queues their worker processes report their process ID on, see killPool()
+_pools = dict()
+_pids = dict()
+
+#-------------------------------------------------------------------------------
+def initWorker(memory_limit=None, pids=None):
+    """
+    Worker process initializer -- load all the Pillow plugins once per worker
+    rather than lazily on the first image of each format, and limit the
+    address space of the worker to memory_limit bytes if it is not None.
+    The worker's process ID is put on the queue pids if it is not None.
+    """
+    if pids is not None:
+        pids.put(os.getpid())
+
+    Image.init()
+
+    if memory_limit is not None and resource is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+#-------------------------------------------------------------------------------
+def encodeImage(image_file, variants=(), resample=VA.DEFAULT_RESAMPLE, cache_dir=None,
+                codec=imagecodecs.DEFAULT_CODEC, min_psnr=imagecodecs.DEFAULT_MIN_PSNR,
+                frames=FR.DEFAULT_FRAMES, max_size=None, max_pixels=None, outputs=(), stats=False):
+    """
+    Decode and re-encode image_file, which is either the path of an image
+    file or the bytes already read from an image file.
+
+    Returns the tuple (image_data, meta_data) where image_data is the bytes of
+    the image encoded with codec (see imm.imagecodecs) and meta_data is a
+    dictionary of the image meta-data found while decoding it, including the
+    name of the codec actually used as meta_data['Codec'].
+
+    variants, resample and cache_dir are passed to variants.makeVariants()
+    to also make resized variants of the image from the same decode; they
+    are returned as meta_data['Variants'].
+
+    Unless frames is 'first', the frames of a multi-frame image are described
+    by meta_data['Frames'] and, for frames 'split', their distinct PNG data
+    returned as meta_data['FrameData'], see frames.py. With 'apng' or 'webp'
+    an animation's image_data is the re-encoded animation.
+
+    max_size and max_pixels are passed to imagereduce.reduce_image() to
+    decode an image larger than max_size at a reduced size; meta_data then
+    gives the reduced size.
+
+    outputs, the (output, settings) tuples of the extra outputs of the build,
+    is passed to outputs.renderOutputs() to make their data from the same
+    decode; it is returned as meta_data['Outputs'].
+
+    If stats is True, the statistics of the image (see imm.imagestats) are
+    computed from the same decode and returned as meta_data['Stats'].
+    """
+    if not isinstance(image_file, bytes) and variants:
+        # The variant cache is keyed by the file's content
+        with open(image_file, 'rb') as f:
+            image_file = f.read()
+
+    source = image_file
+    if isinstance(image_file, bytes):
+        image_file = BytesIO(image_file)
+
+    reducing = max_size is not None or max_pixels is not None
+    img = imagereduce.open_image(image_file, huge=reducing)
+
+    if reducing:
+        img = imagereduce.reduce_image(img, max_size, max_pixels)
+
+    (w, h) = img.size
+
+    meta_data = {
+        'Width'  : w,
+        'Height' : h,
+    }
+
+    if variants:
+        meta_data['Variants'] = VA.makeVariants(img, source, variants, resample, cache_dir)
+
+    if outputs:
+        meta_data['Outputs'] = OU.renderOutputs(img, outputs)
+
+    if stats:
+        meta_data['Stats'] = imagestats.image_stats(img)
+
+    (meta_data['Codec'], image_data) = imagecodecs.encode_with_codec(img, codec, min_psnr=min_psnr)
+
+    if frames != FR.FRAMES_FIRST and FR.frameCount(img) > 1:
+        if frames == FR.FRAMES_SPLIT or not FR.isAnimation(img):
+            (meta_data['Frames'], meta_data['FrameData']) = FR.splitFrames(img)
+        else:
+            (image_data, meta_data['Frames']) = FR.encodeAnimation(img, frames)
+            meta_data['Codec'] = 'png' if frames == FR.FRAMES_APNG else 'webp'
+
+    return (image_data, meta_data)
+
+
+#-------------------------------------------------------------------------------
+def resolveJobs(jobs):
+    """
+    Returns the number of workers to use for the --jobs JOBS option; a JOBS
+    of 0 or less means one worker per CPU.
+    """
+    if jobs is None:
+        return 1
+
+    if jobs < 1:
+        return os.cpu_count() or 1
+
+    return jobs
+
+
+#-------------------------------------------------------------------------------
+def getPool(jobs, memory_limit=None, isolate=False):
+    """
+    Returns a pool of jobs worker processes, or None if jobs is 1 in which case
+    the caller should do the work itself -- unless isolate is True, since only
+    work done in a worker process can be limited and killed.
+
+    memory_limit - the most bytes of memory each worker may use, or None
+    """
+    jobs = resolveJobs(jobs)
+
+    if jobs == 1 and not isolate and memory_limit is None:
+        return None
+
+    key = (jobs, memory_limit)
+    if key not in _pools:
+        _pids[key] = multiprocessing.SimpleQueue()
+        _pools[key] = ProcessPoolExecutor(max_workers=jobs, initializer=initWorker, initargs=(memory_limit, _pids[key]))
+
+    return _pools[key]
+
+
+#-------------------------------------------------------------------------------
+def killPool(jobs, memory_limit=None):
+    """
+    Kill the worker processes of the pool getPool(jobs, memory_limit) returned,
+    whatever they are doing; the work they had not finished is lost. The next
+    call to getPool() starts a new pool.
+    """
+    key = (resolveJobs(jobs), memory_limit)
+    pool = _pools.pop(key, None)
+    if pool is None:
+        return
+
+    # ProcessPoolExecutor has no public way to stop a task once it started,
+    # nor to list its workers: they reported their process ID when started.
+    # Killing them breaks the pool, which fails the work not finished.
+    pids = _pids.pop(key)
+    reported = set()
+    while not pids.empty():
+        reported.add(pids.get())
+    for process in multiprocessing.active_children():
+        if process.pid in reported:
+            process.kill()
+
+    pool.shutdown(wait=True)
+
+
+#-------------------------------------------------------------------------------
+def shutdownPools():
+    """
+    Shutdown every pool started by getPool().
+    """
+    for key in list(_pools):
+        _pools.pop(key).shutdown()
+    _pids.clear()
+
+atexit.register(shutdownPools)
+
+
+#-------------------------------------------------------------------------------
+if __name__ == "__main__":
+    pass
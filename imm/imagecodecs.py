@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The imagecodecs module is a registry of the codecs image data can be encoded with before it is
+written to a Python module text file, and selects the codec giving the smallest image data.
+
+Photographs are usually smallest as lossy WebP or JPEG while flat icons are smallest as PNG or
+lossless WebP, so the 'auto' codec encodes an image with each candidate codec and keeps the
+smallest image data whose fidelity, measured as the PSNR against the original image, is good
+enough. Lossless codecs always qualify.
+
+"""
+
+__author__  = 'E.R. Uber'
+__email__   = 'eruber@gmail.com'
+__license__ = 'ISCL'
+__version__ = '2.1.0'
+
+#----------------------------------------------------------------------------------------
+import math
+import struct
+
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+#----------------------------------------------------------------------------------------
+from PIL import Image, ImageChops, ImageStat, features
+
+#----------------------------------------------------------------------------------------
+DEFAULT_CODEC = 'png'
+
+AUTO = 'auto'
+
+# The codecs tried by 'auto'; 'raw' is never the smallest but for tiny images
+AUTO_CANDIDATES = ('png', 'webp-lossless', 'webp', 'jpeg', 'gif')
+
+# The lowest PSNR, in dB, of a lossy encoding 'auto' may select
+DEFAULT_MIN_PSNR = 40.0
+
+# The image modes PNG stores, images of any other mode (CMYK, YCbCr, F, ...) are converted
+# to the first one
+PNG_MODES = ('RGBA', 'RGB', 'P', 'L', 'LA', '1', 'I', 'I;16', 'I;16B')
+
+# Image data encoded by the 'raw' codec starts with this, followed by the length of the
+# image mode, the image mode, the width and the height
+RAW_MAGIC = b'IMMRAW'
+RAW_HEADER = '>6sB%dsII'
+
+#----------------------------------------------------------------------------------------
+class UnknownCodecError(Exception):
+    pass
+
+
+#----------------------------------------------------------------------------------------
+class Codec(object):
+    """
+    A codec saving images with Pillow.
+
+    :param name: A string naming the codec in the registry.
+    :param format: A string naming the Pillow image file format to save as.
+    :param params: A dictionary of the parameters passed to PIL.Image.Image.save().
+    :param modes: A tuple of the image modes the format can save, other modes are converted
+                  to the first one; if None, Pillow converts the image itself if needed.
+    :param feature: A string naming the Pillow feature (see PIL.features.check()) the codec
+                    needs, or None.
+    """
+    def __init__(self, name, format, params=None, modes=None, feature=None):
+        self.name = name
+        self.format = format
+        self.params = params or dict()
+        self.modes = modes
+        self.feature = feature
+
+
+    def available(self):
+        """
+        Returns True if the installed Pillow can encode with this codec.
+        """
+        return self.feature is None or features.check(self.feature)
+
+
+    def encode(self, image):
+        """
+        Returns the bytes of image encoded with this codec.
+        """
+        if self.modes is not None and image.mode not in self.modes:
+            image = image.convert(self.modes[0])
+
+        imageBuf = BytesIO()
+        try:
+            image.save(imageBuf, self.format, **self.params)
+            return(imageBuf.getvalue())
+        finally:
+            imageBuf.close()
+
+
+    def decode(self, data):
+        """
+        Returns the PIL.Image.Image decoded from data.
+        """
+        return(Image.open(BytesIO(data)))
+
+
+#----------------------------------------------------------------------------------------
+class RawCodec(Codec):
+    """
+    The uncompressed pixel data of an image, after a short header giving its mode and size.
+    """
+    def __init__(self, name='raw'):
+        Codec.__init__(self, name, None)
+
+
+    def encode(self, image):
+        mode = image.mode.encode('ascii')
+        header = struct.pack(RAW_HEADER % len(mode), RAW_MAGIC, len(mode), mode, image.size[0], image.size[1])
+        return(header + image.tobytes())
+
+
+    def decode(self, data):
+        (magic, length) = struct.unpack_from('>6sB', data)
+        if magic != RAW_MAGIC:
+            raise ValueError("Image data is not encoded by the raw codec")
+        fmt = RAW_HEADER % length
+        (magic, length, mode, width, height) = struct.unpack_from(fmt, data)
+        return(Image.frombytes(mode.decode('ascii'), (width, height), data[struct.calcsize(fmt):]))
+
+
+#----------------------------------------------------------------------------------------
+_codecs = dict()
+
+def register_codec(codec):
+    """
+    Add codec, a Codec object, to the registry, replacing any codec of the same name.
+    """
+    _codecs[codec.name] = codec
+
+
+def get_codec(name):
+    """
+    Returns the registered Codec object named name.
+    """
+    try:
+        return(_codecs[name])
+    except KeyError:
+        raise UnknownCodecError("Unknown codec '%s', expecting one of %s" % (name, codec_names())) from None
+
+
+def codec_names():
+    """
+    Returns the sorted list of the names of the registered codecs.
+    """
+    return(sorted(_codecs))
+
+
+register_codec(Codec('png', 'PNG', modes=PNG_MODES))
+register_codec(Codec('webp-lossless', 'WEBP', { 'lossless' : True, 'exact' : True }, feature='webp'))
+register_codec(Codec('webp', 'WEBP', { 'quality' : 80 }, feature='webp'))
+register_codec(Codec('jpeg', 'JPEG', { 'quality' : 85, 'optimize' : True }, modes=('RGB', 'L', 'CMYK'), feature='jpg'))
+register_codec(Codec('gif', 'GIF'))
+register_codec(RawCodec())
+
+
+#----------------------------------------------------------------------------------------
+def psnr(original, decoded):
+    """
+    Returns the peak signal to noise ratio, in dB, of the decoded image against the original
+    image, compared as RGBA; math.inf if they are identical.
+    """
+    a = original.convert('RGBA')
+    b = decoded.convert('RGBA')
+    if a.size != b.size:
+        return(0.0)
+
+    stat = ImageStat.Stat(ImageChops.difference(a, b))
+    mse = sum(stat.sum2) / (a.size[0] * a.size[1] * 4)
+    if mse == 0:
+        return(math.inf)
+
+    return(10 * math.log10(255**2 / mse))
+
+
+#----------------------------------------------------------------------------------------
+# Candidate codecs are tried by threads, Pillow releases the GIL while encoding
+_executor = None
+
+def _try_codec(name, image, min_psnr):
+    codec = get_codec(name)
+    try:
+        data = codec.encode(image)
+        if psnr(image, codec.decode(data)) < min_psnr:
+            return(None)
+    except (OSError, ValueError):
+        # A format that cannot store the image's mode is left out, not fatal
+        return(None)
+    return(data)
+
+
+def encode_with_codec(image, codec=DEFAULT_CODEC, candidates=AUTO_CANDIDATES, min_psnr=DEFAULT_MIN_PSNR):
+    """
+    Returns the tuple (codec_name, image_data) of image encoded with the codec named codec.
+
+    :param image: A PIL.Image.Image object.
+    :param codec: A string naming a registered codec, or 'auto' to encode image with each
+                  available codec of candidates and select the smallest image data with a PSNR
+                  of at least min_psnr. A candidate failing to encode the image is skipped;
+                  PNG is used if no candidate qualifies.
+    """
+    global _executor
+
+    if codec != AUTO:
+        return((codec, get_codec(codec).encode(image)))
+
+    image.load()
+    names = [ name for name in candidates if get_codec(name).available() ]
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor()
+
+    results = zip(names, _executor.map(_try_codec, names, [image]*len(names), [min_psnr]*len(names)))
+
+    best = None
+    for (name, data) in results:
+        if data is not None and (best is None or len(data) < len(best[1])):
+            best = (name, data)
+
+    if best is None:
+        return((DEFAULT_CODEC, get_codec(DEFAULT_CODEC).encode(image)))
+
+    return(best)
+
+
+#----------------------------------------------------------------------------------------
+def decode_image(data, codec=DEFAULT_CODEC):
+    """
+    Returns the PIL.Image.Image decoded from image data encoded with the codec named codec.
+    """
+    return(get_codec(codec).decode(data))
+
+
+if __name__ == "__main__":
+    pass
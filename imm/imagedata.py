@@ -19,6 +19,13 @@ from io import BytesIO
 import re
 import random
 import string
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where appending is neither locked nor journaled
+    fcntl = None
 
 #----------------------------------------------------------------------------------------
 from logging import NullHandler
@@ -27,6 +34,10 @@ from datetime import datetime as dt
 #----------------------------------------------------------------------------------------
 from PIL import Image, ImageTk
 
+#----------------------------------------------------------------------------------------
+from imm import imagecodecs
+from imm import imagereduce
+
 #----------------------------------------------------------------------------------------
 APPEND_MODE = 'APPEND'
 WRITE_MODE  = 'WRITE'
@@ -42,6 +53,9 @@ WRITE_MODE_MAP = {
 
 NEW_LINE = '\n'
 
+# The journal of an output module appended to is the module's file name followed by this
+JOURNAL_SUFFIX = '.journal'
+
 #----------------------------------------------------------------------------------------
 def make_string_valid_python_identifier(s):
     """
@@ -93,6 +107,81 @@ def id_generator(size=7, chars=string.ascii_lowercase + string.digits):
     return(id)
 
 
+#----------------------------------------------------------------------------------------
+def encode_image(image, format='PNG'):
+    """
+    Returns the bytes of image saved in format.
+
+    :param image: A PIL.Image.Image object, or a string naming an image file to read.
+    :param format: A string naming the Pillow image file format to save as, the default is 'PNG'.
+    """
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+
+    imageBuf = BytesIO()
+    try:
+        image.save(imageBuf, format)
+        return(imageBuf.getvalue())
+    finally:
+        imageBuf.close()
+
+
+#----------------------------------------------------------------------------------------
+def format_data_entry(imagedata, imagevarname, encoding='utf-8'):
+    """
+    Returns the encoded bytes of the Python statement that defines the image data variable
+    for imagedata, in the form written to the output Python module text file:
+
+        <imagevarname>_data = b'...'
+
+    :param imagedata: The bytes of an encoded image.
+    :param imagevarname: A string specifying the image data's variable name, which is lower cased.
+    :param encoding: A string defining the encoding of the output, defaults to 'utf-8'.
+    """
+    dataRef = "%s_data = " % imagevarname.lower()
+    return(dataRef.encode(encoding) + repr(imagedata).encode(encoding) + NEW_LINE.encode(encoding))
+
+
+#----------------------------------------------------------------------------------------
+def _rollback_journal(output_file, fileno):
+    """
+    Truncate the output file, opened as fileno and locked by the caller, back to the size
+    recorded in its journal and remove the journal. Returns True if there was a journal.
+    """
+    journal_file = output_file + JOURNAL_SUFFIX
+    try:
+        with open(journal_file, 'r') as f:
+            size = int(f.read())
+    except FileNotFoundError:
+        return(False)
+
+    os.ftruncate(fileno, size)
+    os.remove(journal_file)
+    return(True)
+
+
+def recover_module(output_file):
+    """
+    Roll back the partial entry a writer appending to the output module output_file left when
+    it crashed, if any. Returns True if an entry was rolled back.
+
+    Generators appending to output_file do this themselves before appending their first entry,
+    this allows checking a module without appending to it. Does nothing on platforms without
+    fcntl (Windows).
+
+    :param output_file: A string naming the output module.
+    """
+    if fcntl is None or not os.path.exists(output_file):
+        return(False)
+
+    with open(output_file, 'ab') as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            return(_rollback_journal(output_file, f.fileno()))
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
 #----------------------------------------------------------------------------------------
 class IllegalFileIOWriteModeError(Exception):
     pass
@@ -112,6 +201,16 @@ class Generator(object):
     Note that if the output parameter represents an already opened output file object, then this
     context manager does not own the output file object resource and will therefore not close it
     upon exiting the context manager's with statement code block.
+
+    A Generator may be shared by several threads. Each write() reads and encodes its image
+    without holding any lock, so the threads decode and encode concurrently; only writing the
+    finished entry to the output is serialized, so that entries are never interleaved.
+
+    Several processes may append to the same output module, each with a Generator of writemode
+    'APPEND' naming it: each entry is appended holding an exclusive advisory lock (fcntl.flock)
+    on the module, and is journaled so that the entry a crashed process left half written is
+    rolled back by the next writer. Neither is done for an already opened output file object,
+    nor on platforms without fcntl (Windows).
     
     """
     def __init__(self, output='gfxmodule.py', writemode=WRITE_MODE_NAMES[0], encoding='utf-8'):
@@ -145,11 +244,14 @@ class Generator(object):
         else:
             raise IllegalFileIOWriteModeError("Input parameter 'writemode' should be one of %s, but is %s" % (WRITE_MODE_NAMES, writemode))
 
-        self._image_file = None
-        self._image_var_name = None
-
         self._encoding = encoding
 
+        # Serializes opening, writing and closing the output stream, see write_data()
+        self._lock = threading.Lock()
+
+        # Appending to a named output is locked against other processes and journaled, see _commit()
+        self._journaled = self._write_mode == WRITE_MODE_MAP[APPEND_MODE] and self._close_on_context_exit and fcntl is not None
+
     
     def __enter__(self):
         """
@@ -168,66 +270,125 @@ class Generator(object):
             self.close()
 
 
-    def write(self, imagefile, imagevarname=None):
+    def write(self, imagefile, imagevarname=None, codec=imagecodecs.DEFAULT_CODEC, min_psnr=imagecodecs.DEFAULT_MIN_PSNR,
+              max_size=None, max_pixels=None):
         """
         This method writes the image data read from imagefile to the output Python module text file.
+        Returns the name of the codec the image data was encoded with.
 
         :param imagefile: A string specifying the image file name to read.
         :param imagevarname: A string specifying the image data's variable name.
+        :param codec: A string naming the codec (see imm.imagecodecs) to encode the image data with,
+                      or 'auto' to select the codec giving the smallest image data with a PSNR of at
+                      least min_psnr. Defaults to 'png'.
+        :param max_size: The (width, height) a larger image is reduced to fit in, decoding it at
+                         a reduced size where possible (see imm.imagereduce), or None.
+        :param max_pixels: Raise imm.imagereduce.ImageTooLargeError rather than decode more than
+                           max_pixels pixels of the image, or None for Pillow's default limit.
 
-        If imagefile is NOT a .png file, then it will be converted in memory to a PNG image
-        before being written to the output Python module text file.
+        The image is converted in memory by the codec, to a PNG image by default, before being
+        written to the output Python module text file.
 
         If imagevarname is NOT specified, then a legal Python variable name will be derived
         from the imagefile name. If no legal Python identifier can be derived from the image
         file name, the a random identifer will be generated.
         """
-        self._image_file = os.path.abspath(imagefile)
-        self._image_var_name = imagevarname
+        # Per call state stays local, the Generator may be shared by several threads
+        image_file = os.path.abspath(imagefile)
 
-        if self._image_var_name is None:
+        if imagevarname is None:
             # If no image variable name is specified, we do our best to derive one from the
             # image file name
-            path, filename_with_ext = os.path.split(self._image_file)
+            path, filename_with_ext = os.path.split(image_file)
             filename_with_no_ext, ext = os.path.splitext(filename_with_ext)
 
-            self._image_var_name = make_string_valid_python_identifier(filename_with_no_ext)
-
-        if self._output_file_stream is None:
-            try:
-                self._logr.debug("Opening output file '%s' write stream in mode '%s'" % (self._output_file, self._write_mode))
-                self._output_file_stream = open(self._output_file, self._write_mode)
-            except (OSError, IOError) as e:
-                self._logr.exception(e)
-                raise 
-
-        imageBuf = BytesIO()
+            imagevarname = make_string_valid_python_identifier(filename_with_no_ext)
 
         try:
-            self._logr.debug("Reading image file '%s' with PIL.Image.open()" % self._image_file)
-            img = Image.open(self._image_file)
+            self._logr.debug("Reading image file '%s' with PIL.Image.open()" % image_file)
+            reducing = max_size is not None or max_pixels is not None
+            img = imagereduce.open_image(image_file, huge=reducing)
 
-            # Save the opened image to an in memory bytes buffer as a PNG image
-            self._logr.debug("Saving image object in PNG format to a bytes buffer in memory.")
-            img.save(imageBuf, 'PNG')
-           
-            # image data to write to module text file
-            self._image_data = imageBuf.getvalue()
+            if reducing:
+                img = imagereduce.reduce_image(img, max_size, max_pixels)
 
-            self._image_var_name = "%s_data" % self._image_var_name.lower()
-            self._logr.info("Writing image data as variable '%s' to output file '%s'" % (self._image_var_name, self._output_file))
-            dataRef = "%s = " % self._image_var_name
-
-            self._output_file_stream.write(bytes(dataRef.encode(self._encoding)))
-            self._output_file_stream.write(bytes(repr(self._image_data).encode(self._encoding)))
-            self._output_file_stream.write(bytes(NEW_LINE.encode(self._encoding)))
+            # Save the opened image to an in memory bytes buffer
+            self._logr.debug("Saving image object with codec '%s' to a bytes buffer in memory." % codec)
+            (codec, imagedata) = imagecodecs.encode_with_codec(img, codec, min_psnr=min_psnr)
 
         except Exception as e:
             self._logr.exception(e)
             raise
 
+        self.write_data(imagedata, imagevarname)
+
+        return(codec)
+
+
+    def write_data(self, imagedata, imagevarname):
+        """
+        This method writes already encoded image data to the output Python module text file.
+
+        :param imagedata: The bytes of an encoded image, for example as returned by encode_image().
+        :param imagevarname: A string specifying the image data's variable name.
+
+        This allows image files to be read and encoded elsewhere, for example by a pool of
+        worker processes, while the output is still written by a single Generator.
+
+        The entry is formatted before the lock is taken and written to the output whole, in a
+        single write while holding it, so concurrent calls never interleave their entries.
+        """
+        entry = format_data_entry(imagedata, imagevarname, self._encoding)
+
+        with self._lock:
+            if self._output_file_stream is None:
+                try:
+                    self._logr.debug("Opening output file '%s' write stream in mode '%s'" % (self._output_file, self._write_mode))
+                    self._output_file_stream = open(self._output_file, self._write_mode)
+                except (OSError, IOError) as e:
+                    self._logr.exception(e)
+                    raise 
+
+            try:
+                self._logr.info("Writing image data as variable '%s_data' to output file '%s'" % (imagevarname.lower(), self._output_file))
+                if self._journaled:
+                    self._commit(entry)
+                else:
+                    self._output_file_stream.write(entry)
+
+            except Exception as e:
+                self._logr.exception(e)
+                raise
+
+
+    def _commit(self, entry):
+        """
+        Append entry to the output while holding an exclusive lock on it, so that the entries of
+        processes appending to the same output are never interleaved.
+
+        The size of the output before the entry is recorded in the journal file, which is removed
+        once the entry is written. A journal found by a writer holding the lock was therefore left
+        by a writer that crashed part way through its entry, which is rolled back first.
+        """
+        stream = self._output_file_stream
+        fileno = stream.fileno()
+
+        fcntl.flock(fileno, fcntl.LOCK_EX)
+        try:
+            if _rollback_journal(self._output_file, fileno):
+                self._logr.warning("Rolled back the partial entry of a crashed writer of output file '%s'" % self._output_file)
+
+            # Renamed into place, a journal is never seen half written
+            journal_file = self._output_file + JOURNAL_SUFFIX
+            with open(journal_file + '.tmp', 'w') as f:
+                f.write('%d' % os.fstat(fileno).st_size)
+            os.replace(journal_file + '.tmp', journal_file)
+
+            stream.write(entry)
+            stream.flush()
+            os.remove(journal_file)
         finally:
-            imageBuf.close()
+            fcntl.flock(fileno, fcntl.LOCK_UN)
 
 
     def close(self):
@@ -238,12 +399,13 @@ class Generator(object):
         automatically if necessary upon exit of the context's with block.
 
         """
-        if self._output_file_stream:
-            self._output_file_stream.close()
-            self._output_file_stream = None
-            self._logr.debug("Closed output file '%s' write stream" % self._output_file)
-        else:
-            self._logr.debug("The output file '%s' write stream is ALREADY CLOSED" % self._output_file)
+        with self._lock:
+            if self._output_file_stream:
+                self._output_file_stream.close()
+                self._output_file_stream = None
+                self._logr.debug("Closed output file '%s' write stream" % self._output_file)
+            else:
+                self._logr.debug("The output file '%s' write stream is ALREADY CLOSED" % self._output_file)
 
 
 if __name__ == "__main__":
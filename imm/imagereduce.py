@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The imagereduce module decodes very large images at a reduced size, so that the memory needed
+depends on the size wanted rather than on the size of the image file's raster.
+
+PIL.Image.open() only reads an image file's header. Before any pixel is decoded:
+
+    - a JPEG image is set to decode at 1/2, 1/4 or 1/8 scale with draft(), which the JPEG
+      decoder does for little more than the cost of the smaller image;
+    - an uncompressed image (BMP, PPM, uncompressed TIFF, ...) is read a strip of rows at a
+      time, each strip reduced with reduce() as soon as it is decoded;
+    - any other image is decoded in full and then reduced with reduce(), a palette or
+      bilevel image converted first so that its pixels are averaged rather than picked.
+
+The remaining scaling is done on the already small image with resize(). A max_pixels limit
+refuses images that would still have more pixels than that to decode.
+
+"""
+
+__author__  = 'E.R. Uber'
+__email__   = 'eruber@gmail.com'
+__license__ = 'ISCL'
+__version__ = '2.1.0'
+
+#----------------------------------------------------------------------------------------
+import math
+import struct
+
+#----------------------------------------------------------------------------------------
+from PIL import Image
+
+#----------------------------------------------------------------------------------------
+# Bytes of raw pixel data read and decoded at a time by the strip decoder
+STRIP_BYTES = 16 * 1024 * 1024
+
+#----------------------------------------------------------------------------------------
+class ImageTooLargeError(Exception):
+    pass
+
+
+# The modes reduce() cannot average pixels of, and the mode such an image is converted to
+# before it is reduced; a palette image with transparency is converted to RGBA, a 16 bit
+# image is converted back once reduced
+REDUCIBLE_MODES = {
+    '1'     : 'L',
+    'P'     : 'RGB',
+    'PA'    : 'RGBA',
+    'I;16'  : 'I',
+    'I;16L' : 'I',
+    'I;16B' : 'I',
+    'I;16N' : 'I',
+}
+
+#----------------------------------------------------------------------------------------
+def open_image(fp, huge=False):
+    """
+    Returns PIL.Image.open(fp). If huge is True, the image is opened without Pillow's
+    decompression bomb check (see PIL.Image.MAX_IMAGE_PIXELS), to be replaced by the
+    max_pixels limit of reduce_image(): the image plugins registered with
+    PIL.Image.register_open() are tried in turn on the image header, as open() does, and
+    PIL.Image.MAX_IMAGE_PIXELS is left alone for the images other threads open.
+    """
+    if not huge:
+        return(Image.open(fp))
+
+    if hasattr(fp, 'read'):
+        start = fp.tell()
+        prefix = fp.read(16)
+    else:
+        with open(fp, 'rb') as f:
+            prefix = f.read(16)
+
+    for init in (Image.preinit, Image.init):
+        init()
+        for format_id in list(Image.ID):
+            (factory, accept) = Image.OPEN[format_id]
+            accepted = accept is None or accept(prefix)
+            if not accepted or isinstance(accepted, str):
+                continue
+            if hasattr(fp, 'read'):
+                fp.seek(start)
+            try:
+                # Given a path, the image opens and owns the file like Image.open() does
+                return(factory(fp))
+            except (SyntaxError, IndexError, TypeError, struct.error):
+                continue
+
+    raise Image.UnidentifiedImageError("cannot identify image file %r" % (fp,))
+
+
+#----------------------------------------------------------------------------------------
+def _reducible(image):
+    """
+    Returns image, or image converted to a mode reduce() and resize() average the pixels
+    of (see REDUCIBLE_MODES).
+    """
+    mode = REDUCIBLE_MODES.get(image.mode)
+    if mode is None:
+        return(image)
+    if mode == 'RGB' and 'transparency' in image.info:
+        mode = 'RGBA'
+    return(image.convert(mode))
+
+
+#----------------------------------------------------------------------------------------
+def fit_size(size, box):
+    """
+    Returns the largest size with the aspect ratio of size that fits in box, or size itself
+    if it already fits.
+    """
+    (w, h) = size
+    if w <= box[0] and h <= box[1]:
+        return(size)
+    scale = min(box[0] / w, box[1] / h)
+    return((max(1, int(w * scale)), max(1, int(h * scale))))
+
+
+#----------------------------------------------------------------------------------------
+def _raw_layout(image):
+    """
+    Returns the tuple (offset, rawmode, stride, orientation) describing where the rows of an
+    uncompressed image are in its file, or None if image is not a single uncompressed tile.
+    """
+    if image.mode in REDUCIBLE_MODES or len(image.tile) != 1 or image.fp is None:
+        return(None)
+
+    (codec, extents, offset, args) = image.tile[0][:4]
+    if codec != 'raw' or tuple(extents) != (0, 0) + image.size:
+        return(None)
+
+    if not isinstance(args, tuple):
+        args = (args,)
+    rawmode = args[0]
+    stride = args[1] if len(args) > 1 else 0
+    orientation = args[2] if len(args) > 2 else 1
+
+    if stride == 0:
+        try:
+            stride = len(Image.new(image.mode, (image.size[0], 1)).tobytes('raw', rawmode))
+        except Exception:
+            return(None)
+
+    if orientation not in (1, -1) or stride < 1:
+        return(None)
+
+    return((offset, rawmode, abs(stride), orientation))
+
+
+#----------------------------------------------------------------------------------------
+def _reduce_strips(image, layout, factor):
+    """
+    Returns image reduced by factor, decoding and reducing a strip of rows at a time.
+    """
+    (offset, rawmode, stride, orientation) = layout
+    (w, h) = image.size
+
+    rows = max(factor, STRIP_BYTES // stride // factor * factor)
+    reduced = Image.new(image.mode, (math.ceil(w / factor), math.ceil(h / factor)))
+
+    for y in range(0, h, rows):
+        count = min(rows, h - y)
+        if orientation == 1:
+            image.fp.seek(offset + y * stride)
+        else:
+            # Bottom-up rows, as in BMP files
+            image.fp.seek(offset + (h - y - count) * stride)
+        data = image.fp.read(count * stride)
+        strip = Image.frombytes(image.mode, (w, count), data, 'raw', rawmode, stride, orientation)
+        reduced.paste(strip.reduce(factor), (0, y // factor))
+
+    return(reduced)
+
+
+#----------------------------------------------------------------------------------------
+def reduce_image(image, box=None, max_pixels=None, resample=Image.LANCZOS):
+    """
+    Returns the opened but not yet loaded image reduced to fit in box, decoding as few pixels
+    as possible; returns image itself if it already fits.
+
+    :param image: A PIL.Image.Image object returned by PIL.Image.open().
+    :param box: The (width, height) the image must fit in, or None not to reduce it.
+    :param max_pixels: Raise ImageTooLargeError rather than decode more than max_pixels
+                       pixels at once, or None for no limit.
+    :param resample: The resampling filter of the final resize().
+    """
+    target = fit_size(image.size, box) if box else image.size
+    mode = image.mode
+
+    if target != image.size and image.format == 'JPEG':
+        image.draft(image.mode, target)
+
+    layout = None
+    factor = min(image.size[0] // target[0], image.size[1] // target[1])
+    if factor > 1:
+        layout = _raw_layout(image)
+
+    if layout is not None:
+        reduced = _reduce_strips(image, layout, factor)
+        # Loading the image would have closed its file, it is never loaded
+        image.close()
+        image = reduced
+    else:
+        if max_pixels is not None and image.size[0] * image.size[1] > max_pixels:
+            raise ImageTooLargeError("Decoding the %dx%d image would exceed the limit of %d pixels" % (image.size + (max_pixels,)))
+        if target != image.size:
+            image = _reducible(image)
+        if factor > 1:
+            image = image.reduce(factor)
+
+    if image.size != target:
+        image = image.resize(target, resample)
+
+    if image.mode != mode and mode.startswith('I;16'):
+        image = image.convert(mode)
+
+    return(image)
+
+
+if __name__ == "__main__":
+    pass
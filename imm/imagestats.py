@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+The imagestats module computes statistics of an image that applications otherwise decode the
+image at startup for, for theming and layout: its average color, how much of it is opaque,
+the bounding box of its visible pixels and whether it is mostly dark.
+
+The statistics are computed with NumPy over all the pixels of the image at once when NumPy is
+installed, else with PIL.ImageStat; both give the same results. Pixels whose alpha is 0 are not
+part of the image as it is seen, so they are left out of the average color.
+
+"""
+
+__author__  = 'E.R. Uber'
+__email__   = 'eruber@gmail.com'
+__license__ = 'ISCL'
+__version__ = '2.1.0'
+
+#----------------------------------------------------------------------------------------
+try:
+    import numpy
+except ImportError:
+    # The statistics are then computed with PIL.ImageStat
+    numpy = None
+
+#----------------------------------------------------------------------------------------
+from PIL import ImageStat
+
+#----------------------------------------------------------------------------------------
+# ITU-R 601-2 luma weights of R, G and B, as used by PIL.Image.convert('L')
+LUMA_WEIGHTS = (0.299, 0.587, 0.114)
+
+# An image whose average color has a luma below this is mostly dark
+DARK_LUMA = 96
+
+# Digits the alpha coverage is rounded to
+COVERAGE_DIGITS = 4
+
+#----------------------------------------------------------------------------------------
+def _mean_color_numpy(rgba):
+    pixels = numpy.asarray(rgba)
+    alpha = pixels[..., 3]
+    visible = alpha > 0
+    coverage = float(alpha.mean()) / 255
+    if not visible.any():
+        return((None, coverage))
+    mean = pixels[..., :3][visible].mean(axis=0)
+    return((tuple(float(value) for value in mean), coverage))
+
+
+def _mean_color_imagestat(rgba):
+    alpha = rgba.getchannel('A')
+    coverage = ImageStat.Stat(alpha).mean[0] / 255
+    if alpha.getbbox() is None:
+        return((None, coverage))
+    mask = alpha.point(lambda value: 255 if value else 0)
+    return((tuple(ImageStat.Stat(rgba.convert('RGB'), mask).mean), coverage))
+
+
+#----------------------------------------------------------------------------------------
+def image_stats(image):
+    """
+    Returns the dictionary of the statistics of image:
+
+        AverageColor  - the (r, g, b) average of its visible pixels
+        AlphaCoverage - the average of its alpha from 0.0 (transparent) to 1.0 (opaque)
+        BBox          - the (left, upper, right, lower) box of its visible pixels
+        IsDark        - True if the luma of its average color is below DARK_LUMA
+
+    AverageColor, BBox and IsDark are left out for an image that is entirely transparent.
+
+    :param image: A PIL.Image.Image object, of any mode.
+    """
+    rgba = image.convert('RGBA')
+
+    if numpy is not None:
+        (mean, coverage) = _mean_color_numpy(rgba)
+    else:
+        (mean, coverage) = _mean_color_imagestat(rgba)
+
+    stats = {
+        'AlphaCoverage' : round(coverage, COVERAGE_DIGITS),
+    }
+
+    if mean is not None:
+        luma = sum(weight * value for (weight, value) in zip(LUMA_WEIGHTS, mean))
+        stats['AverageColor'] = tuple(int(round(value)) for value in mean)
+        stats['BBox'] = rgba.getchannel('A').getbbox()
+        stats['IsDark'] = luma < DARK_LUMA
+
+    return(stats)
+
+
+if __name__ == "__main__":
+    pass
@@ -89,6 +89,48 @@ Use Case #2 - A Single Image File to be Processed
     into the Python module file named 'image.py' that will be created in the
     current directory.
 
+Use Case #1 can also scan several directories and their sub-directories:
+
+    imm --input gfx --input more_gfx --recursive --exclude "*_old.*" --module icons
+
+    Every image file found below 'gfx' and 'more_gfx' is embedded in 'icons.py'.
+    The --include GLOB and --exclude GLOB options may be repeated; a GLOB with
+    no '/' is matched against file (and directory) names, otherwise against the
+    path relative to the --input directory. Symbolic links to image files are
+    followed, symbolic links to directories are not unless --symlinks follow is
+    specified; --symlinks skip ignores all symbolic links. Image files are
+    recognized by their first bytes, not by their file name extension, so
+    'SAVE.PNG', a PNG image named 'logo.jpg' or one named 'logo' are all
+    images while 'notes.png' holding text is not.
+    An image file whose name is already used by an image file found earlier in
+    another directory is ignored.
+
+Use Case #1 can also take the list of image files to process from stdin:
+
+    git diff --name-only HEAD~ -- gfx | imm --input - --code - > icons.py
+
+    The --input - option reads a list of paths from stdin, one per line or
+    separated by NUL characters (find -print0); each path is processed as if
+    given by its own --input option and paths that do not exist are skipped.
+    The --code - option writes MODULE to stdout rather than to a file in a
+    CODE_PATH directory; logging goes to stderr as always. As MODULE is
+    streamed, a build that fails leaves it incomplete with a non-zero return
+    code. --code - cannot be combined with --append, --split, --layout,
+    --watch or --stats and ignores --show; --input - cannot be combined with
+    --watch.
+
+Use Case #1 can also read the image files of a zip or tar archive:
+
+    imm --input assets.zip --recursive --module icons
+
+    The archive is not extracted: its members are processed as the files of
+    an --input directory would be, a member 'toolbar/save.png' giving the
+    image name 'save'. The members of a zip archive are read one at a time
+    as needed, in name order; a tar archive (.tar, .tar.gz, .tar.bz2 or
+    .tar.xz) is streamed once from start to end, its members in archive
+    order. Archives are recognized by their content, and only when they are
+    themselves an --input.
+
 If the --module option is not specified, the default MODULE name used is 'gfxmodule'.
 
 If the Python module needs to be created in another location other than the
@@ -109,6 +151,115 @@ option rather than the
 
 option.
 
+Use Case #3 - Many Builds Through the Build Daemon
+
+    imm --daemon &
+    python immclient.py --input gfx --module icons
+
+    The first command line starts a long-lived build daemon listening on the
+    Unix domain socket ~/.imm/immd.sock (or the SOCKET given to --daemon).
+    The thin client immclient.py accepts the same OPTIONS as imm, forwards
+    them to the daemon and exits with the build's return code. Set the
+    environment variable IMM_SOCKET to use a socket other than the default.
+    The daemon keeps Pillow, the logging sub-system and the command line
+    parser loaded between builds, which matters when many small directories
+    are built one after another. Stop the daemon with Ctrl-C or kill. The
+    daemon does not read the client's stdin nor write its stdout, so --input -
+    and --code - fail with return code 9.
+
+
+Use Case #4 - Rebuilding a MODULE Whenever Its Images Change
+
+    imm --input gfx --module icons --watch
+
+    After building 'icons.py' imm keeps running and polls 'gfx' (every 0.5
+    seconds, or every SECONDS given as --watch SECONDS). Whenever an image
+    file is added, changed or removed 'icons.py' is rebuilt; only the image
+    files that changed are read and encoded again, the data of every other
+    image is kept in memory. Stop watching with Ctrl-C. The option --watch
+    cannot be combined with --append and it ignores --show.
+
+
+Use Case #5 - Planning a Build Before Running It
+
+    imm --input gfx --recursive --plan plan.json
+
+    Nothing is generated. Instead a JSON document is written to 'plan.json'
+    (or to stdout if no file is named) listing each image file that would be
+    processed with its format, size and mode, the image names --fixident
+    would rename, the illegal image names and the ignored files, and an
+    estimate of MODULE's size in bytes and of the encoding time on one core
+    and on --jobs cores. Only image file headers are read, so planning is
+    fast even for very large images. The return code is the one the build
+    would most likely end with.
+
+
+Use Case #6 - Building Many MODULEs From One Config File
+
+    imm --config gfx.toml --jobs
+
+    Every target declared by 'gfx.toml' is built in turn by one process:
+
+        [defaults]
+        code = "build/gfx"
+        recursive = true
+
+        [targets.icons]
+        input = ["gfx/icons", "gfx/common"]
+
+        [targets.photos]
+        input = ["gfx/photos", "gfx/common"]
+        codec = "auto"
+
+    Each key of a target is an option without its leading '--': true for an
+    option without an argument, a list for an option that may be repeated.
+    The [defaults] apply to every target, paths are relative to the config
+    file and a target's MODULE is named after it unless 'module' says
+    otherwise. An INI file (any name not ending in .toml) may be used too,
+    its [DEFAULT] section holding the defaults and each other section being
+    a target; an option repeated is given one value per line. The options on
+    the command line apply to every target. The targets share one worker
+    pool, and an image file used by several targets with the same encoding
+    options is decoded and encoded only once. The time each target took is
+    reported at the end. The first target that fails stops the build unless
+    --keep-going is specified; the return code is that of the first target
+    that failed.
+
+
+Use Case #7 - Splitting One Build Across Machines
+
+    imm --input gfx --recursive --module icons --shard 1/3
+    imm --input gfx --recursive --module icons --shard 2/3
+    imm --input gfx --recursive --module icons --shard 3/3
+    imm --module icons --merge icons.shard1of3.immpart \
+        --merge icons.shard2of3.immpart --merge icons.shard3of3.immpart
+
+    Each of the three --shard builds, typically run on a CI node of its own,
+    decodes and encodes about a third of the image files and writes them to
+    a partial result file, 'icons.shard<i>of3.immpart' in CODE_PATH. Image
+    files are split by a stable hash of their image name, so every node
+    agrees on which shard an image belongs to without talking to the
+    others. The --merge build then generates 'icons.py' from the image data
+    of the partial results, without reading or decoding any image file; it
+    is the same module a single build would have generated. The options that
+    change the image data (--codec, --variant, --frames, --max-size, ...)
+    are given to the --shard builds and recorded in their partial results;
+    the options that change how MODULE is generated (--split, --atlas,
+    --show, ...) are given to the --merge build. Give --css and
+    --contact-sheet to both.
+
+
+Use Case #8 - Generating Several Outputs From One Build
+
+    imm --input gfx --module icons --metadata --css icons.css \
+        --css-codec auto --contact-sheet icons.png --contact-size 48
+
+    Besides 'icons.py' the build writes the image meta-data module, a style
+    sheet with a data URI rule per image and a contact sheet of thumbnails.
+    Each image file is decoded once and the decoded image is handed to every
+    output, each encoding it with its own settings, so the build costs about
+    what building 'icons.py' alone does.
+
 
 IMAGE FILE NAMES
 ----------------
@@ -174,6 +325,222 @@ the Python MODULE generated:
                             if __name__ == "__main__":
                                 pass
 
+  --jobs [JOBS]        Default is to decode and encode one image at a time.
+                       If JOBS is specified, that many worker processes decode
+                       and encode the images in parallel; if JOBS is omitted
+                       (or 0) one worker process per CPU is used. MODULE is
+                       identical to the one generated without --jobs.
+
+  --depth DEPTH        Images are discovered, read, encoded and written by
+                       concurrent stages connected by queues holding at most
+                       DEPTH images each (default 16), so memory use is set by
+                       DEPTH rather than by the number of images. DEPTH must
+                       be at least 1; below JOBS some workers are left idle.
+
+  --timeout SECONDS    Default is to wait for every image however long it
+                       takes. If SECONDS is specified, an image file whose
+                       decoding and encoding takes longer fails. Images are
+                       then always encoded in worker processes, even without
+                       --jobs, so that the worker can be killed and replaced;
+                       the images the other workers were encoding are simply
+                       encoded again.
+
+  --memory-limit BYTES Default is no limit. If BYTES is specified (the
+                       suffixes K, M and G may be used), the memory of each
+                       worker process is limited to BYTES and an image file
+                       needing more fails. If a worker crashes, the images it
+                       may have been encoding are encoded again one at a time
+                       to find the culprit. Ignored on Windows.
+
+  --keep-going         Default is to stop the build, and abandon MODULE, at
+                       the first image file that cannot be read or encoded,
+                       times out or crashes its worker. If this option is
+                       specified, the image file is left out of MODULE and
+                       the build goes on; the failures are listed at the end
+                       of the build, which returns 11.
+
+  --depfile FILE       Also write FILE, a dependency file in the Makefile
+                       syntax of gcc -MD read by Make (include FILE) and
+                       Ninja (depfile = FILE). Every file generated (MODULE,
+                       the modules of its package with --split or --layout,
+                       the --css, --contact-sheet, --metadata and --show
+                       files) is a target depending on every image file
+                       written to MODULE, or on the archive of an archive
+                       member, on the --input directories scanned, so that
+                       adding an image file rebuilds MODULE, and on the
+                       --config file. A directory the targets are written to
+                       is left out. Only written when MODULE is generated;
+                       cannot be combined with --code -.
+
+  --shard i/N          Default is to build MODULE from every image file. If
+                       i/N is specified, the image files are split into N
+                       shards by a stable hash of their image name and only
+                       those of shard i (1 to N) are encoded, then written
+                       to the partial result MODULE.shard<i>of<N>.immpart in
+                       CODE_PATH rather than to MODULE. With --depfile the
+                       partial result is the target. Cannot be combined with
+                       --append, --watch, --merge or --code -.
+
+  --merge PARTIAL      Generate MODULE from the PARTIAL results of the N
+                       --shard builds, one --merge PARTIAL for each shard,
+                       without reading or decoding any image file; --input is
+                       ignored. The encoding options recorded in the partial
+                       results are used. Cannot be combined with --append or
+                       --watch.
+
+  --split BYTES        Default is to generate MODULE as a single module file.
+                       If BYTES is specified, MODULE is generated as a package
+                       directory in CODE_PATH holding shard modules _shard0000.py,
+                       _shard0001.py, ... of at most BYTES each (the suffixes K,
+                       M and G may be used, as in --split 2M) and an __init__.py
+                       indexing which shard holds each image. 'import MODULE'
+                       only reads the index; a shard module is imported the
+                       first time one of its image data names is used. An image
+                       larger than BYTES gets a shard module of its own.
+
+  --layout LAYOUT      Default LAYOUT is 'module', every image goes in MODULE.
+                       With 'directory' MODULE is generated as a package in
+                       CODE_PATH mirroring the --input directory tree: each
+                       sub-directory is a sub-package and the image data of
+                       each directory's images goes in its package's
+                       __init__.py. With 'image' the package tree is the same
+                       but each image gets a module of its own. For example
+                       'gfx/toolbar/save.png' built with --module icons is:
+
+                            icons.toolbar.save_data        (directory)
+                            icons.toolbar.save.save_data   (image)
+
+                       Every package imports its sub-packages and image
+                       modules only when they are first used, so an
+                       application loads just the images it needs. Directory
+                       names are checked (and fixed by --fixident) like image
+                       names; the same image name may be used in different
+                       directories. --layout cannot be combined with --append
+                       or --split and it ignores --show.
+
+  --atlas [SIZE]       Default is to generate a data string per image. If this
+                       option is specified the images are packed into atlas
+                       images of at most SIZE x SIZE pixels (default 1024)
+                       and MODULE holds a data string per atlas instead, the
+                       dictionary ATLAS_INDEX mapping each image name to
+                       (atlas, x, y, width, height, mode) and two accessors:
+
+                            get_image(name)        a PIL image, in the mode
+                                                   of its image file
+                            get_photo_image(name)  a tkinter.PhotoImage
+
+                       Each atlas is decoded once, the first time one of its
+                       images is asked for; one decode then serves hundreds
+                       of small images. An image larger than SIZE gets an
+                       atlas of its own. --atlas cannot be combined with
+                       --append, --split or --layout and it ignores --show.
+
+  --codec CODEC        Default CODEC is png, every image is converted to PNG.
+                       The other codecs are webp-lossless, webp, jpeg, gif
+                       and raw (uncompressed pixels). With auto each image is
+                       encoded with png, webp-lossless, webp, jpeg and gif in
+                       parallel and the smallest image data is kept among the
+                       lossless ones and the lossy ones with a PSNR of at
+                       least --min-psnr DB (default 40), so photographs and
+                       flat icons each get the codec suiting them. MODULE
+                       then also gets IMAGE_CODECS, the codec of each image,
+                       and get_image(name) which decodes any of them. --codec
+                       cannot be combined with --append, --split, --atlas or
+                       --layout; --codec raw ignores --show.
+
+  --frames MODE        Default MODE is first, only the first frame of an
+                       animated GIF, APNG or WebP or of a multi-page TIFF, and
+                       only the largest size of an ICO file, is generated.
+                       With split every distinct frame (or size) is also
+                       generated as <image name>_frame<N>_data; identical
+                       frames share one. With apng or webp an animation is
+                       re-encoded as a whole as an APNG or a lossless animated
+                       WebP in <image name>_data (other multi-frame images
+                       are split). MODULE then also gets the FRAMES index of
+                       the image data, offset and duration in milliseconds,
+                       width and height of each frame. Frames are decoded one
+                       at a time. --frames cannot be combined with --append,
+                       --split, --atlas, --layout, --max-size or --max-pixels.
+
+  --max-size SIZE      Default is to generate each image at its own size. If
+                       SIZE (N for N x N pixels, or WxH) is specified, larger
+                       images are reduced to fit in SIZE. A JPEG image is
+                       decoded at 1/2, 1/4 or 1/8 scale with Pillow's draft()
+                       and an uncompressed image (BMP, PPM, TIFF, ...) is read
+                       and reduced a strip of rows at a time, so the memory
+                       used depends on SIZE rather than on the image file;
+                       other images are decoded in full, then reduced with
+                       Pillow's reduce() and resize(). Pillow's decompression
+                       bomb check is not made, see --max-pixels.
+
+  --max-pixels PIXELS  Default is Pillow's decompression bomb check, or no limit
+                       with --max-size. If PIXELS is specified, an image that
+                       would need more than PIXELS pixels decoded at once
+                       (after --max-size) fails the build instead, keeping the
+                       memory of each worker predictable. Image files larger
+                       than 64 MiB are read by the worker itself rather than
+                       passed to it.
+
+  --variant NAME=SIZE  Default is to generate each image at its own size only.
+                       Each --variant also generates the image resized to fit
+                       in SIZE (N for N x N pixels, or WxH) keeping its aspect
+                       ratio, as <image name>_NAME_data. For example:
+
+                            --variant 1x=16 --variant 2x=32 --variant thumb=64
+
+                       The image file is decoded once for all its variants.
+                       MODULE also gets the VARIANTS index and the accessor
+                       get_variant(name, size) returning the image data of
+                       the variant (or the image itself) nearest to size.
+
+  --resample FILTER    The resampling FILTER of --variant, one of nearest,
+                       box, bilinear, hamming, bicubic or lanczos (default).
+                       Downscaling first shrinks the image cheaply by an
+                       integer factor with Pillow's reduce().
+
+  --variant-cache DIR  Variants are cached in DIR (default ~/.imm/variants)
+                       by the content of their image file, so an unchanged
+                       image file is never resized again by later builds.
+                       --variant cannot be combined with --append, --split,
+                       --atlas or --layout.
+
+  --css FILE           Also write the style sheet FILE holding a rule per
+                       image, named after the image (prefixed by its package
+                       names with --layout), that sets its width, height and
+                       background-image, the image as a data URI.
+
+  --css-codec CODEC    The CODEC of the --css data URIs, one of gif, jpeg,
+                       png, webp, webp-lossless or auto. Default is png.
+
+  --contact-sheet FILE Also write the PNG FILE, a contact sheet laying out a
+                       thumbnail of every image in rows.
+
+  --contact-size SIZE  The thumbnails of --contact-sheet fit in SIZE, N for
+                       N x N or WxH pixels. Default is 64.
+
+                       The --css and --contact-sheet data of an image are
+                       made from the image decoded to encode it into MODULE;
+                       no image file is decoded more than once however many
+                       outputs are written.
+
+  --metadata           Also generate the image meta-data module
+                       image_meta_data.py in CODE_PATH, as --show does, but
+                       not the show module.
+
+  --stats              Also compute for every image, from the image decoded to
+                       encode it, the statistics an application would
+                       otherwise decode it for and write them to the image
+                       meta-data module (implies --metadata):
+
+                           AverageColor   (r, g, b) of its visible pixels
+                           AlphaCoverage  its average alpha, 0.0 to 1.0
+                           BBox           the box of its visible pixels
+                           IsDark         True if it is mostly dark
+
+                       The pixels are processed with NumPy if it is
+                       installed, else with PIL.ImageStat. Cannot be combined
+                       with --code -.
+
   --show               Default is to just generate MODULE. If this option is
                        specified two more Python Module files will be generated
                        in CODE_PATH:
@@ -215,6 +582,14 @@ This utility exits with the following return codes:
     6 - The option --input specifies nothing that leads to recognizeable image file(s)
     7 - Mis-use file object in codegenerator.py (left open; should be closed for re-use)
     8 - Unable to create --code CODE_PATH
+    9 - Unable to start the build daemon or to reach it from immclient.py
+   10 - Command line options that cannot be used together were specified
+   11 - One or more image files failed to be read or encoded, timed out or
+        crashed their worker process (see --timeout and --keep-going)
+   12 - The option --config specifies a file that cannot be read or that is
+        not a valid build configuration
+   13 - The --merge partial results cannot be read, are not one for each
+        shard or were built with different encoding options
 
 
 CREDITS
@@ -248,6 +623,9 @@ import sys
 import platform
 import pprint
 import re
+import json
+import time
+import functools
 
 
 #-------------------------------------------------------------------------------
@@ -260,8 +638,21 @@ from imm.cli import utils
 from imm.cli import pager
 from imm.cli import showgenerator as Sg
 from imm.cli import codegenerator as Cg
+from imm.cli import daemon
+from imm.cli import pipeline
+from imm.cli import discovery
+from imm.cli import watcher
+from imm.cli import planner
+from imm.cli import workers
+from imm.cli import sniffer
+from imm.cli import depfile
+from imm.cli import config
+from imm.cli import frames
+from imm.cli import shards
+from imm.cli import outputs as Ou
 
 from imm import imagedata
+from imm import imagecodecs
 
 #-------------------------------------------------------------------------------
 # identifier ::=  (letter|"_") (letter | digit | "_")*
@@ -273,22 +664,302 @@ from imm import imagedata
 # See: http://stackoverflow.com/questions/5474008/regular-expression-to-confirm-whether-a-string-is-a-valid-identifier-in-python
 pythonIdentifier = re.compile(r"^[^\d\W]\w*\Z", re.UNICODE)
 
+# The name of frame N of an image with --frames split, see CodeGen.genFrameData()
+FRAME_NAME = re.compile(r"^(.+)_frame\d+\Z")
+
+#-------------------------------------------------------------------------------
+def selectImages(args, input_img_files, ignoredFiles, illegalIdentifiers, identmappings, logger, planning=False):
+    """
+    Yields the tuple (imageName, imgFilePath, ext, package) for each image file
+    of the (relpath, path) tuples of input_img_files that will be processed.
+    With --layout directory or image, package is the tuple of package names
+    of the directories of relpath; otherwise it is empty.
+
+    Files that are not recognizable image files, by their first bytes (see
+    sniffer.py), are appended to ignoredFiles, as are image files whose image
+    name was already used by an earlier image file found in another directory.
+    With --layout, an image file whose image name clashes with the name of a
+    sub-package found earlier, or whose package clashes with an image found
+    earlier (save.png next to save/), is ignored too.
+
+    The file system prevents image files in the same directory from having
+    the same name; however, a legal file system name can be an illegal Python
+    identifier; so each image name (sans file extension) is checked, as is
+    that it does not clash with a name generated for another image (see
+    generatedNames()). With --fixident the name is mapped in identmappings to
+    a legal one; otherwise it is appended to illegalIdentifiers and, since
+    the build will fail, no further images are yielded -- but all image file
+    names are still checked so the report at the end is complete. When
+    planning, the images with legal names are still yielded so the plan
+    lists all of them.
+    Directory names used as package names are checked the same way.
+    """
+    logger.info("Checking if image file(s) can be legal Python identifiers...")
+    imageNames = dict()
+    tree = args.layout != Cg.LAYOUT_MODULE
+    # With --layout, package tuple + (name,) -> ('image' or 'package', the
+    # file or directory that claimed name in the package)
+    treeNames = dict()
+    # Otherwise, the names claimed in MODULE
+    moduleNames = ModuleNames(args)
+    for (imgFile, imgFilePath, format) in sniffer.sniffFiles(input_img_files):
+        (imageName, ext) = os.path.splitext(os.path.basename(imgFile))
+        if format is None:
+            ignoredFiles.append(imgFile)
+            continue
+        ext = sniffer.imageType(format, ext)
+
+        names = [ imageName ]
+        if tree:
+            names = imgFile.split('/')[:-1] + names
+
+        for (i, name) in enumerate(names):
+            if not pythonIdentifier.match(name):
+                if not args.fixident:
+                    if name not in illegalIdentifiers:
+                        illegalIdentifiers.append(name)
+                    names = None
+                    break
+
+                badIdent2 = name.replace(' ', '_')
+                badIdent2 = badIdent2.replace('-', '_')
+                identmappings[name] = args.fixident + badIdent2
+
+                new_ident_name = imagedata.make_string_valid_python_identifier(identmappings[name])
+                logger.warning("Renaming imageName '%s' (illegal Python identifier) to '%s'" % (name, new_ident_name))
+                names[i] = new_ident_name
+
+        if names is None:
+            continue
+
+        imageName = names[-1]
+        # Package names are lower cased like image names, see CodeGen.processImage()
+        package = tuple(name.lower() for name in names[:-1])
+
+        # Image names are lower cased in MODULE, see CodeGen.processImage()
+        key = package + (imageName.lower(),)
+        if key in imageNames:
+            logger.warning("Image file '%s' ignored, its image name '%s' is already used by '%s'" % (imgFile, imageName, imageNames[key]))
+            ignoredFiles.append(imgFile)
+            continue
+
+        if tree:
+            # An image module, or image data variable, shares the namespace of
+            # its package with the sub-packages
+            attribute = imageName.lower() if args.layout == Cg.LAYOUT_IMAGE else imageName.lower() + '_data'
+            clash = None
+            (kind, owner) = treeNames.get(package + (attribute,), ('image', None))
+            if kind == 'package':
+                clash = "its image name '%s' is already used by the sub-directory '%s'" % (imageName, owner)
+            for i in range(len(package)):
+                (kind, owner) = treeNames.get(package[:i+1], ('package', None))
+                if kind == 'image':
+                    clash = "its directory '%s' is already used by the image file '%s'" % ('/'.join(imgFile.split('/')[:i+1]), owner)
+            if clash is not None:
+                logger.warning("Image file '%s' ignored, %s" % (imgFile, clash))
+                ignoredFiles.append(imgFile)
+                continue
+            treeNames[package + (attribute,)] = ('image', imgFile)
+            for i in range(len(package)):
+                treeNames.setdefault(package[:i+1], ('package', '/'.join(imgFile.split('/')[:i+1])))
+        else:
+            owner = moduleNames.owner(imageName)
+            if owner is not None and args.fixident:
+                new_ident_name = imagedata.make_string_valid_python_identifier(args.fixident + imageName)
+                logger.warning("Renaming imageName '%s' (clashes with a name generated for '%s') to '%s'" % (imageName, owner, new_ident_name))
+                identmappings[imageName] = new_ident_name
+                imageName = new_ident_name
+                owner = moduleNames.owner(imageName)
+            if owner is not None:
+                logger.error("The image name '%s' of '%s' clashes with a name generated for '%s'" % (imageName, imgFile, owner))
+                if imageName not in illegalIdentifiers:
+                    illegalIdentifiers.append(imageName)
+                continue
+            moduleNames.claim(imageName, imgFile)
+
+        imageNames[key] = imgFile
+
+        if len(illegalIdentifiers) > 0 and not planning:
+            continue
+
+        logger.info("Processing Image Name '%s' from file: '%s'" % (imageName, imgFile))
+
+        yield (imageName, imgFilePath, ext, package)
+
+
 #-------------------------------------------------------------------------------
-def main():
+def generatedNames(args, imageName):
+    """
+    Returns the names, besides imageName itself, MODULE gets image data
+    variables for (as <name>_data) from the image named imageName: one per
+    --variant.
+    """
+    return [ "%s_%s" % (imageName, variant_name) for (variant_name, box) in (args.variant or ()) ]
+
+
+#-------------------------------------------------------------------------------
+class ModuleNames():
+    """
+    The names of the image data variables claimed in MODULE by the images
+    selected so far: each image's name and the names generated for it, see
+    generatedNames(). With --frames split, an image also claims every
+    <image name>_frame<N> since how many frames it has is only known once it
+    is decoded.
+    """
+    def __init__(self, args):
+        self._split_frames = args.frames == frames.FRAMES_SPLIT
+        self._args = args
+        self._names = dict()        # name -> the image file that claimed it
+        self._frames = dict()       # image name -> the image file that claimed its frame names
+        self._frame_like = dict()   # image name -> the first image file named like one of its frames
+
+
+    def owner(self, imageName):
+        """
+        Returns the image file that already claimed imageName, or a name
+        generated for it, or None.
+        """
+        name = imageName.lower()
+        for stem in [ name ] + generatedNames(self._args, name):
+            if stem in self._names:
+                return self._names[stem]
+
+        if self._split_frames:
+            match = FRAME_NAME.match(name)
+            if match and match.group(1) in self._frames:
+                return self._frames[match.group(1)]
+            return self._frame_like.get(name)
+
+        return None
+
+
+    def claim(self, imageName, imgFile):
+        """
+        Claim imageName, and the names generated for it, for the image file imgFile.
+        """
+        name = imageName.lower()
+        for stem in [ name ] + generatedNames(self._args, name):
+            self._names[stem] = imgFile
+
+        if self._split_frames:
+            self._frames[name] = imgFile
+            match = FRAME_NAME.match(name)
+            if match:
+                self._frame_like.setdefault(match.group(1), imgFile)
+
+
+#-------------------------------------------------------------------------------
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
     if not os.path.exists(C.APP_PATH):
         os.makedirs(C.APP_PATH, exist_ok=True)
 
     logSubSystem = loggingsetup.Setup(C.LOGGER)
+
+    #---------------------------------------------------------------------------
+    # See imm.cli/commandline.py
+    (args, cliparser) = Cli.parseCmdLine(__version__, argv)
+
+    if args.daemon:
+        # See imm.cli/daemon.py -- serves builds until interrupted
+        server = daemon.BuildDaemon(args.daemon, logSubSystem, build, __version__)
+        sys.exit(server.serve())
+
+    if args.config:
+        sys.exit(buildTargets(args, logSubSystem, argv))
+
+    build(args, cliparser, logSubSystem, argv)
+
+
+#-------------------------------------------------------------------------------
+def buildTargets(args, logSubSystem, argv):
+    """
+    Build every target of the --config FILE in turn and return a RETURN CODE,
+    the first one that is not 0. The other options of argv apply to every
+    target, after the target's own.
+
+    The targets share the worker pool and the images they encode: an image
+    file used by several targets with the same encoding options is decoded
+    and encoded once.
+    """
+    logger = logSubSystem.Logger()
+    if args.quiet:
+        logSubSystem.QuietConsoleLogger()
+
+    try:
+        targets = config.loadConfig(args.config)
+        base_dir = os.path.dirname(os.path.abspath(args.config))
+        commands = [ (name, config.targetArgv(name, options, base_dir)) for (name, options) in targets ]
+    except config.ConfigError as e:
+        logger.fatal(str(e))
+        return 12
+
+    if len(commands) == 0:
+        logger.fatal("The config '%s' declares no target." % args.config)
+        return 12
+
+    # The command line less --config FILE
+    common_argv = list()
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == '--config':
+            skip = True
+        elif not arg.startswith('--config='):
+            common_argv.append(arg)
+
+    caches = dict()
+    report = list()
+    return_code = 0
+    for (name, target_argv) in commands:
+        logger.warning("Building target '%s'..." % name)
+        start = time.perf_counter()
+        try:
+            (target_args, cliparser) = Cli.parseCmdLine(__version__, target_argv + common_argv)
+            # Only a --depfile looks at it, the config is a dependency of every target
+            target_args.config = args.config
+            build(target_args, cliparser, logSubSystem, target_argv + common_argv, caches)
+            status = 0
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else 12
+        report.append((name, status, time.perf_counter() - start))
+
+        if status != 0:
+            return_code = return_code or status
+            if not args.keep_going:
+                break
+
+    msg = "Built %d of the %d target(s) of '%s':\n\n" % (len(report), len(commands), args.config)
+    msg += "   %-24s %6s %10s\n" % ('TARGET', 'RETURN', 'SECONDS')
+    for (name, status, seconds) in report:
+        msg += "   %-24s %6d %10.3f\n" % (name, status, seconds)
+    msg += "   %-24s %6d %10.3f\n" % ('(total)', return_code, sum(seconds for (name, status, seconds) in report))
+    logger.warning(msg)
+
+    return return_code
+
+
+#-------------------------------------------------------------------------------
+def build(args, cliparser, logSubSystem, argv, caches=None):
+    """
+    Build the MODULE described by the parsed command line args.
+
+    Like the rest of the CLI this exits via sys.exit() with one of the RETURN
+    CODES; the build daemon catches SystemExit to report the return code to
+    the client that forwarded the command line.
+
+    caches - a dictionary of the pipeline.EncodeCache of each encoderOptions()
+             shared by the builds of a --config, or None
+    """
     logger = logSubSystem.Logger()
 
     platformdata = platform.platform() + " using Python " + platform.python_version()
     IDENT = os.path.basename(sys.argv[0]) + " " + __version__ + " running on " + platformdata
-    
-    #---------------------------------------------------------------------------
-    # See imm.cli/commandline.py
-    (args, cliparser) = Cli.parseCmdLine(__version__)
 
-    if len(sys.argv) < 2:
+    if len(argv) < 1:
         print(IDENT, '\n')
         cliparser.print_usage()
         print("\nwhere HELP_TOPIC can be one of the following:")
@@ -352,7 +1023,7 @@ def main():
     args.loglevel = args.loglevel.upper()
 
     if args.quiet:
-        log.QuietConsoleLogger()
+        logSubSystem.QuietConsoleLogger()
     else:
         # Only change the logging level for the Console Handler, this will
         # leave the logging level for the File Handler unchanged -- which
@@ -372,26 +1043,33 @@ def main():
 
     #---------------------------------------------------------------------------
 
-    logger.debug("Cmd Line: %s" % sys.argv)
+    logger.debug("Cmd Line: %s" % argv)
     logger.debug(args)
     logger.info(utils.FormatArgsNamespace(args))
 
     #---------------------------------------------------------------------------
-    input_img_files = list()
-    if not os.path.exists(args.input):
-        logger.fatal("The option --input specifies an argument '%s' that does not exist!" % args.input)
-        sys.exit(1)
-    elif os.path.isdir(args.input):
-        logger.info("The option --input specifies a directory '%s'" % args.input)
-        input_img_files = [ f for f in os.listdir(args.input) if os.path.isfile(os.path.join(args.input,f)) ]
-    elif os.path.isfile(args.input):
-        logger.info("The option --input specifies a file '%s'" % args.input)
-        (dirname, imgfilename) = os.path.split(args.input)
-        args.input = dirname
-        input_img_files.append(imgfilename)
-    else:
-        logger.fatal("The option --input specifies an argument that is not a directory and is not a file!")
-        sys.exit(2)
+    if not args.input:
+        args.input = ['.']
+
+    for input_root in args.input:
+        if input_root == C.STDIN:
+            logger.info("The option --input specifies a list of image files read from stdin")
+        elif not os.path.exists(input_root):
+            logger.fatal("The option --input specifies an argument '%s' that does not exist!" % input_root)
+            sys.exit(1)
+        elif os.path.isdir(input_root):
+            logger.info("The option --input specifies a directory '%s'" % input_root)
+        elif os.path.isfile(input_root):
+            logger.info("The option --input specifies a file '%s'" % input_root)
+        else:
+            logger.fatal("The option --input specifies an argument that is not a directory and is not a file!")
+            sys.exit(2)
+
+    # See imm.cli/discovery.py -- a generator, the input directories are
+    # scanned while images are processed
+    finder = discovery.Discovery(recursive=args.recursive, include=args.include,
+                                 exclude=args.exclude, symlinks=args.symlinks)
+    input_img_files = finder.scan(args.input)
 
     if args.module:
         if not pythonIdentifier.match(args.module):
@@ -420,60 +1098,54 @@ def main():
                 args.fixident = None
 
     #---------------------------------------------------------------------------
-    # The file system prevents image files in the same directory from having
-    # the same name; however, a legal file system name can be an illegal Python
-    # identifier; so we check the list of images that will be processed to make
-    # sure each one is a legal Python identifier (sans file exstension).
-    # We check them all and give a report at the end.
-    logger.info("Checking if image file(s) can be legal Python identifiers...")
-    count = 0
-    illegalIdentifiers = list()
-    for imgFile in input_img_files:
-        (imageName, ext) = os.path.splitext(imgFile)
-        if ext in C.IMG_EXTS:
-            count += 1
-            if not pythonIdentifier.match(imageName):
-                illegalIdentifiers.append(imageName)
-
-    if count == 0:
-        logger.error("No image files were found.")
-        # A directory was specified that contains on recognizeable image files
-        # or a file was specified that is not a recognizeable image file.
-        # This is a user error...
-        logger.fatal("The --input option names a directory with no recognizable image files or names a single image file that is not recognizable.")
-        sys.exit(6)
-
-    identmappings = dict()
-    if len(illegalIdentifiers) > 0:
-        if args.fixident:
-            # a valid fix ident prefix, setup a mapping
-
-            for badIdent in illegalIdentifiers:
-                badIdent2 = badIdent.replace(' ', '_')
-                badIdent2 = badIdent2.replace('-', '_')
-                identmappings[badIdent] = args.fixident + badIdent2
-
-            dict_txt = pprint.pformat(identmappings, indent=4, width=1)
-            logger.info("Bad Identifier Mapping:\n\n%s" % dict_txt)
+    if args.plan:
+        # See imm.cli/planner.py -- reads image headers only, generates nothing
+        ignoredFiles = list()
+        illegalIdentifiers = list()
+        identmappings = dict()
+        images = selectImages(args, input_img_files, ignoredFiles, illegalIdentifiers, identmappings, logger, planning=True)
+        plan = planner.Planner(logger, jobs=args.jobs).plan(images, ignoredFiles, illegalIdentifiers, identmappings)
+
+        plan_text = json.dumps(plan, indent=2)
+        if args.plan == C.STDOUT:
+            print(plan_text)
         else:
-            # not valid fix ident prefix, error out
-            msg  = '\n\n' + 80*'-' + '\n'
-            msg += '   The following image file(s) do not represent a legal Python Identfier:\n\n'
-            for badIdent in illegalIdentifiers:
-                msg += "      '%s'\n" % badIdent
-            msg += '\n   Please change their file name(s) and re-run,\n'
-            msg += '   or use the --fixident [PREFIX] option to potentially fix this issue.\n'
-            msg += '   A legal Python identifer must meet the following definition:\n\n      identifier ::=  (letter|"_") (letter | digit | "_")*\n'
-            msg += 80*'-' + '\n'
-            logger.critical(msg)
-            sys.exit(5)
+            with open(args.plan, 'w', encoding=C.DEFAULT_ENCODE) as f:
+                f.write(plan_text + '\n')
+            logger.info("Build plan written to '%s'" % args.plan)
+
+        sys.exit(plan['return_code'])
 
     #---------------------------------------------------------------------------
+    partials = None
+    if args.merge:
+        if args.shard or args.append or args.watch is not None:
+            logger.fatal("The option --merge cannot be combined with the option --shard, --append or --watch.")
+            sys.exit(10)
 
-    logger.info("%d image file(s) will be processed..." % count)
+        # See imm.cli/shards.py -- the encoding options are those the shards used
+        try:
+            partials = shards.PartialSet(args.merge)
+        except shards.ShardError as e:
+            logger.fatal(e)
+            sys.exit(13)
+        for (name, value) in partials.Options.items():
+            setattr(args, name, value)
+
+    if args.stats and not args.show:
+        # The statistics are written to the image meta-data module
+        args.metadata = True
+
+    if args.code == C.STDOUT:
+        if args.append or args.split or args.layout != Cg.LAYOUT_MODULE or args.watch is not None or args.depfile or args.shard or args.stats:
+            logger.fatal("The option --code - cannot be combined with the option --append, --split, --layout, --watch, --depfile, --shard or --stats.")
+            sys.exit(10)
+        if args.show or args.metadata:
+            logger.warning("The option %s is ignored by --code -." % ('--show' if args.show else '--metadata'))
+            (args.show, args.metadata) = (False, False)
 
     # If args.code (--code CODE_PATH) does NOT exist create it
-    if not os.path.exists(args.code):
+    elif not os.path.exists(args.code):
         logger.info("Code path '%s' does NOT exist, creating it..." % args.code)
         try:
             os.makedirs(args.code)
@@ -483,7 +1155,202 @@ def main():
 
         logger.info("Created path '%s'" % args.code)
 
+    if args.depth < 1:
+        logger.fatal("The option --depth needs a DEPTH of at least 1.")
+        sys.exit(10)
+
+    if args.split and args.append:
+        logger.fatal("The option --split cannot be combined with the option --append.")
+        sys.exit(10)
+
+    if args.atlas is not None:
+        if args.atlas < 1 or args.append or args.split or args.layout != Cg.LAYOUT_MODULE:
+            logger.fatal("The option --atlas needs a SIZE of at least 1 and cannot be combined with the option --append, --split or --layout.")
+            sys.exit(10)
+        if args.show:
+            logger.warning("The option --show is ignored by --atlas.")
+            args.show = False
+
+    if args.codec != imagecodecs.DEFAULT_CODEC:
+        if args.append or args.split or args.atlas or args.layout != Cg.LAYOUT_MODULE:
+            logger.fatal("The option --codec %s cannot be combined with the option --append, --split, --atlas or --layout." % args.codec)
+            sys.exit(10)
+        if args.codec == 'raw' and args.show:
+            logger.warning("The option --show is ignored by --codec raw.")
+            args.show = False
+
+    if args.frames != frames.DEFAULT_FRAMES:
+        if args.append or args.split or args.atlas or args.layout != Cg.LAYOUT_MODULE or args.max_size or args.max_pixels is not None:
+            # The frames are split from the image as decoded, never reduced
+            logger.fatal("The option --frames %s cannot be combined with the option --append, --split, --atlas, --layout, --max-size or --max-pixels." % args.frames)
+            sys.exit(10)
+
+    if args.variant:
+        if args.append or args.split or args.atlas or args.layout != Cg.LAYOUT_MODULE:
+            logger.fatal("The option --variant cannot be combined with the option --append, --split, --atlas or --layout.")
+            sys.exit(10)
+        names = [ name for (name, box) in args.variant ]
+        if len(set(names)) != len(names):
+            logger.fatal("The option --variant names the same variant more than once: %s" % names)
+            sys.exit(10)
+
+    if args.layout != Cg.LAYOUT_MODULE:
+        if args.append or args.split:
+            logger.fatal("The option --layout %s cannot be combined with the option %s." % (args.layout, '--append' if args.append else '--split'))
+            sys.exit(10)
+        if args.show:
+            logger.warning("The option --show is ignored by --layout %s." % args.layout)
+            args.show = False
+
+    if args.shard:
+        if args.append or args.watch is not None:
+            logger.fatal("The option --shard cannot be combined with the option %s." % ('--append' if args.append else '--watch'))
+            sys.exit(10)
+
+        sys.exit(generateShard(args, logger, input_img_files, finder))
+
+    if args.watch is not None:
+        if args.append or C.STDIN in args.input:
+            logger.fatal("The option --watch cannot be combined with the option %s." % ('--append' if args.append else '--input -'))
+            sys.exit(10)
+        if args.show:
+            logger.warning("The option --show is ignored by --watch.")
+            args.show = False
+
+        # See imm.cli/watcher.py
+        watch = watcher.Watcher(logger, finder, args.input, interval=args.watch, ignore=[ args.code ])
+        sys.exit(watch.run(lambda files, cache, generated: generate(args, logger, files, cache, generated=generated, finder=finder)))
+
+    cache = None
+    if caches is not None:
+        cache = caches.setdefault(tuple(sorted(encoderOptions(args).items())), pipeline.EncodeCache())
+
+    sys.exit(generate(args, logger, input_img_files, cache, partials, finder=finder))
+
+
+#-------------------------------------------------------------------------------
+def encoderOptions(args):
+    """
+    Returns the dictionary of the keyword arguments of workers.encodeImage()
+    the command line args asks for; empty if it asks for none.
+    """
+    if args.variant or args.codec != imagecodecs.DEFAULT_CODEC or args.frames != frames.DEFAULT_FRAMES or \
+       args.max_size or args.max_pixels is not None or Ou.outputSettings(args) or args.stats:
+        return dict(variants=tuple(args.variant or ()), resample=args.resample, cache_dir=args.variant_cache,
+                    codec=args.codec, min_psnr=args.min_psnr, frames=args.frames,
+                    max_size=args.max_size, max_pixels=args.max_pixels, outputs=Ou.outputSettings(args),
+                    stats=args.stats)
+    return dict()
+
+
+#-------------------------------------------------------------------------------
+def encoder(args):
+    """
+    Returns the function encoding an image the way the command line args asks.
+    """
+    options = encoderOptions(args)
+    if options:
+        return functools.partial(workers.encodeImage, **options)
+    return workers.encodeImage
+
+
+#-------------------------------------------------------------------------------
+def illegalIdentifiersMessage(illegalIdentifiers):
+    msg  = '\n\n' + 80*'-' + '\n'
+    msg += '   The following image file(s) do not represent a legal Python Identfier,\n'
+    msg += '   or clash with a name generated for the --variant or --frames of another image:\n\n'
+    for badIdent in illegalIdentifiers:
+        msg += "      '%s'\n" % badIdent
+    msg += '\n   Please change their file name(s) and re-run,\n'
+    msg += '   or use the --fixident [PREFIX] option to potentially fix this issue.\n'
+    msg += '   A legal Python identifer must meet the following definition:\n\n      identifier ::=  (letter|"_") (letter | digit | "_")*\n'
+    msg += 80*'-' + '\n'
+    return msg
+
+
+def failuresMessage(failures):
+    msg = "The following %d image file(s) failed and were left out:\n" % len(failures)
+    for (path, reason) in failures:
+        msg += "   '%s': %s\n" % (path, reason)
+    return msg
+
+
+#-------------------------------------------------------------------------------
+def dependencies(args, finder, inputs, targets):
+    """
+    Returns the dependencies of the --depfile of the targets built from the
+    image files inputs, see imm.cli/depfile.py.
+    """
+    directories = list()
+    if finder is not None:
+        for scanned in finder.Directories.values():
+            directories.extend(directory for directory in scanned if directory not in directories)
+
+    # CODE_PATH also changes while a --split or --layout package is staged
+    written = [ args.code, os.path.dirname(args.depfile) ] + [ os.path.dirname(target) for target in targets ]
+    return depfile.dependencies(inputs, directories, args.config, written)
+
+
+#-------------------------------------------------------------------------------
+def generateShard(args, logger, input_img_files, finder=None):
+    """
+    Encode the images of the --shard of the (relpath, path) tuples of
+    input_img_files into its partial result and return a RETURN CODE.
+    """
+    # See imm.cli/shards.py
+    path = shards.partialPath(args.code, args.module, args.shard)
+    options = dict((name, getattr(args, name)) for name in shards.ENCODING_OPTIONS)
+    writer = shards.PartialWriter(path, args.shard, options)
+
+    ignoredFiles = list()
+    illegalIdentifiers = list()
+    identmappings = dict()
+    images = writer.select(selectImages(args, input_img_files, ignoredFiles, illegalIdentifiers, identmappings, logger))
+
+    PLine = pipeline.Pipeline(logger, writer, jobs=args.jobs, depth=args.depth, encode=encoder(args),
+                              timeout=args.timeout, memory_limit=args.memory_limit, keep_going=args.keep_going)
+    try:
+        count = PLine.run(images)
+    except pipeline.ImageFailedError as e:
+        writer.abandon()
+        logger.fatal("%s\n   Use the --keep-going option to leave the image files that fail out of MODULE." % e)
+        return 11
+
+    if len(illegalIdentifiers) > 0:
+        writer.abandon()
+        logger.critical(illegalIdentifiersMessage(illegalIdentifiers))
+        return 5
+
+    writer.close(ignoredFiles, illegalIdentifiers, identmappings, PLine.Failures)
+    logger.info("%d image file(s) of shard %d/%d were written to '%s'" % ((count,) + args.shard + (path,)))
+
+    if args.depfile:
+        depfile.writeDepfile(args.depfile, [ path ], dependencies(args, finder, writer.Inputs, [ path ]))
+        logger.info("Dependency file written to '%s'" % args.depfile)
+
+    if len(PLine.Failures) > 0:
+        logger.error(failuresMessage(PLine.Failures))
+        return 11
+
+    return 0
+
+
+#-------------------------------------------------------------------------------
+def generate(args, logger, input_img_files, cache=None, partials=None, generated=None, finder=None):
+    """
+    Generate MODULE from the (relpath, path) tuples of input_img_files and
+    return a RETURN CODE.
+
+    cache     - a pipeline.EncodeCache of images encoded by an earlier build, or None
+    partials  - the shards.PartialSet of a --merge, MODULE is then generated
+                from its images rather than from input_img_files
+    generated - a list extended with the paths of the files generated, or None
+    finder    - the discovery.Discovery object that scanned the --input roots,
+                whose directories --depfile lists, or None
+    """
     # ---------------------------- CODE GENERATION ----------------------------
+    # A new MODULE is written aside and only replaces the previous one once
+    # the build succeeds, see CodeGen.genCommit()
     CGen = Cg.CodeGen(logger=logger, arg_namespace=args, caller_version=__version__)
 
     # If appending, this will be None
@@ -491,24 +1358,68 @@ def main():
         # New Python Module, write mode "wb"
         CGen.genModuleHeader()
 
-    ignoredFiles = list()
-    logger.debug("Input Image File List: %s" % input_img_files)
-    for imgFile in input_img_files:
-        (imageName, ext) = os.path.splitext(imgFile)
-        if ext in C.IMG_EXTS:
-            imgFilePath = os.path.join(args.input, imgFile)
-
-            if imageName in identmappings:
-                new_ident_name = imagedata.make_string_valid_python_identifier(identmappings[imageName])
-                logger.warning("Renaming imageName '%s' (illegal Python identifier) to '%s'" % (imageName, new_ident_name))
-                imageName = new_ident_name
+    if partials is not None:
+        # The images were encoded by the --shard builds, only written here
+        count = 0
+        for ((image_name, image_file_path, image_type, package), encoded) in partials.images():
+            CGen.processImage(image_name, image_file_path, image_type, encoded, package)
+            count += 1
+        partials.close()
 
-            logger.info("Processing Image Name '%s' from file: '%s'" % (imageName, imgFile))
+        ignoredFiles = partials.Ignored
+        illegalIdentifiers = partials.Illegal
+        identmappings = partials.IdentMappings
+        failures = partials.Failures
+    else:
+        ignoredFiles = list()
+        illegalIdentifiers = list()
+        identmappings = dict()
+        images = selectImages(args, input_img_files, ignoredFiles, illegalIdentifiers, identmappings, logger)
+
+        # See imm.cli/pipeline.py -- images are discovered, read, encoded and
+        # written concurrently
+        PLine = pipeline.Pipeline(logger, CGen, jobs=args.jobs, depth=args.depth, cache=cache, encode=encoder(args),
+                                  timeout=args.timeout, memory_limit=args.memory_limit, keep_going=args.keep_going)
+        try:
+            count = PLine.run(images)
+        except pipeline.ImageFailedError as e:
+            CGen.genAbandon()
+            logger.fatal("%s\n   Use the --keep-going option to leave the image files that fail out of MODULE." % e)
+            return 11
+        failures = PLine.Failures
 
-            CGen.processImage(image_name=imageName, image_file_path=imgFilePath, image_type=ext)
+    if len(illegalIdentifiers) > 0:
+        # not valid fix ident prefix, error out
+        CGen.genAbandon()
+        logger.critical(illegalIdentifiersMessage(illegalIdentifiers))
+        return 5
 
-        else:
-            ignoredFiles.append(imgFile)
+    if count == 0:
+        CGen.genAbandon()
+        logger.error("No image files were found.")
+        # A directory was specified that contains on recognizeable image files
+        # or a file was specified that is not a recognizeable image file.
+        # This is a user error...
+        logger.fatal("The --input option names a directory with no recognizable image files or names a single image file that is not recognizable.")
+        return 6
+
+    if len(identmappings) > 0:
+        dict_txt = pprint.pformat(identmappings, indent=4, width=1)
+        logger.info("Bad Identifier Mapping:\n\n%s" % dict_txt)
+
+    logger.info("%d image file(s) were processed..." % count)
+
+    if args.atlas:
+        CGen.genAtlases()
+
+    if args.variant:
+        CGen.genVariantIndex()
+
+    if args.codec != imagecodecs.DEFAULT_CODEC:
+        CGen.genCodecIndex()
+
+    if args.frames != frames.DEFAULT_FRAMES:
+        CGen.genFrameIndex()
 
     if args.module:
         # Single Python Module File
@@ -516,6 +1427,9 @@ def main():
 
         CGen.genClosure()
 
+    # The --css and --contact-sheet files
+    CGen.genOutputs()
+
     # Emit the list of ignored files
     if len(ignoredFiles) > 0:
         msg = "The following %d file(s) were ignored:\n" % len(ignoredFiles)
@@ -524,14 +1438,35 @@ def main():
 
         logger.info(msg)
 
-    if args.show:
+    if args.show or args.metadata:
         # We generated the meta-data module which is used by the generated
         # show module
         CGen.genImageMetaData()
 
+    if args.show:
         ShowGen = Sg.ShowGen(logger=logger, arg_namespace=args, caller_version=__version__).Generator()
 
-    sys.exit(0)
+    outputs = CGen.Outputs
+    if args.show or args.metadata:
+        outputs.append(os.path.join(args.code, Cg.META_DATA_MODULE_FILE))
+    if args.show:
+        outputs.append(os.path.join(args.code, Sg.SHOW_MODULE_FILE))
+
+    if args.depfile:
+        # See imm.cli/depfile.py
+        depfile.writeDepfile(args.depfile, outputs, dependencies(args, finder, CGen.Inputs, outputs))
+        logger.info("Dependency file written to '%s'" % args.depfile)
+
+    if generated is not None:
+        generated.extend(outputs)
+        if args.depfile:
+            generated.append(args.depfile)
+
+    if len(failures) > 0:
+        logger.error(failuresMessage(failures))
+        return 11
+
+    return 0
 
 if __name__ == "__main__":
     main()
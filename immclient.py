@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+#coding=utf-8
+#-------------------------------------------------------------------------------
+# immclient.py
+#
+# Image Module Maker Build Daemon Client
+#
+# Forward an Image Module Maker command line to a running build daemon.
+#_______________________________________________________________________________
+
+"""
+A thin client that forwards its command line to an Image Module Maker build
+daemon started with:
+
+    python immcli.py --daemon [SOCKET]
+
+and invoked exactly like immcli.py:
+
+    python immclient.py [OPTIONS]
+
+The daemon's socket is taken from the environment variable IMM_SOCKET and
+defaults to ~/.imm/immd.sock. Help and version requests are handled locally
+by immcli.py since they are interactive.
+
+The return code is that of the build, or 9 if the daemon cannot be reached.
+"""
+
+__version__="2.1.00"
+__author__="eruber@gmail.com"
+
+#-------------------------------------------------------------------------------
+import os
+import sys
+
+#-------------------------------------------------------------------------------
+# Only the Python Standard Library is imported by these modules
+from imm.cli import constants as C
+from imm.cli import daemon
+
+LOCAL_OPTIONS = ('--help', '-h', '--version', '-v', '--daemon')
+
+#-------------------------------------------------------------------------------
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+
+    if len(argv) < 1 or any(arg.split('=')[0] in LOCAL_OPTIONS for arg in argv):
+        import immcli
+        immcli.main(argv)
+
+    socket_path = os.environ.get(C.DAEMON_SOCKET_ENV, C.DAEMON_SOCKET)
+
+    sys.exit(daemon.forward(socket_path, argv))
+
+if __name__ == "__main__":
+    main()
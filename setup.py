@@ -33,11 +33,12 @@ setup(
     packages=[
         'imm',
     ],
-    py_modules = ['immcli'],
+    py_modules = ['immcli', 'immclient'],
     package_dir={'imm':
                  'imm'},
     include_package_data=True,
     install_requires=requirements,
+    python_requires='>=3.7',
     license="ISCL",
     zip_safe=False,
     keywords='imm',
@@ -51,9 +52,11 @@ setup(
         'Intended Audience :: Developers',
         'License :: OSI Approved :: ISC License (ISCL)',
         'Natural Language :: English',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
     ],
     test_suite='tests',
     tests_require=test_requirements
@@ -8,23 +8,870 @@ test_imm
 Tests for `imm` module.
 """
 
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import socket
+import tempfile
+import importlib
+import subprocess
+import multiprocessing
+import tarfile
+import zipfile
 import unittest
 
+from io import BytesIO, StringIO
+from contextlib import redirect_stdout, redirect_stderr
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+
 from imm import imagedata
+from imm import imagecodecs
+from imm import imagereduce
+from imm import imagestats
+from imm.cli import workers
+from imm.cli import discovery
+from imm.cli import atlas
+from imm.cli import sniffer
+from imm.cli import depfile
+from imm.cli import shards
+from imm.cli import outputs
+from imm.cli import daemon
+from imm.cli import pipeline
+from imm.cli import watcher
+from imm.cli import planner
+from imm.cli import archives
+
+import immcli
+
+IMMCLI_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'immcli.py')
+
+
+def appendEntries(module_path, writer):
+    """
+    Append 25 entries to module_path, run by several processes at once.
+    """
+    with imagedata.Generator(module_path, writemode='APPEND') as gen:
+        for entry in range(25):
+            gen.write_data(b'%d' % entry * 100, 'w%d_%d' % (writer, entry))
 
 
 class TestImm(unittest.TestCase):
 
     def setUp(self):
-        pass
+        self.tmpdir = tempfile.mkdtemp()
 
     def tearDown(self):
-        pass
+        shutil.rmtree(self.tmpdir)
+
+    def makeImage(self, name, size=(8, 6), color='red', mode='RGB'):
+        path = os.path.join(self.tmpdir, name)
+        Image.new(mode, size, color).save(path)
+        return path
+
+    def build(self, *argv):
+        """
+        Run immcli with the command line argv and return its return code.
+        """
+        try:
+            immcli.main(list(argv) + ['--quiet'])
+        except SystemExit as e:
+            return e.code
+
+    def importModule(self, name):
+        sys.path.insert(0, self.tmpdir)
+        try:
+            return importlib.import_module(name)
+        finally:
+            sys.path.remove(self.tmpdir)
+            self.addCleanup(lambda: [ sys.modules.pop(m) for m in list(sys.modules) if m.split('.')[0] == name ])
 
     def test_000_something(self):
         pass
 
+    def test_001_encode_image(self):
+        path = self.makeImage('photo.jpg')
+        data = imagedata.encode_image(path)
+        img = Image.open(BytesIO(data))
+        self.assertEqual(img.format, 'PNG')
+        self.assertEqual(img.size, (8, 6))
+
+    def test_002_write_data_matches_write(self):
+        path = self.makeImage('icon.png')
+        module1 = os.path.join(self.tmpdir, 'module1.py')
+        module2 = os.path.join(self.tmpdir, 'module2.py')
+
+        with imagedata.Generator(module1) as gen:
+            gen.write(path)
+
+        with imagedata.Generator(module2) as gen:
+            gen.write_data(imagedata.encode_image(path), 'icon')
+
+        with open(module1, 'rb') as f1, open(module2, 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+
+    def test_003_discovery_recursive_filters(self):
+        os.makedirs(os.path.join(self.tmpdir, 'sub', 'old'))
+        self.makeImage('b.png')
+        self.makeImage('A.PNG')
+        self.makeImage(os.path.join('sub', 'c.gif'))
+        self.makeImage(os.path.join('sub', 'old', 'd.png'))
+
+        finder = discovery.Discovery()
+        found = [ relpath for (relpath, path) in finder.scan([self.tmpdir]) ]
+        self.assertEqual(found, ['A.PNG', 'b.png'])
+
+        finder = discovery.Discovery(recursive=True, exclude=['old'])
+        found = [ relpath for (relpath, path) in finder.scan([self.tmpdir]) ]
+        self.assertEqual(found, ['A.PNG', 'b.png', 'sub/c.gif'])
+
+        finder = discovery.Discovery(recursive=True, include=['sub/*'])
+        found = [ relpath for (relpath, path) in finder.scan([self.tmpdir]) ]
+        self.assertEqual(found, ['sub/c.gif', 'sub/old/d.png'])
+
+    def test_004_split_package(self):
+        images = os.path.join(self.tmpdir, 'images')
+        os.makedirs(images)
+        for i in range(4):
+            # Noise does not compress, so every image is larger than 1K
+            Image.frombytes('RGB', (40, 40), os.urandom(40*40*3)).save(os.path.join(images, 'icon%d.png' % i))
+
+        # An image larger than the cap gets a shard module of its own
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'split_gfx', '--split', '1K'), 0)
+        files = sorted(os.listdir(os.path.join(self.tmpdir, 'split_gfx')))
+        self.assertEqual(files, ['__init__.py', '_shard0000.py', '_shard0001.py', '_shard0002.py', '_shard0003.py'])
+
+        package = self.importModule('split_gfx')
+        self.assertNotIn('split_gfx._shard0002', sys.modules)
+        self.assertEqual([ name for name in dir(package) if not name.startswith('_') ], ['icon%d_data' % i for i in range(4)])
+        self.assertEqual(package.icon2_data, imagedata.encode_image(os.path.join(images, 'icon2.png')))
+        self.assertIn('split_gfx._shard0002', sys.modules)
+        self.assertNotIn('split_gfx._shard0003', sys.modules)
+
+        self.assertEqual(self.build('--input', images, '--append', 'split_gfx', '--split', '1K'), 10)
+
+    def test_005_layout_package_tree(self):
+        images = os.path.join(self.tmpdir, 'images')
+        os.makedirs(os.path.join(images, 'toolbar'))
+        os.makedirs(os.path.join(images, 'menu'))
+        save = self.makeImage(os.path.join('images', 'toolbar', 'save.png'))
+        self.makeImage(os.path.join('images', 'menu', 'save.png'), color='blue')
+        self.makeImage(os.path.join('images', 'top.gif'))
+        # Would be the package toolbar.save, which is the image module of save.png
+        os.makedirs(os.path.join(images, 'toolbar', 'save'))
+        self.makeImage(os.path.join('images', 'toolbar', 'save', 'extra.png'))
+
+        self.assertEqual(self.build('--input', images, '--recursive', '--code', self.tmpdir, '--module', 'tree_gfx', '--layout', 'image'), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'tree_gfx', 'toolbar', 'save')))
+
+        package = self.importModule('tree_gfx')
+        self.assertEqual([ name for name in dir(package.toolbar) if not name.startswith('_') ], ['save'])
+        self.assertNotIn('tree_gfx.menu', sys.modules)
+        self.assertEqual(package.toolbar.save.save_data, imagedata.encode_image(save))
+        self.assertNotEqual(package.menu.save.save_data, package.toolbar.save.save_data)
+        self.assertNotIn('tree_gfx.top', sys.modules)
+
+        # Rebuilding as a single module removes the package that would shadow it
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'tree_gfx'), 0)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'tree_gfx')))
+
+    def test_006_atlas_pack(self):
+        sizes = dict(('r%d' % i, (5 + i % 7 * 3, 4 + i % 5 * 6)) for i in range(60))
+        sizes['big'] = (90, 20)
+        (atlases, placements) = atlas.pack(sizes, size=64)
+
+        self.assertEqual(atlases[placements['big'][0]], (90, 20))
+        for (name, (index, x, y, w, h)) in placements.items():
+            self.assertEqual((w, h), sizes[name])
+            self.assertLessEqual(x + w, atlases[index][0])
+            self.assertLessEqual(y + h, atlases[index][1])
+            for (other, (index2, x2, y2, w2, h2)) in placements.items():
+                if other != name and index2 == index:
+                    self.assertTrue(x + w <= x2 or x2 + w2 <= x or y + h <= y2 or y2 + h2 <= y, (name, other))
+
+    def test_007_atlas_module(self):
+        images = os.path.join(self.tmpdir, 'images')
+        os.makedirs(images)
+        for (i, (color, mode)) in enumerate([('red', 'RGBA'), ('green', 'RGB'), ('blue', 'L')]):
+            self.makeImage(os.path.join('images', 'icon%d.png' % i), size=(10 + i, 8), color=color, mode=mode)
+        Image.new('RGB', (6, 6), 'yellow').convert('P').save(os.path.join(images, 'icon3.png'))
+
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'atlas_gfx', '--atlas', '32'), 0)
+
+        module = self.importModule('atlas_gfx')
+        self.assertEqual(len(module.ATLASES), 1)
+        self.assertEqual(sorted(module.ATLAS_INDEX), ['icon0', 'icon1', 'icon2', 'icon3'])
+        for i in range(3):
+            original = Image.open(os.path.join(images, 'icon%d.png' % i))
+            image = module.get_image('icon%d' % i)
+            self.assertEqual((image.mode, image.tobytes()), (original.mode, original.tobytes()))
+
+        original = Image.open(os.path.join(images, 'icon3.png'))
+        image = module.get_image('icon3')
+        self.assertEqual(image.mode, 'P')
+        self.assertEqual(image.convert('RGB').tobytes(), original.convert('RGB').tobytes())
+
+    def test_008_variants(self):
+        images = os.path.join(self.tmpdir, 'images')
+        cache = os.path.join(self.tmpdir, 'cache')
+        os.makedirs(images)
+        self.makeImage(os.path.join('images', 'icon.png'), size=(40, 20))
+        argv = ['--input', images, '--code', self.tmpdir, '--module', 'variant_gfx',
+                '--variant', '1x=10', '--variant', 'thumb=16x16', '--variant-cache', cache]
+
+        self.assertEqual(self.build(*argv), 0)
+        cached = [ os.path.join(d, f) for (d, dirs, files) in os.walk(cache) for f in files ]
+        self.assertEqual(len(cached), 2)
+        stamps = [ os.stat(path).st_mtime_ns for path in cached ]
+
+        # An unchanged image file is not resized again
+        self.assertEqual(self.build(*argv), 0)
+        self.assertEqual([ os.stat(path).st_mtime_ns for path in cached ], stamps)
+
+        module = self.importModule('variant_gfx')
+        self.assertEqual([ (w, h) for (w, h, data) in module.VARIANTS['icon'] ], [(10, 5), (16, 8), (40, 20)])
+        self.assertEqual(Image.open(BytesIO(module.icon_thumb_data)).size, (16, 8))
+        self.assertIs(module.get_variant('icon', 14), module.icon_thumb_data)
+        self.assertIs(module.get_variant('icon', 100), module.icon_data)
+
+        # A real image named like a variant of another one
+        thumb = self.makeImage(os.path.join('images', 'icon_thumb.png'), size=(4, 4))
+        self.assertEqual(self.build(*argv), 5)
+        self.assertEqual(self.build(*argv + ['--module', 'fixed_gfx', '--fixident', 'img_']), 0)
+        module = self.importModule('fixed_gfx')
+        self.assertEqual(module.img_icon_thumb_data, imagedata.encode_image(thumb))
+        self.assertEqual(Image.open(BytesIO(module.icon_thumb_data)).size, (16, 8))
+
+    def test_009_codecs(self):
+        img = Image.frombytes('RGB', (32, 32), os.urandom(32*32*3)).convert('RGBA')
+        for name in ('png', 'webp-lossless', 'raw'):
+            if imagecodecs.get_codec(name).available():
+                data = imagecodecs.get_codec(name).encode(img)
+                self.assertEqual(imagecodecs.psnr(img, imagecodecs.decode_image(data, name)), float('inf'))
+
+        # Noise only survives lossless codecs; with no PSNR floor a lossy one wins
+        (codec, data) = imagecodecs.encode_with_codec(img, imagecodecs.AUTO)
+        self.assertIn(codec, ('png', 'webp-lossless', 'gif'))
+        (codec, data) = imagecodecs.encode_with_codec(img, imagecodecs.AUTO, min_psnr=0)
+        self.assertIn(codec, ('webp', 'jpeg'))
+
+        self.assertRaises(imagecodecs.UnknownCodecError, imagecodecs.get_codec, 'bmp')
+
+        # A candidate that cannot store the image's mode is skipped, PNG converts it
+        imagecodecs.register_codec(imagecodecs.Codec('bmp', 'BMP'))
+        self.addCleanup(imagecodecs._codecs.pop, 'bmp')
+        cmyk = Image.new('CMYK', (8, 8), (0, 255, 0, 0))
+        (codec, data) = imagecodecs.encode_with_codec(cmyk, imagecodecs.AUTO, candidates=('bmp', 'png'))
+        self.assertEqual(codec, 'png')
+        self.assertEqual(imagecodecs.decode_image(data).getpixel((0, 0)), cmyk.convert('RGBA').getpixel((0, 0)))
+        for mode in ('PA', 'F', 'YCbCr', 'HSV'):
+            (codec, data) = imagecodecs.encode_with_codec(Image.new(mode, (8, 8)), imagecodecs.AUTO, candidates=('bmp',))
+            self.assertEqual(codec, 'png')
+
+        path = self.makeImage('icon.png')
+        with imagedata.Generator(os.path.join(self.tmpdir, 'module.py')) as gen:
+            self.assertEqual(gen.write(path, codec='raw'), 'raw')
+
+    def test_010_frames(self):
+        images = os.path.join(self.tmpdir, 'images')
+        os.makedirs(images)
+        frames = [ Image.new('RGB', (12, 12), color) for color in ['red', 'blue', 'green', 'blue'] ]
+        frames[0].save(os.path.join(images, 'anim.gif'), save_all=True, append_images=frames[1:], duration=[100, 50, 70, 30])
+
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'split_frames', '--frames', 'split'), 0)
+        module = self.importModule('split_frames')
+        self.assertEqual([ frame[1:3] for frame in module.FRAMES['anim'] ], [(0, 100), (100, 50), (150, 70), (220, 30)])
+        self.assertIs(module.FRAMES['anim'][0][0], module.anim_data)
+        # The second blue frame shares the image data of the first
+        self.assertIs(module.FRAMES['anim'][3][0], module.FRAMES['anim'][1][0])
+        self.assertFalse(hasattr(module, 'anim_frame3_data'))
+
+        # The first frame is the image data whatever its codec
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'jpeg_frames', '--frames', 'split',
+                                    '--codec', 'jpeg'), 0)
+        module = self.importModule('jpeg_frames')
+        self.assertIs(module.FRAMES['anim'][0][0], module.anim_data)
+        self.assertFalse(hasattr(module, 'anim_frame0_data'))
+        self.assertEqual(Image.open(BytesIO(module.anim_data)).format, 'JPEG')
+
+        # A real image named like a frame of another one
+        self.makeImage(os.path.join('images', 'anim_frame1.png'))
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'clash_frames', '--frames', 'split'), 5)
+
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'apng_frames', '--frames', 'apng'), 0)
+        module = self.importModule('apng_frames')
+        apng = Image.open(BytesIO(module.anim_data))
+        self.assertEqual((apng.format, apng.n_frames), ('PNG', 4))
+        self.assertEqual(module.FRAMES['anim'][2], (None, 150, 70, 12, 12))
+
+    def test_011_reduce_huge_images(self):
+        src = Image.linear_gradient('L').resize((400, 300)).convert('RGB')
+        for name in ('big.bmp', 'big.ppm', 'big.jpg'):
+            path = os.path.join(self.tmpdir, name)
+            src.save(path)
+            img = Image.open(path)
+            self.assertEqual(imagereduce.reduce_image(img, (400, 400)), img)
+
+        # Uncompressed images are reduced a few rows at a time
+        strip_bytes = imagereduce.STRIP_BYTES
+        imagereduce.STRIP_BYTES = 400*3*16
+        self.addCleanup(setattr, imagereduce, 'STRIP_BYTES', strip_bytes)
+        for name in ('big.bmp', 'big.ppm'):
+            reduced = imagereduce.reduce_image(Image.open(os.path.join(self.tmpdir, name)), (100, 100), max_pixels=400*16)
+            self.assertEqual(reduced.size, (100, 75))
+            self.assertEqual(reduced.tobytes(), src.reduce(4).tobytes())
+
+        # A JPEG image is decoded at a reduced scale
+        img = Image.open(os.path.join(self.tmpdir, 'big.jpg'))
+        self.assertEqual(imagereduce.reduce_image(img, (50, 50), max_pixels=50*38).size, (50, 37))
+
+        img = Image.open(os.path.join(self.tmpdir, 'big.jpg'))
+        self.assertRaises(imagereduce.ImageTooLargeError, imagereduce.reduce_image, img, None, 1000)
+
+        with imagedata.Generator(os.path.join(self.tmpdir, 'module.py')) as gen:
+            gen.write(os.path.join(self.tmpdir, 'big.bmp'), max_size=(40, 40))
+        self.assertEqual(Image.open(BytesIO(self.importModule('module').big_data)).size, (40, 30))
+
+        # Palette, bilevel and 16 bit images are reduced in a mode reduce() averages
+        for (mode, reduced_mode) in (('P', 'RGB'), ('1', 'L'), ('I;16', 'I;16')):
+            path = os.path.join(self.tmpdir, 'big.png')
+            src.convert(mode).save(path)
+            (image_data, meta_data) = workers.encodeImage(path, max_size=(50, 50))
+            self.assertEqual((meta_data['Width'], meta_data['Height']), (50, 37))
+            self.assertEqual(imagereduce.reduce_image(Image.open(path), (50, 50)).mode, reduced_mode)
+
+    def test_012_failing_images(self):
+        images = os.path.join(self.tmpdir, 'images')
+        os.mkdir(images)
+        self.makeImage(os.path.join('images', 'good.png'), (8, 8), 'red')
+        with open(os.path.join(images, 'broken.png'), 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n' + b'truncated')
+
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'stopped'), 11)
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'stopped.py')))
+
+        # The broken image is left out, in an isolated worker process too
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'kept',
+                                    '--keep-going', '--timeout', '60'), 11)
+        module = self.importModule('kept')
+        self.assertTrue(hasattr(module, 'good_data'))
+        self.assertFalse(hasattr(module, 'broken_data'))
+
+        # A hung worker is killed with its pool, which fails the work it had not finished
+        pool = workers.getPool(1, isolate=True)
+        self.addCleanup(workers.killPool, 1)
+        worker = pool.submit(os.getpid).result()
+        hung = pool.submit(time.sleep, 60)
+        workers.killPool(1)
+        self.assertIsInstance(hung.exception(timeout=10), BrokenProcessPool)
+        self.assertNotIn(worker, [ process.pid for process in multiprocessing.active_children() ])
+
+    def test_013_sniff_image_formats(self):
+        images = os.path.join(self.tmpdir, 'images')
+        os.mkdir(images)
+        self.makeImage(os.path.join('images', 'upper.PNG'))
+        self.makeImage(os.path.join('images', 'icon.tga'))
+        Image.new('RGB', (8, 6)).save(os.path.join(images, 'misnamed.jpg'), 'PNG')
+        Image.new('RGB', (8, 6)).save(os.path.join(images, 'noext'), 'GIF')
+        with open(os.path.join(images, 'notes.png'), 'w') as f:
+            f.write('not an image')
+
+        files = sorted((name, os.path.join(images, name)) for name in os.listdir(images))
+        formats = dict((relpath, format) for (relpath, path, format) in sniffer.sniffFiles(files))
+        self.assertEqual(formats, {'upper.PNG': 'PNG', 'icon.tga': 'TGA', 'misnamed.jpg': 'PNG', 'noext': 'GIF', 'notes.png': None})
+        self.assertEqual(sniffer.imageType('PNG', '.jpg'), '.png')
+
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'sniffed'), 0)
+        module = self.importModule('sniffed')
+        for name in ('upper', 'icon', 'misnamed', 'noext'):
+            self.assertTrue(hasattr(module, name + '_data'))
+        self.assertFalse(hasattr(module, 'notes_data'))
+
+    def test_014_archive_inputs(self):
+        red = self.makeImage('red.png', color='red')
+        blue = self.makeImage('blue.gif', color='blue')
+        with zipfile.ZipFile(os.path.join(self.tmpdir, 'assets.zip'), 'w') as archive:
+            archive.write(red, 'icons/red.png')
+            archive.write(blue, 'top.gif')
+            archive.writestr('icons/notes.txt', 'not an image')
+        with tarfile.open(os.path.join(self.tmpdir, 'assets.tar.gz'), 'w:gz') as archive:
+            archive.add(red, './icons/red.png')
+            archive.add(blue, 'top.gif')
+
+        finder = discovery.Discovery()
+        found = [ relpath for (relpath, path) in finder.scan([os.path.join(self.tmpdir, 'assets.zip')]) ]
+        self.assertEqual(found, ['top.gif'])
+
+        for (name, module) in (('assets.zip', 'archive_zip'), ('assets.tar.gz', 'archive_tar')):
+            self.assertEqual(self.build('--input', os.path.join(self.tmpdir, name), '--recursive',
+                                        '--code', self.tmpdir, '--module', module, '--layout', 'directory'), 0)
+            package = self.importModule(module)
+            self.assertEqual(package.icons.red_data, imagedata.encode_image(red))
+            self.assertEqual(package.top_data, imagedata.encode_image(blue))
+
+    def test_015_stdin_file_list_stdout_module(self):
+        red = self.makeImage('red.png', color='red')
+        blue = self.makeImage('blue.gif', color='blue')
+        gone = os.path.join(self.tmpdir, 'gone.png')
+
+        for sep in (b'\n', b'\0'):
+            stdin = BytesIO(sep.join(os.fsencode(path) for path in (red, gone, blue)) + sep)
+            finder = discovery.Discovery(stdin=stdin)
+            self.assertEqual([ relpath for (relpath, path) in finder.scan(['-']) ], ['red.png', 'blue.gif'])
+
+        result = subprocess.run([sys.executable, IMMCLI_PATH, '--input', '-', '--code', '-', '--module', 'piped', '--quiet'],
+                                input=os.fsencode(red + '\n' + blue + '\n'), stdout=subprocess.PIPE, check=True)
+        with open(os.path.join(self.tmpdir, 'piped.py'), 'wb') as f:
+            f.write(result.stdout)
+        module = self.importModule('piped')
+        self.assertEqual(module.red_data, imagedata.encode_image(red))
+        self.assertEqual(module.blue_data, imagedata.encode_image(blue))
+
+    def test_016_depfile(self):
+        self.assertEqual(depfile.formatDepfile(['out.py'], ['my icons/a$b#1.png']), 'out.py: my\\ icons/a$$b\\#1.png\n')
+
+        images = os.path.join(self.tmpdir, 'images')
+        os.mkdir(images)
+        red = self.makeImage(os.path.join('images', 'red.png'))
+        blue = self.makeImage(os.path.join('images', 'blue.png'))
+        with open(os.path.join(images, 'notes.txt'), 'w') as f:
+            f.write('not an image')
+
+        deps = os.path.join(self.tmpdir, 'deps.d')
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'deps', '--depfile', deps), 0)
+        with open(deps) as f:
+            (targets, dependencies) = f.read().replace('\\\n', '').split(':')
+        self.assertEqual(targets.split(), [os.path.join(self.tmpdir, 'deps.py')])
+        self.assertEqual(dependencies.split(), [blue, red, images])
+
+        # An image file added to a scanned directory makes the build out of date
+        old = 10**18
+        for path in targets.split() + dependencies.split():
+            os.utime(path, ns=(old, old))
+        self.makeImage(os.path.join('images', 'green.png'), color='green')
+        self.assertTrue(any(os.stat(dep).st_mtime_ns > old for dep in dependencies.split()))
+
+        self.assertEqual(depfile.dependencies(['a.png'], ['gfx', 'out'], 'gfx.ini', written=['out']), ['a.png', 'gfx', 'gfx.ini'])
+
+    def test_017_config_targets(self):
+        os.mkdir(os.path.join(self.tmpdir, 'common'))
+        os.mkdir(os.path.join(self.tmpdir, 'icons'))
+        shared = self.makeImage(os.path.join('common', 'shared.png'), color='green')
+        self.makeImage(os.path.join('icons', 'save.png'))
+
+        ini = os.path.join(self.tmpdir, 'gfx.ini')
+        with open(ini, 'w') as f:
+            f.write('[DEFAULT]\ncode = out\n\n[icons]\ninput = icons\n    common\n\n'
+                    '[common]\ninput = common\nmodule = common_gfx\nmain = yes\n')
+        self.assertEqual(self.build('--config', ini), 0)
+
+        out = os.path.join(self.tmpdir, 'out')
+        self.assertEqual(sorted(os.listdir(out)), ['common_gfx.py', 'icons.py'])
+        sys.path.insert(0, out)
+        self.addCleanup(sys.path.remove, out)
+        self.addCleanup(lambda: [ sys.modules.pop(name, None) for name in ('icons', 'common_gfx') ])
+        self.assertEqual(importlib.import_module('icons').shared_data, imagedata.encode_image(shared))
+        self.assertEqual(importlib.import_module('common_gfx').shared_data, imagedata.encode_image(shared))
+
+        with open(ini, 'a') as f:
+            f.write('[bad]\nwatch = 1\n')
+        self.assertEqual(self.build('--config', ini), 12)
+
+    def test_018_shard_and_merge(self):
+        images = os.path.join(self.tmpdir, 'images')
+        os.mkdir(images)
+        colors = ('red', 'green', 'blue', 'yellow', 'white', 'black')
+        for color in colors:
+            self.makeImage(os.path.join('images', color + '.png'), color=color)
+        self.assertEqual(shards.shardOf(('red',), 3), shards.shardOf(('red',), 3))
+
+        # Every shard is built by a process of its own, as on separate machines
+        for shard in ('1/3', '2/3', '3/3'):
+            subprocess.run([sys.executable, IMMCLI_PATH, '--input', images, '--code', self.tmpdir, '--module', 'gfx',
+                            '--shard', shard, '--quiet'], check=True)
+        partials = [ shards.partialPath(self.tmpdir, 'gfx', (i, 3)) for i in (3, 1, 2) ]
+
+        merged = os.path.join(self.tmpdir, 'merged')
+        self.assertEqual(self.build('--code', merged, '--module', 'gfx', *[ '--merge=' + path for path in partials ]), 0)
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'gfx'), 0)
+        with open(os.path.join(merged, 'gfx.py')) as f, open(os.path.join(self.tmpdir, 'gfx.py')) as g:
+            strip = lambda lines: [ line for line in lines if not line.startswith('#        On:') ]
+            self.assertEqual(strip(f), strip(g))
+
+        self.assertEqual(self.build('--code', merged, '--module', 'gfx', '--merge', partials[0]), 13)
+
+    def test_019_extra_outputs(self):
+        images = os.path.join(self.tmpdir, 'images')
+        os.mkdir(images)
+        self.makeImage(os.path.join('images', 'red.png'), size=(20, 10), color='red')
+        self.makeImage(os.path.join('images', 'blue.png'), size=(8, 8), color='blue')
+
+        css = os.path.join(self.tmpdir, 'gfx.css')
+        sheet = os.path.join(self.tmpdir, 'sheet.png')
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'gfx', '--metadata',
+                                    '--css', css, '--contact-sheet', sheet, '--contact-size', '10'), 0)
+
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'image_meta_data.py')))
+        with open(css) as f:
+            rules = f.read()
+        self.assertIn('.red {\n    width: 20px;\n    height: 10px;\n    background-image: url(data:image/png;base64,', rules)
+        self.assertIn('.blue {', rules)
+        with Image.open(sheet) as img:
+            self.assertEqual(img.size, (2 * (10 + outputs.CONTACT_PADDING) + outputs.CONTACT_PADDING,
+                                        10 + 2 * outputs.CONTACT_PADDING))
+
+    def test_020_generator_shared_by_threads(self):
+        paths = [ self.makeImage('image%02d.png' % i, size=(8 + i, 6), color=(i * 8, 0, 0)) for i in range(32) ]
+
+        with imagedata.Generator(os.path.join(self.tmpdir, 'threaded.py')) as gen:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                self.assertEqual(set(executor.map(gen.write, paths)), {'png'})
+
+        module = self.importModule('threaded')
+        for (i, path) in enumerate(paths):
+            self.assertEqual(getattr(module, 'image%02d_data' % i), imagedata.encode_image(path))
+
+    @unittest.skipIf(imagedata.fcntl is None, 'appending is only locked where fcntl is available')
+    def test_021_append_from_processes(self):
+        module_path = os.path.join(self.tmpdir, 'shared.py')
+        with imagedata.Generator(module_path) as gen:
+            gen.write_data(b'first', 'first')
+
+        # A writer crashed part way through its entry
+        with open(module_path + imagedata.JOURNAL_SUFFIX, 'w') as f:
+            f.write('%d' % os.path.getsize(module_path))
+        with open(module_path, 'ab') as f:
+            f.write(b"crashed_data = b'\\x89PN")
+
+        with ProcessPoolExecutor(max_workers=4) as executor:
+            list(executor.map(appendEntries, [module_path] * 4, range(4)))
+
+        self.assertFalse(os.path.exists(module_path + imagedata.JOURNAL_SUFFIX))
+        module = self.importModule('shared')
+        self.assertEqual(module.first_data, b'first')
+        for writer in range(4):
+            for entry in range(25):
+                self.assertEqual(getattr(module, 'w%d_%d_data' % (writer, entry)), b'%d' % entry * 100)
+
+    def test_022_columnar_meta_data(self):
+        images = os.path.join(self.tmpdir, 'images')
+        os.mkdir(images)
+        frames = [ Image.new('RGB', (6, 6), color) for color in ['red', 'blue', 'green'] ]
+        frames[0].save(os.path.join(images, 'anim.gif'), save_all=True, append_images=frames[1:], duration=100)
+        self.makeImage(os.path.join('images', 'wide.png'), size=(12, 4))
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'gfx', '--metadata',
+                                    '--frames', 'split'), 0)
+
+        meta = self.importModule('image_meta_data')
+        self.assertEqual(list(meta.IMG_META_DATA), ['anim', 'wide'])
+        self.assertEqual(dict(meta.IMG_META_DATA['anim']), {
+            'FilePath' : os.path.join(images, 'anim.gif'), 'ImgType' : '.gif', 'Width' : 6, 'Height' : 6,
+            'Codec' : 'png', 'Frames' : 3, 'largest_width' : 12, 'uniform_width' : False })
+        self.assertNotIn('Frames', meta.IMG_META_DATA['wide'])
+        self.assertEqual(meta.COLUMNS['Width'].typecode, 'L')
+
+        # The show module records where it placed each image
+        meta.IMG_META_DATA['wide']['row'] = 2
+        self.assertEqual(meta.IMG_META_DATA['wide']['row'], 2)
+
+    def test_023_image_stats(self):
+        half = Image.new('RGBA', (10, 4), (0, 0, 0, 0))
+        half.paste((250, 200, 0, 255), (0, 0, 5, 4))
+        self.assertEqual(imagestats.image_stats(half), {
+            'AverageColor' : (250, 200, 0), 'AlphaCoverage' : 0.5, 'BBox' : (0, 0, 5, 4), 'IsDark' : False })
+        self.assertTrue(imagestats.image_stats(Image.new('L', (3, 3), 20))['IsDark'])
+        self.assertEqual(imagestats.image_stats(Image.new('RGBA', (3, 3))), { 'AlphaCoverage' : 0.0 })
+
+        if imagestats.numpy is not None:
+            # Both ways of computing the statistics agree
+            numpy = imagestats.numpy
+            imagestats.numpy = None
+            self.addCleanup(setattr, imagestats, 'numpy', numpy)
+            self.assertEqual(imagestats.image_stats(half)['AverageColor'], (250, 200, 0))
+
+        images = os.path.join(self.tmpdir, 'images')
+        os.mkdir(images)
+        half.save(os.path.join(images, 'half.png'))
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'gfx', '--stats'), 0)
+        meta = self.importModule('image_meta_data')
+        self.assertEqual(meta.IMG_META_DATA['half']['BBox'], (0, 0, 5, 4))
+        self.assertEqual(meta.IMG_META_DATA['half']['AlphaCoverage'], 0.5)
+
+        # MODULE on stdout has no meta-data module to write the statistics to
+        self.assertEqual(self.build('--input', images, '--code', '-', '--module', 'gfx', '--stats'), 10)
+
+    @unittest.skipIf(not hasattr(socket, 'AF_UNIX'), 'the build daemon needs Unix domain sockets')
+    def test_024_build_daemon(self):
+        images = os.path.join(self.tmpdir, 'images')
+        os.mkdir(images)
+        red = self.makeImage(os.path.join('images', 'red.png'))
+
+        # A socket file left behind by a daemon that was killed
+        socket_path = os.path.join(self.tmpdir, 'immd.sock')
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(socket_path)
+
+        server = subprocess.Popen([sys.executable, IMMCLI_PATH, '--daemon', socket_path, '--quiet'])
+        self.addCleanup(server.wait)
+        self.addCleanup(server.terminate)
+        for attempt in range(100):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                if probe.connect_ex(socket_path) == 0:
+                    break
+            time.sleep(0.1)
+
+        out = StringIO()
+        err = StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            status = daemon.forward(socket_path, ['--input', 'images', '--module', 'icons', '--quiet'], cwd=self.tmpdir)
+        self.assertEqual(status, 0)
+        self.assertEqual(out.getvalue(), '')
+        self.assertEqual(err.getvalue(), '')
+        with open(os.path.join(self.tmpdir, 'icons.py')) as module:
+            self.assertIn('red', module.read())
+
+        out = StringIO()
+        err = StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            status = daemon.forward(socket_path, ['--input', 'missing', '--code', self.tmpdir], cwd=self.tmpdir)
+        self.assertEqual(status, 1)
+        self.assertEqual(out.getvalue(), '')
+        self.assertIn("'missing' that does not exist", err.getvalue())
+
+        # The daemon's stdin and stdout are not the client's
+        for argv in (['--input', images, '--code', '-'], ['--input', '-', '--code', self.tmpdir]):
+            out = StringIO()
+            err = StringIO()
+            with redirect_stdout(out), redirect_stderr(err):
+                status = daemon.forward(socket_path, argv, cwd=self.tmpdir)
+            self.assertEqual(status, daemon.DAEMON_ERROR)
+            self.assertEqual(out.getvalue(), '')
+            self.assertIn('cannot be forwarded', err.getvalue())
+
+        # A polite kill removes the socket file
+        server.terminate()
+        self.assertEqual(server.wait(), 0)
+        self.assertFalse(os.path.exists(socket_path))
+
+        # The daemon's requests share the images encoded, as long as their files exist
+        class LogSubSystem():
+            def Logger(self):
+                return logging.getLogger(__name__)
+            def SetConsoleStream(self, stream):
+                return None
+            def QuietConsoleLogger(self):
+                pass
+            def RestoreConsoleLogger(self):
+                pass
+        builds = list()
+        def build(args, cliparser, logSubSystem, argv, caches=None):
+            builds.append(caches)
+            immcli.build(args, cliparser, logSubSystem, argv, caches)
+        requests = daemon.BuildDaemon(socket_path, LogSubSystem(), build, immcli.__version__)
+        argv = ['--input', images, '--code', self.tmpdir, '--module', 'warm', '--quiet']
+        self.assertEqual(requests.runRequest(argv, self.tmpdir)['status'], 0)
+        self.assertEqual(requests.runRequest(argv, self.tmpdir)['status'], 0)
+        self.assertIs(builds[0], builds[1])
+        [ cache ] = builds[0].values()
+        self.assertIsNotNone(cache.lookup(red, pipeline.fileStamp(os.stat(red))))
+        os.remove(red)
+        self.assertEqual(requests.runRequest(argv, self.tmpdir)['status'], 6)
+        self.assertEqual(len(cache), 0)
+
+    def test_025_pipeline_order_and_abandon(self):
+        images = os.path.join(self.tmpdir, 'images')
+        os.mkdir(images)
+        paths = list()
+        for (n, side) in enumerate([300, 4, 200, 2]):
+            # Noise takes longer to encode the larger it is, so the workers finish out of order
+            paths.append(os.path.join(images, 'i%d.png' % n))
+            Image.frombytes('RGB', (side, side), os.urandom(side*side*3)).save(paths[-1])
+
+        class Recorder():
+            def __init__(self):
+                self.names = list()
+            def processImage(self, image_name, image_file_path, image_type, encoded, package):
+                self.names.append(image_name)
+
+        recorder = Recorder()
+        line = pipeline.Pipeline(logging.getLogger(__name__), recorder, jobs=2, depth=2)
+        self.assertEqual(line.run(('i%d' % n, path, '.png', ()) for (n, path) in enumerate(paths)), 4)
+        self.assertEqual(recorder.names, ['i0', 'i1', 'i2', 'i3'])
+
+        # A depth below the number of workers is honoured, below 1 refused
+        recorder = Recorder()
+        line = pipeline.Pipeline(logging.getLogger(__name__), recorder, jobs=2, depth=1)
+        self.assertEqual(line.run(('i%d' % n, path, '.png', ()) for (n, path) in enumerate(paths)), 4)
+        self.assertEqual(recorder.names, ['i0', 'i1', 'i2', 'i3'])
+        self.assertRaises(ValueError, pipeline.Pipeline, logging.getLogger(__name__), recorder, depth=0)
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'shallow', '--depth', '0'), 10)
+
+        with open(paths[2], 'wb') as f:
+            f.write(b'\x89PNG\r\n\x1a\n' + b'truncated')
+        recorder = Recorder()
+        line = pipeline.Pipeline(logging.getLogger(__name__), recorder, jobs=2, depth=2)
+        self.assertRaises(pipeline.ImageFailedError, line.run, (('i%d' % n, path, '.png', ()) for (n, path) in enumerate(paths)))
+        # Nothing after the image that failed is written
+        self.assertIn(recorder.names, ([], ['i0'], ['i0', 'i1']))
+
+        # A build that fails leaves the module of the last one that succeeded
+        os.remove(paths[2])
+        empty = os.path.join(self.tmpdir, 'empty')
+        os.mkdir(empty)
+        for layout in ('module', 'directory'):
+            self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'kept', '--layout', layout), 0)
+            module = os.path.join(self.tmpdir, 'kept.py' if layout == 'module' else os.path.join('kept', '__init__.py'))
+            with open(module, 'rb') as f:
+                built = f.read()
+
+            self.makeImage(os.path.join('images', 'bad name.png'))
+            self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'kept', '--layout', layout), 5)
+            os.remove(os.path.join(images, 'bad name.png'))
+            self.assertEqual(self.build('--input', empty, '--code', self.tmpdir, '--module', 'kept', '--layout', layout), 6)
+
+            with open(module, 'rb') as f:
+                self.assertEqual(f.read(), built)
+            self.assertEqual([ name for name in os.listdir(self.tmpdir) if name.startswith('.') ], [])
+
+    def test_026_watch_rebuilds_changed_images(self):
+        images = self.tmpdir
+        red = self.makeImage('red.png', color='red')
+        self.makeImage('blue.png', color='blue')
+
+        # MODULE and the outputs, an image too, are generated below the input root
+        builds = list()
+        immcli_generate = immcli.generate
+        def generate(args, logger, files, cache=None, partials=None, generated=None, finder=None):
+            files = list(files)
+            hits = [ relpath for (relpath, path) in files
+                     if cache.lookup(path, pipeline.fileStamp(os.stat(path))) is not None ]
+            builds.append(([ relpath for (relpath, path) in files ], hits))
+            return immcli_generate(args, logger, files, cache, partials, generated, finder)
+        immcli.generate = generate
+        self.addCleanup(setattr, immcli, 'generate', immcli_generate)
+
+        # Each poll is followed by the next step instead of a sleep
+        def changeRed():
+            Image.new('RGB', (8, 6), 'green').save(red)
+            os.utime(red, ns=(0, 0))
+        def addNotes():
+            with open(os.path.join(images, 'notes.txt'), 'w') as f:
+                f.write('not an image')
+        def stop():
+            raise KeyboardInterrupt
+        steps = iter([ lambda: None, changeRed, addNotes, stop ])
+        self.addCleanup(setattr, watcher, 'time', watcher.time)
+        watcher.time = type('Time', (), { 'perf_counter' : staticmethod(time.perf_counter),
+                                          'sleep' : staticmethod(lambda seconds: next(steps)()) })
+
+        self.assertEqual(self.build('--input', images, '--code', images, '--module', 'gfx', '--watch', '60',
+                                    '--css', os.path.join(images, 'gfx.css'), '--contact-sheet', os.path.join(images, 'sheet.png')), 0)
+
+        self.assertEqual(builds, [ (['blue.png', 'red.png'], []), (['blue.png', 'red.png'], ['blue.png']) ])
+        self.assertEqual(self.importModule('gfx').red_data, imagedata.encode_image(red))
+
+    def test_027_plan(self):
+        images = os.path.join(self.tmpdir, 'images')
+        os.mkdir(images)
+        red = self.makeImage(os.path.join('images', 'red.png'), size=(20, 10))
+        self.makeImage(os.path.join('images', 'blue.jpg'), size=(1000, 1000))
+        with open(os.path.join(images, 'notes.txt'), 'w') as f:
+            f.write('not an image')
+
+        out = StringIO()
+        with redirect_stdout(out):
+            self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'gfx', '--plan'), 0)
+        plan = json.loads(out.getvalue())
+        self.assertEqual([ (image['name'], image['Width'], image['Height']) for image in plan['images'] ],
+                         [('blue', 1000, 1000), ('red', 20, 10)])
+        self.assertEqual(plan['ignored'], ['notes.txt'])
+        self.assertEqual(plan['estimate']['megapixels'], 1.0)
+        # Nothing is generated
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['images'])
+
+        self.makeImage(os.path.join('images', 'bad name.png'))
+        path = os.path.join(self.tmpdir, 'plan.json')
+        self.assertEqual(self.build('--input', images, '--plan', path), 5)
+        with open(path) as f:
+            self.assertEqual(json.load(f)['illegal'], ['bad name'])
+
+        # A file removed while the plan is made is reported, not fatal
+        os.remove(red)
+        self.assertIn('Error', planner.readHeader(red))
+
+    def test_028_max_size_skips_bomb_check(self):
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = 100*75
+        self.addCleanup(setattr, Image, 'MAX_IMAGE_PIXELS', limit)
+
+        images = os.path.join(self.tmpdir, 'images')
+        os.mkdir(images)
+        Image.linear_gradient('L').resize((400, 300)).save(os.path.join(images, 'poster.bmp'))
+        Image.linear_gradient('L').resize((400, 300)).save(os.path.join(images, 'poster2.png'))
+
+        self.assertNotEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'bombs'), 0)
+
+        # --max-size alone reduces the images, only while they are opened is the check off
+        self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'posters', '--max-size', '40'), 0)
+        self.assertEqual(Image.MAX_IMAGE_PIXELS, 100*75)
+
+        # Frames are never reduced, so they cannot be asked for with a reduced size
+        for option in ('--max-size', '--max-pixels'):
+            self.assertEqual(self.build('--input', images, '--code', self.tmpdir, '--module', 'frames',
+                                        '--frames', 'split', option, '40'), 10)
+        module = self.importModule('posters')
+        self.assertEqual(Image.open(BytesIO(module.poster_data)).size, (40, 30))
+        self.assertEqual(Image.open(BytesIO(module.poster2_data)).size, (40, 30))
+        self.assertRaises(Image.DecompressionBombError, Image.open, os.path.join(images, 'poster.bmp'))
+
+        # Only the image opened for reducing skips the check, Pillow's limit is left alone
+        with open(os.path.join(images, 'poster2.png'), 'rb') as f:
+            self.assertEqual(imagereduce.open_image(BytesIO(f.read()), huge=True).size, (400, 300))
+        self.assertEqual(imagereduce.open_image(os.path.join(images, 'poster.bmp'), huge=True).format, 'BMP')
+        self.assertRaises(Image.UnidentifiedImageError, imagereduce.open_image, IMMCLI_PATH, huge=True)
+
+    def test_029_archive_rescans(self):
+        red = self.makeImage('red.png', color='red')
+        blue = self.makeImage('blue.gif', color='blue')
+        path = os.path.join(self.tmpdir, 'assets.zip')
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.write(red, 'top.png')
+
+        finder = discovery.Discovery()
+        [ (relpath, member) ] = finder.scan([path])
+        with open(red, 'rb') as f:
+            red_bytes = f.read()
+        with open(blue, 'rb') as f:
+            blue_bytes = f.read()
+        with archives.openFile(member) as f:
+            self.assertEqual(f.read(), red_bytes)
+
+        # The zip archive changed since this thread last read its central directory
+        with zipfile.ZipFile(path, 'w') as archive:
+            archive.write(blue, 'top.png')
+            archive.write(red, 'other.png')
+        found = dict(finder.scan([path]))
+        self.assertEqual(sorted(found), ['other.png', 'top.png'])
+        with archives.openFile(found['top.png']) as f:
+            self.assertEqual(f.read(), blue_bytes)
+
+        # Listing a tar archive gives the stamps of its members, not their bytes
+        path = os.path.join(self.tmpdir, 'assets.tar')
+        with tarfile.open(path, 'w') as archive:
+            archive.add(red, 'top.png')
+            archive.add(blue, 'icons/blue.gif')
+        listed = list(archives.scanArchive(path, data=False))
+        scanned = list(archives.scanArchive(path))
+        self.assertEqual(listed, scanned)
+        self.assertEqual([ member.stamp for (relpath, member) in listed ], [ member.stamp for (relpath, member) in scanned ])
+        self.assertEqual([ member.data for (relpath, member) in listed ], [None, None])
+        self.assertEqual(scanned[0][1].data, red_bytes)
+
 
 if __name__ == '__main__':
-    import sys
     sys.exit(unittest.main())